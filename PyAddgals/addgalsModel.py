@@ -15,10 +15,90 @@ from .galaxyModel import GalaxyModel
 from .colorModel import ColorModel
 from . import luminosityFunction
 from . import shape
+from .trace import span
+
+
+def rsdRedshift(z, pos, vel):
+    """Redshift including the line of sight velocity.
+
+    Parameters
+    ----------
+    z : np.array
+        Cosmological redshifts of dimension (N)
+    pos : np.array
+        Positions of dimension (N, 3)
+    vel : np.array
+        Velocities in km/s of dimension (N, 3)
+
+    Returns
+    -------
+    z_rsd : np.array
+        Redshifts of dimension (N)
+    """
+
+    return z + np.sum(pos * vel, axis=1) / \
+        np.sqrt(np.sum(pos**2, axis=1)) / 299792.458
+
+
+# Search statistics of the assignment kernels. For each search phase,
+# a histogram of the number of candidates scanned per galaxy or halo,
+# in bins of the bit length of the count (0, 1, 2-3, 4-7, ...), followed
+# by the total number scanned in that phase. Phase 0 is the fiducial
+# search, 1 the first fallback with a wider window, and 2 the last
+# resort search of assign, which takes any unassigned particle.
+n_search_phases = 3
+n_search_bins = 40
+
+
+def makeSearchStats():
+    """Make an empty array of search statistics, to pass to the
+    assignment kernels.
+    """
+
+    return np.zeros((n_search_phases, n_search_bins + 1), dtype=np.int64)
+
+
+def summarizeSearchStats(stats):
+    """Convert search statistics to a dict for trace records.
+
+    Parameters
+    ----------
+    stats : np.array
+        Search statistics filled by an assignment kernel
+
+    Returns
+    -------
+    summary : dict
+        search_hist, the scan length histogram of each phase, search_n,
+        the number of galaxies or halos reaching each phase, and
+        search_steps, the total number of candidates scanned in each phase
+    """
+
+    hist = stats[:, :-1]
+
+    # drop empty high bins
+    nz = np.where(hist.any(axis=0))[0]
+    nbins = nz[-1] + 1 if len(nz) > 0 else 0
+
+    return {'search_hist': hist[:, :nbins].tolist(),
+            'search_n': hist.sum(axis=1).tolist(),
+            'search_steps': stats[:, -1].tolist()}
+
+
+@jit(nopython=True)
+def _recordSearch(stats, phase, n):
+
+    b = 0
+    while ((n >> b) > 0) & (b < (stats.shape[1] - 2)):
+        b += 1
+
+    stats[phase, b] += 1
+    stats[phase, -1] += n
 
 
 @jit(nopython=True)
-def assign(magnitude, redshift, density, z_part, density_part, dz=0.01):
+def assign(magnitude, redshift, density, z_part, density_part, dz=0.01,
+           stats=None):
 
     n_gal = magnitude.size
     n_part = density_part.size
@@ -70,10 +150,15 @@ def assign(magnitude, redshift, density, z_part, density_part, dz=0.01):
 
             pi += 1
 
+        # counting is compiled out when stats is None
+        if stats is not None:
+            _recordSearch(stats, 0, pi)
+
         max_search_count = n_part
 
         if not assigned:
             bad[i] = True
+            pi0 = pi
             while (not assigned) & (pi < max_search_count):
                 if (pidx - pi) >= 0:
                     if (nassigned[pidx - pi] & (minz < z_part[pidx - pi]) &
@@ -91,6 +176,9 @@ def assign(magnitude, redshift, density, z_part, density_part, dz=0.01):
 
                 pi += 1
 
+            if stats is not None:
+                _recordSearch(stats, 1, pi - pi0)
+
         if not assigned:
             pi = 0
             while (not assigned) & (pi < max_search_count):
@@ -108,12 +196,15 @@ def assign(magnitude, redshift, density, z_part, density_part, dz=0.01):
 
                 pi += 1
 
+            if stats is not None:
+                _recordSearch(stats, 2, pi)
+
     return idx_part, bad
 
 
 @jit(nopython=True)
 def assignLcen(redshift, magnitude, density, mass_halo, density_halo, z_halo,
-               params, scatter, dMr=0.015, dz=0.02):
+               params, scatter, dMr=0.015, dz=0.02, stats=None):
 
     n_halo = z_halo.size
     n_gal = redshift.size
@@ -174,6 +265,10 @@ def assignLcen(redshift, magnitude, density, mass_halo, density_halo, z_halo,
 
             pi += 1
 
+        # counting is compiled out when stats is None
+        if stats is not None:
+            _recordSearch(stats, 0, pi)
+
         # if not assigned with fiducial magniude window, make larger
         if not halo_assigned:
             bad[i] = True
@@ -210,12 +305,15 @@ def assignLcen(redshift, magnitude, density, mass_halo, density_halo, z_halo,
 
                 pi += 1
 
+            if stats is not None:
+                _recordSearch(stats, 1, pi)
+
     return assigned, mr0, bad
 
 
 @jit(nopython=True)
 def assignLcenNodens(redshift, magnitude, density, mass_halo, density_halo, z_halo,
-                     params, scatter, dMr=0.015, dz=0.01):
+                     params, scatter, dMr=0.015, dz=0.01, stats=None):
 
     n_halo = z_halo.size
     n_gal = redshift.size
@@ -269,6 +367,10 @@ def assignLcenNodens(redshift, magnitude, density, mass_halo, density_halo, z_ha
 
             pi += 1
 
+        # counting is compiled out when stats is None
+        if stats is not None:
+            _recordSearch(stats, 0, pi)
+
         # if not assigned with fiducial magniude window, make larger
         if not halo_assigned:
             bad[i] = True
@@ -298,6 +400,9 @@ def assignLcenNodens(redshift, magnitude, density, mass_halo, density_halo, z_ha
 
                 pi += 1
 
+            if stats is not None:
+                _recordSearch(stats, 1, pi)
+
     return assigned, mr0, bad
 
 
@@ -310,7 +415,8 @@ class ADDGALSModel(GalaxyModel):
                  use_dens=True,
                  dMr=0.01,
                  dz=0.02,
-                 delete_after_assignment=True):
+                 delete_after_assignment=True,
+                 search_stats=False):
 
         self.nbody = nbody
 
@@ -338,6 +444,10 @@ class ADDGALSModel(GalaxyModel):
 
         self.dMr = dMr
         self.dz = dz
+        self.sigma5_neighbours = None
+
+        # count how far the assignment kernels search, for traces
+        self.search_stats = search_stats
 
         if shapeModelConfig is None:
             self.shapeModel = None
@@ -347,19 +457,34 @@ class ADDGALSModel(GalaxyModel):
             self.shapeModel = getattr(shape, shape_type)
             self.shapeModel = self.shapeModel(nbody.cosmo, **shapeModelConfig)
 
-    def paintGalaxies(self):
+    def paintGalaxies(self, between_stages=None):
         """Paint galaxy positions, luminosities and SEDs into nbody.
         Saves them in self.galaxyCatalog.catalog.
 
+        Parameters
+        ----------
+        between_stages : callable
+            Called with no arguments after each painting stage, e.g. to
+            release write locks held by finished background writes
+
         Returns
         -------
         None
         """
 
-        self.paintPositions()
+        with span('positions'):
+            self.paintPositions()
+
+        if between_stages is not None:
+            between_stages()
 
         if not self.colorModel.no_colors:
-            self.paintSEDs()
+            with span('seds'):
+                self.paintSEDs()
+
+            if between_stages is not None:
+                between_stages()
+
             self.paintShapes()
 
     def paintPositions(self):
@@ -380,23 +505,27 @@ class ADDGALSModel(GalaxyModel):
 
         print('[{}] : Domain has overdensity: {}'.format(self.nbody.domain.rank,
                                                          overdens))
-        z = self.luminosityFunction.drawRedshifts(domain, overdens)
-        z.sort()
+        with span('lf_draw') as sp:
+            z = self.luminosityFunction.drawRedshifts(domain, overdens)
+            z.sort()
 
-        if domain.fmt == 'Snapshot':
-            mag = self.luminosityFunction.sampleLuminositiesSnap(domain, z)
-        else:
-            mag = self.luminosityFunction.sampleLuminosities(domain, z)
+            if domain.fmt == 'Snapshot':
+                mag = self.luminosityFunction.sampleLuminositiesSnap(domain, z)
+            else:
+                mag = self.luminosityFunction.sampleLuminosities(domain, z)
+
+            sp.set(n_gal=len(z))
 
         zidx = z.argsort()
         z = z[zidx]
         mag = mag[zidx]
         del zidx
 
-        if domain.fmt == 'Snapshot':
-            density, mag = self.rdelModel.sampleDensitySnap(domain, mag)
-        else:
-            density, z, mag = self.rdelModel.sampleDensity(domain, z, mag)
+        with span('density_draw'):
+            if domain.fmt == 'Snapshot':
+                density, mag = self.rdelModel.sampleDensitySnap(domain, mag)
+            else:
+                density, z, mag = self.rdelModel.sampleDensity(domain, z, mag)
 
         end = time()
 
@@ -419,7 +548,9 @@ class ADDGALSModel(GalaxyModel):
             del idx
 
         start = time()
-        mag_cen, assigned, bad_cen = self.assignHalos(z, mag, density)
+        with span('centrals') as sp:
+            mag_cen, assigned, bad_cen = self.assignHalos(z, mag, density)
+            sp.set(n_halo=len(mag_cen))
         end = time()
 
         print('[{}] Finished assigning galaxies to halos. Took {}s'.format(
@@ -427,34 +558,79 @@ class ADDGALSModel(GalaxyModel):
         sys.stdout.flush()
 
         start = time()
-        pos, vel, z, density, mag, rhalo, halorad, haloid, halomass, bad = self.assignParticles(
-            z[~assigned], mag[~assigned], density[~assigned])
+        with span('particles') as sp:
+            pos, vel, z, density, mag, rhalo, halorad, haloid, halomass, bad = self.assignParticles(
+                z[~assigned], mag[~assigned], density[~assigned])
+            sp.set(n_sat=len(z))
         end = time()
 
         print('[{}] Finished assigning galaxies to particles. Took {}s'.format(
             self.nbody.domain.rank, end - start))
         sys.stdout.flush()
 
-        n_halo = mag_cen.size
-
-        pos = np.vstack([self.nbody.haloCatalog.catalog['pos'], pos])
-        print('velocity halo min, halo max, part min, part max: {}, {}, {}, {}'.format(np.min(self.nbody.haloCatalog.catalog['vel']),
-                                                                                       np.max(self.nbody.haloCatalog.catalog['vel']), np.min(vel), np.max(vel)))
-        vel = np.vstack([self.nbody.haloCatalog.catalog['vel'], vel])
-        z = np.hstack([self.nbody.haloCatalog.catalog['z'], z])
-        mag = np.hstack([mag_cen, mag])
-        density = np.hstack([self.nbody.haloCatalog.catalog['rnn'], density])
-        halomass = np.hstack(
-            [self.nbody.haloCatalog.catalog['mass'], halomass])
-        halorad = np.hstack(
-            [self.nbody.haloCatalog.catalog['radius'], halorad])
-        rhalo = np.hstack([np.zeros(n_halo), rhalo])
-        central = np.zeros(rhalo.size)
-        central[:n_halo] = 1
-        haloid = np.hstack([self.nbody.haloCatalog.catalog['id'], haloid])
-        z_rsd = z + np.sum(pos * vel, axis=1) / \
-            np.sqrt(np.sum(pos**2, axis=1)) / 299792.458
-        bad = np.hstack([bad_cen, bad])
+        halos = self.nbody.haloCatalog.catalog
+
+        print('velocity halo min, halo max, part min, part max: {}, {}, {}, {}'.format(np.min(halos['vel']),
+                                                                                       np.max(halos['vel']), np.min(vel), np.max(vel)))
+
+        # only galaxies in the core of a lightcone domain are written, so
+        # galaxies assigned to the redshift buffer are dropped now instead
+        # of being carried through the rest of painting. They were still
+        # drawn and assigned, so that assignment near the edges of the
+        # core is unchanged, and are kept for sigma5 and its ranking.
+        if domain.fmt == 'BCCLightcone':
+            hcore = domain.inCore(halos['pos'])
+            score = domain.inCore(pos)
+
+            self.sigma5_neighbours = (np.vstack([halos['pos'][~hcore], pos[~score]]),
+                                      np.hstack([mag_cen[~hcore], mag[~score]]),
+                                      np.hstack([rsdRedshift(halos['z'][~hcore],
+                                                             halos['pos'][~hcore],
+                                                             halos['vel'][~hcore]),
+                                                 rsdRedshift(z[~score], pos[~score],
+                                                             vel[~score])]))
+
+            print('[{}] Dropping {} of {} galaxies in the domain buffer'.format(
+                self.nbody.domain.rank, np.sum(~hcore) + np.sum(~score),
+                hcore.size + score.size))
+            sys.stdout.flush()
+        else:
+            hcore = np.ones(mag_cen.size, dtype=np.bool_)
+            score = np.ones(z.size, dtype=np.bool_)
+            self.sigma5_neighbours = None
+
+        n_halo = np.sum(hcore)
+
+        # centrals go first, followed by galaxies assigned to particles
+        galaxyCatalog = self.nbody.galaxyCatalog
+        galaxyCatalog.allocate(n_halo + np.sum(score), self.getColumns(),
+                               galaxyCatalog.getPlaceholderNames(galaxyCatalog.placeholders))
+        catalog = galaxyCatalog.catalog
+
+        gpos = galaxyCatalog.getPositions()
+        gvel = galaxyCatalog.getVelocities()
+        gpos[:n_halo] = halos['pos'][hcore]
+        gpos[n_halo:] = pos[score]
+        gvel[:n_halo] = halos['vel'][hcore]
+        gvel[n_halo:] = vel[score]
+
+        for k, cen, sat in [('Z_COS', halos['z'], z),
+                            ('MAG_R', mag_cen, mag),
+                            ('DIST8', halos['rnn'], density),
+                            ('M200', halos['mass'], halomass),
+                            ('R200', halos['radius'], halorad),
+                            ('HALOID', halos['id'], haloid),
+                            ('BAD_ASSIGN', bad_cen, bad)]:
+            catalog[k][:n_halo] = cen[hcore]
+            catalog[k][n_halo:] = sat[score]
+
+        catalog['RHALO'][n_halo:] = rhalo[score]
+        catalog['CENTRAL'][:n_halo] = 1
+
+        del pos, vel, z, mag, density, halomass, halorad, haloid, rhalo, bad
+        del hcore, score
+
+        catalog['Z'][:] = rsdRedshift(catalog['Z_COS'], gpos, gvel)
 
         # done with halo catalog now
         if self.delete_after_assignment:
@@ -462,22 +638,56 @@ class ADDGALSModel(GalaxyModel):
         else:
             pass
 
-        self.nbody.galaxyCatalog.catalog['PX'] = pos[:, 0]
-        self.nbody.galaxyCatalog.catalog['PY'] = pos[:, 1]
-        self.nbody.galaxyCatalog.catalog['PZ'] = pos[:, 2]
-        self.nbody.galaxyCatalog.catalog['VX'] = vel[:, 0]
-        self.nbody.galaxyCatalog.catalog['VY'] = vel[:, 1]
-        self.nbody.galaxyCatalog.catalog['VZ'] = vel[:, 2]
-        self.nbody.galaxyCatalog.catalog['Z_COS'] = z
-        self.nbody.galaxyCatalog.catalog['Z'] = z_rsd
-        self.nbody.galaxyCatalog.catalog['MAG_R'] = mag
-        self.nbody.galaxyCatalog.catalog['DIST8'] = density
-        self.nbody.galaxyCatalog.catalog['M200'] = halomass
-        self.nbody.galaxyCatalog.catalog['R200'] = halorad
-        self.nbody.galaxyCatalog.catalog['RHALO'] = rhalo
-        self.nbody.galaxyCatalog.catalog['HALOID'] = haloid
-        self.nbody.galaxyCatalog.catalog['CENTRAL'] = central
-        self.nbody.galaxyCatalog.catalog['BAD_ASSIGN'] = bad
+    def getColumns(self):
+        """Get the columns painted by this model, so that the galaxy
+        catalog can be allocated once the number of galaxies is known.
+
+        Returns
+        -------
+        columns : list
+            (name, dtype, shape) of each column, in output order
+        """
+
+        columns = [('PX', np.float64, ()),
+                   ('PY', np.float64, ()),
+                   ('PZ', np.float64, ()),
+                   ('VX', np.float64, ()),
+                   ('VY', np.float64, ()),
+                   ('VZ', np.float64, ()),
+                   ('Z_COS', np.float64, ()),
+                   ('Z', np.float64, ()),
+                   ('MAG_R', np.float64, ()),
+                   ('DIST8', np.float64, ()),
+                   ('M200', np.float64, ()),
+                   ('R200', np.float64, ()),
+                   ('RHALO', np.float64, ()),
+                   ('HALOID', np.float64, ()),
+                   ('CENTRAL', np.float64, ()),
+                   ('BAD_ASSIGN', np.bool_, ())]
+
+        if not self.colorModel.no_colors:
+            nk = len(self.colorModel.filters)
+            columns.extend([('SIGMA5', np.float64, ()),
+                            ('PSIGMA5', np.float64, ()),
+                            ('SEDID', np.int64, ()),
+                            ('MAG_R_EVOL', np.float64, ()),
+                            ('TMAG', np.float64, (nk,)),
+                            ('AMAG', np.float64, (nk,))])
+
+            if self.shapeModel is not None:
+                columns.extend([('TSIZE', np.float64, ()),
+                                ('TE', np.float64, (2,)),
+                                ('EPSILON_IA', np.float64, (2,)),
+                                ('COMOVING_SIZE', np.float64, ())])
+
+        # filled in when the catalog is written
+        columns.append(('ID', np.int64, ()))
+
+        if self.nbody.domain.fmt == 'BCCLightcone':
+            columns.extend([('TRA', np.float64, ()),
+                            ('TDEC', np.float64, ())])
+
+        return columns
 
     def paintSEDs(self):
         """Paint SEDs onto galaxies after positions and luminosities have
@@ -492,23 +702,23 @@ class ADDGALSModel(GalaxyModel):
         print('[{}] : Painting galaxy SEDs'.format(self.nbody.domain.rank))
         sys.stdout.flush()
 
-        pos = np.vstack([self.nbody.galaxyCatalog.catalog['PX'],
-                         self.nbody.galaxyCatalog.catalog['PY'],
-                         self.nbody.galaxyCatalog.catalog['PZ']]).T
+        pos = self.nbody.galaxyCatalog.getPositions()
         mag = self.nbody.galaxyCatalog.catalog['MAG_R']
         z = self.nbody.galaxyCatalog.catalog['Z_COS']
         z_rsd = self.nbody.galaxyCatalog.catalog['Z']
 
         sigma5, ranksigma5, redfraction, \
             sed_idx, omag, amag, mag_evol = self.colorModel.assignSEDs(
-                pos, mag, z, z_rsd)
+                pos, mag, z, z_rsd, neighbours=self.sigma5_neighbours)
 
-        self.nbody.galaxyCatalog.catalog['SIGMA5'] = sigma5
-        self.nbody.galaxyCatalog.catalog['PSIGMA5'] = ranksigma5
-        self.nbody.galaxyCatalog.catalog['SEDID'] = sed_idx
-        self.nbody.galaxyCatalog.catalog['MAG_R_EVOL'] = mag_evol
-        self.nbody.galaxyCatalog.catalog['TMAG'] = omag
-        self.nbody.galaxyCatalog.catalog['AMAG'] = amag
+        self.sigma5_neighbours = None
+
+        self.nbody.galaxyCatalog.setColumn('SIGMA5', sigma5)
+        self.nbody.galaxyCatalog.setColumn('PSIGMA5', ranksigma5)
+        self.nbody.galaxyCatalog.setColumn('SEDID', sed_idx)
+        self.nbody.galaxyCatalog.setColumn('MAG_R_EVOL', mag_evol)
+        self.nbody.galaxyCatalog.setColumn('TMAG', omag)
+        self.nbody.galaxyCatalog.setColumn('AMAG', amag)
 
     def paintShapes(self):
         """Assign shapes to galaxies.
@@ -521,13 +731,14 @@ class ADDGALSModel(GalaxyModel):
         if self.shapeModel is None:
             return
 
-        log_comoving_size, angular_size, epsilon = self.shapeModel.sampleShapes(
-            self.nbody.galaxyCatalog.catalog)
+        with span('shapes'):
+            log_comoving_size, angular_size, epsilon = self.shapeModel.sampleShapes(
+                self.nbody.galaxyCatalog.catalog)
 
-        self.nbody.galaxyCatalog.catalog['TSIZE'] = angular_size
-        self.nbody.galaxyCatalog.catalog['TE'] = epsilon
-        self.nbody.galaxyCatalog.catalog['EPSILON_IA'] = np.zeros_like(epsilon)
-        self.nbody.galaxyCatalog.catalog['COMOVING_SIZE'] = 10**log_comoving_size
+        self.nbody.galaxyCatalog.setColumn('TSIZE', angular_size)
+        self.nbody.galaxyCatalog.setColumn('TE', epsilon)
+        self.nbody.galaxyCatalog.setColumn('EPSILON_IA', np.zeros_like(epsilon))
+        self.nbody.galaxyCatalog.setColumn('COMOVING_SIZE', 10**log_comoving_size)
 
     def assignHalos(self, z, mag, dens):
         """Assign central galaxies to resolved halos. Halo catalog
@@ -585,14 +796,23 @@ class ADDGALSModel(GalaxyModel):
                   self.rdelModel.lcenModel['b'][idx],
                   self.rdelModel.lcenModel['k'][idx]]
 
-        if self.use_dens:
-            assigned, lcen, bad = assignLcen(z, mag, dens, mass_halo, density_halo,
-                                             z_halo, params, self.rdelModel.scatter,
-                                             dMr=self.dMr, dz=self.dz)
+        if self.search_stats:
+            stats = makeSearchStats()
         else:
-            assigned, lcen, bad = assignLcenNodens(z, mag, dens, mass_halo, density_halo,
-                                                   z_halo, params, self.rdelModel.scatter,
-                                                   self.dMr, self.dz)
+            stats = None
+
+        with span('centrals_kernel') as sp:
+            if self.use_dens:
+                assigned, lcen, bad = assignLcen(z, mag, dens, mass_halo, density_halo,
+                                                 z_halo, params, self.rdelModel.scatter,
+                                                 dMr=self.dMr, dz=self.dz, stats=stats)
+            else:
+                assigned, lcen, bad = assignLcenNodens(z, mag, dens, mass_halo, density_halo,
+                                                       z_halo, params, self.rdelModel.scatter,
+                                                       self.dMr, self.dz, stats=stats)
+
+            if stats is not None:
+                sp.set(**summarizeSearchStats(stats))
 
         print('n_bad halos: {}'.format(np.sum(bad)))
         sys.stdout.flush()
@@ -644,7 +864,17 @@ class ADDGALSModel(GalaxyModel):
         density_part = density_part[didx]
         z_part = z_part[didx]
 
-        idx, bad = assign(magnitude, redshift, density, z_part, density_part)
+        if self.search_stats:
+            stats = makeSearchStats()
+        else:
+            stats = None
+
+        with span('particles_kernel') as sp:
+            idx, bad = assign(magnitude, redshift, density, z_part, density_part,
+                              stats=stats)
+
+            if stats is not None:
+                sp.set(**summarizeSearchStats(stats))
         pos = self.nbody.particleCatalog.catalog['pos'][didx][idx]
         vel = self.nbody.particleCatalog.catalog['vel'][didx][idx]
         rhalo = self.nbody.particleCatalog.catalog['rhalo'][didx][idx]
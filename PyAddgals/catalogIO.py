@@ -0,0 +1,303 @@
+from __future__ import print_function, division
+import numpy as np
+import fitsio
+import os
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+_available_formats = ['fits', 'hdf5']
+
+
+def _setIDs(out, id_base, start):
+
+    if id_base is not None:
+        out['ID'] = id_base + start + np.arange(len(out), dtype=np.int64)
+
+
+class FITSWriter(object):
+    """Reads and writes galaxy catalogs as FITS binary tables.
+    """
+
+    extension = '.fits'
+
+    def nrows(self, fname):
+        """Number of rows in a catalog file.
+        """
+
+        with fitsio.FITS(fname) as f:
+            return f[-1].get_nrows()
+
+    def columns(self, fname):
+        """Names of the columns in a catalog file.
+        """
+
+        with fitsio.FITS(fname) as f:
+            return f[1].get_colnames()
+
+    def write(self, fname, out):
+        """Write a catalog, replacing any existing file.
+
+        Parameters
+        ----------
+        fname : str
+            File to write
+        out : np.array
+            Structured array of galaxies
+
+        Returns
+        -------
+        None
+        """
+
+        fitsio.write(fname, out, clobber=True)
+
+    def append(self, fname, out, id_base=None):
+        """Append galaxies to a catalog, creating it if it doesn't exist.
+
+        Parameters
+        ----------
+        fname : str
+            File to append to
+        out : np.array
+            Structured array of galaxies
+        id_base : int
+            If not None, out['ID'] is set to id_base plus the row number
+            of each galaxy in the file
+
+        Returns
+        -------
+        start : int
+            Row of the first galaxy appended
+        """
+
+        if os.path.exists(fname):
+            with fitsio.FITS(fname, 'rw') as f:
+                start = f[-1].get_nrows()
+                _setIDs(out, id_base, start)
+                f[-1].append(out)
+        else:
+            start = 0
+            _setIDs(out, id_base, start)
+            fitsio.write(fname, out)
+
+        return start
+
+    def resize(self, fname, nrows):
+        """Truncate a catalog to nrows rows.
+        """
+
+        with fitsio.FITS(fname, 'rw') as f:
+            f[-1].resize(nrows)
+
+    def read(self, fname, columns=None, rows=None):
+        """Read a catalog.
+
+        Parameters
+        ----------
+        fname : str
+            File to read
+        columns : list
+            Columns to read. All columns are read if None.
+        rows : array_like
+            Rows to read. All rows are read if None.
+
+        Returns
+        -------
+        out : np.array
+            Structured array of galaxies
+        """
+
+        return fitsio.read(fname, columns=columns, rows=rows, ext=1)
+
+
+class HDF5Writer(object):
+    """Reads and writes galaxy catalogs as HDF5 files, storing each
+    column as a separate chunked and compressed dataset so that reading
+    a few columns doesn't require reading whole rows.
+
+    Catalogs are stored in the group 'catalog'. Its 'nrows' attribute is
+    updated after every append, and rows past it are ignored, so a file
+    left by an interrupted append is still readable.
+    """
+
+    extension = '.h5'
+
+    def __init__(self, chunk_size=65536, compression='lzf',
+                 compression_opts=None, **kwargs):
+        """Create an HDF5Writer.
+
+        Parameters
+        ----------
+        chunk_size : int
+            Number of rows in each chunk of a column
+        compression : str
+            h5py compression filter, e.g. 'lzf', 'gzip' or None
+        compression_opts : int
+            Options for the compression filter, e.g. gzip level
+
+        Returns
+        -------
+        None
+        """
+
+        if h5py is None:
+            raise(ImportError('h5py is required to write HDF5 catalogs'))
+
+        self.chunk_size = int(chunk_size)
+        self.compression = compression
+        self.compression_opts = compression_opts
+
+    def _create(self, f, dtype):
+
+        g = f.create_group('catalog')
+        g.attrs['nrows'] = 0
+
+        for name in dtype.names:
+            shape = dtype[name].shape
+            g.create_dataset(name, shape=(0,) + shape,
+                             maxshape=(None,) + shape,
+                             dtype=dtype[name].base,
+                             chunks=(self.chunk_size,) + shape,
+                             compression=self.compression,
+                             compression_opts=self.compression_opts)
+
+        return g
+
+    def nrows(self, fname):
+
+        with h5py.File(fname, 'r') as f:
+            return int(f['catalog'].attrs['nrows'])
+
+    def columns(self, fname):
+
+        with h5py.File(fname, 'r') as f:
+            return list(f['catalog'].keys())
+
+    def write(self, fname, out):
+
+        with h5py.File(fname, 'w') as f:
+            g = self._create(f, out.dtype)
+            self._append(g, out, 0)
+
+    def _append(self, g, out, start):
+
+        for name in out.dtype.names:
+            ds = g[name]
+            ds.resize(start + len(out), axis=0)
+            ds[start:] = out[name]
+
+        g.attrs['nrows'] = start + len(out)
+
+    def append(self, fname, out, id_base=None):
+
+        with h5py.File(fname, 'a') as f:
+            if 'catalog' in f:
+                g = f['catalog']
+                start = int(g.attrs['nrows'])
+            else:
+                g = self._create(f, out.dtype)
+                start = 0
+
+            _setIDs(out, id_base, start)
+            self._append(g, out, start)
+
+        return start
+
+    def resize(self, fname, nrows):
+
+        with h5py.File(fname, 'a') as f:
+            g = f['catalog']
+
+            for name in g.keys():
+                g[name].resize(nrows, axis=0)
+
+            g.attrs['nrows'] = nrows
+
+    def read(self, fname, columns=None, rows=None):
+
+        with h5py.File(fname, 'r') as f:
+            g = f['catalog']
+            nrows = int(g.attrs['nrows'])
+
+            if columns is None:
+                columns = list(g.keys())
+
+            if rows is None:
+                sel = slice(0, nrows)
+                n = nrows
+            else:
+                sel = np.sort(np.atleast_1d(rows))
+                n = len(sel)
+
+            dtype = np.dtype([(c, g[c].dtype, g[c].shape[1:]) for c in columns])
+            out = np.zeros(n, dtype=dtype)
+
+            for c in columns:
+                out[c] = g[c][sel]
+
+        return out
+
+
+def getWriter(output_format='fits', **kwargs):
+    """Get the object used to read and write catalogs of a format.
+
+    Parameters
+    ----------
+    output_format : str
+        'fits' or 'hdf5'
+    kwargs : dict
+        Options passed to the writer, e.g. chunk_size and compression
+        for hdf5
+
+    Returns
+    -------
+    writer : FITSWriter or HDF5Writer
+    """
+
+    if output_format not in _available_formats:
+        raise(ValueError('Output format {} is not implemented'.format(output_format)))
+
+    if output_format == 'fits':
+        return FITSWriter()
+    else:
+        return HDF5Writer(**kwargs)
+
+
+def _getReader(fname):
+
+    if os.path.splitext(fname)[1] in ['.h5', '.hdf5']:
+        return HDF5Writer()
+    else:
+        return FITSWriter()
+
+
+def getCatalogColumns(fname):
+    """Names of the columns in a galaxy catalog file of either format.
+    """
+
+    return _getReader(fname).columns(fname)
+
+
+def readCatalog(fname, columns=None, rows=None):
+    """Read a galaxy catalog written by GalaxyCatalog.write, in either
+    format, choosing the format from the file extension.
+
+    Parameters
+    ----------
+    fname : str
+        File to read
+    columns : list
+        Columns to read. All columns are read if None.
+    rows : array_like
+        Rows to read. All rows are read if None.
+
+    Returns
+    -------
+    out : np.array
+        Structured array of galaxies
+    """
+
+    return _getReader(fname).read(fname, columns=columns, rows=rows)
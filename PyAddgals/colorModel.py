@@ -10,6 +10,7 @@ import sys
 import fitsio
 
 from .kcorrect import KCorrect, k_reconstruct_maggies
+from .trace import span
 
 
 class ColorModel(object):
@@ -183,10 +184,15 @@ class ColorModel(object):
 
         return rf
 
-    def rankSigma5(self, z, magnitude, sigma5, zwindow, magwindow):
+    def rankSigma5(self, z, magnitude, sigma5, zwindow, magwindow, nrank=None):
+
+        # only the first nrank galaxies are ranked, the rest are
+        # only part of the population they are ranked in
+        if nrank is None:
+            nrank = len(z)
 
         dsigma5 = np.max(sigma5) - np.min(sigma5)
-        ranksigma5 = np.zeros(len(z))
+        ranksigma5 = np.zeros(nrank)
 
         pos = np.zeros((len(z), 3))
         pos[:, 0] = z
@@ -201,7 +207,7 @@ class ColorModel(object):
 
         with fast3tree(tree_pos) as tree:
 
-            for i, p in enumerate(pos):
+            for i, p in enumerate(pos[:nrank]):
 
                 tpos = tree.query_box(
                     p + neg_max_distances, p + max_distances, output='pos')
@@ -252,7 +258,8 @@ class ColorModel(object):
 
         return sigma5
 
-    def computeRankSigma5(self, z, mag, pos_gals):
+    def computeRankSigma5(self, z, mag, pos_gals, pos_neighbours=None,
+                          mag_neighbours=None, z_neighbours=None):
         """Calculate the ranked \Sigma_5 values for galaxies,
         where \Sigma_5 is the projected radius to the 5th nearest neighbor,
         and rank \Sigma_5 is the rank of \Sigma_5 in r-band magnitude and
@@ -268,6 +275,16 @@ class ColorModel(object):
             Angular/redshift space coordinates. Should be (N,3) shape, with
             first column being theta, second being phi (in radians) and third
             being z_rsd.
+        pos_neighbours : np.array
+            Coordinates of galaxies, like pos_gals, that are not returned
+            but are neighbours when calculating \Sigma_5, and are part of
+            the population that \Sigma_5 is ranked in, e.g. galaxies in
+            the buffer of the domain.
+        mag_neighbours : np.array
+            Absolute r-band magnitudes of the neighbour galaxies.
+        z_neighbours : np.array
+            Redshifts of the neighbour galaxies (with RSD).
+
         Returns
         -------
         type
@@ -275,23 +292,35 @@ class ColorModel(object):
 
         """
 
+        n = len(z)
+
+        # rank within the whole padded domain, as if the neighbours
+        # hadn't been removed from the catalog
+        if pos_neighbours is not None:
+            z = np.hstack([z, z_neighbours])
+            mag = np.hstack([mag, mag_neighbours])
+            pos_gals = np.vstack([pos_gals, pos_neighbours])
+
         start = time()
         dtheta = 100. / \
             self.nbody.cosmo.angularDiameterDistance(self.nbody.domain.zmin)
         if dtheta > 1.5:
             dtheta = 1.5
-        sigma5 = self.computeSigma5(z, mag, pos_gals, dt=dtheta)
+        with span('sigma5'):
+            sigma5 = self.computeSigma5(z, mag, pos_gals, dt=dtheta)
         end = time()
         print('[{}] Finished computing sigma5. Took {}s'.format(
             self.nbody.domain.rank, end - start))
 
         start = time()
-        ranksigma5 = self.rankSigma5(z, mag, sigma5, 0.01, self.dm_rank)
+        with span('rank_sigma5'):
+            ranksigma5 = self.rankSigma5(z, mag, sigma5, 0.01, self.dm_rank,
+                                         nrank=n)
         end = time()
         print('[{}] Finished computing rank sigma5. Took {}s'.format(
             self.nbody.domain.rank, end - start))
 
-        return sigma5, ranksigma5
+        return sigma5[:n], ranksigma5
 
     def matchTrainingSet(self, mag, ranksigma5, redfraction, dm=0.1, ds=0.05):
 
@@ -535,17 +564,31 @@ class ColorModel(object):
 
         return dm
 
-    def assignSEDs(self, pos, mag, z, z_rsd):
+    def assignSEDs(self, pos, mag, z, z_rsd, neighbours=None):
 
         start = time()
 
         theta, phi = hp.vec2ang(pos)
         rspos = np.vstack([theta, phi, self.c * z_rsd]).T
+
+        # galaxies outside the domain core, only used as sigma5 neighbours
+        if neighbours is not None:
+            npos, nmag, nz_rsd = neighbours
+            theta, phi = hp.vec2ang(npos)
+            nrspos = np.vstack([theta, phi, self.c * nz_rsd]).T
+        else:
+            nrspos = None
+            nmag = None
+            nz_rsd = None
+
         print('[{}] checking redshifts... max(z), min(z), max(z_rsd), min(z_rsd): {}, {}, {}, {}'.format(
             self.nbody.domain.rank, np.max(z), np.min(z), np.max(z_rsd), np.min(z_rsd)))
 
         if not self.match_magonly:
-            sigma5, ranksigma5 = self.computeRankSigma5(z_rsd, mag, rspos)
+            sigma5, ranksigma5 = self.computeRankSigma5(z_rsd, mag, rspos,
+                                                        pos_neighbours=nrspos,
+                                                        mag_neighbours=nmag,
+                                                        z_neighbours=nz_rsd)
             end = time()
             print('[{}] Finished computing sigma5 and rank sigma5. Took {}s'.format(
                   self.nbody.domain.rank, end - start))
@@ -571,8 +614,9 @@ class ColorModel(object):
         else:
             redfraction = np.ones_like(z)
 
-        sed_idx, bad = self.matchTrainingSet(
-            mag, ranksigma5, redfraction, self.dm_sed, self.ds)
+        with span('sed_match'):
+            sed_idx, bad = self.matchTrainingSet(
+                mag, ranksigma5, redfraction, self.dm_sed, self.ds)
         coeffs = self.trainingSet[sed_idx]['COEFFS']
         end = time()
 
@@ -586,7 +630,8 @@ class ColorModel(object):
         mag = mag_evol
 
         start = time()
-        omag, amag = self.computeMagnitudes(mag, z_a, coeffs, self.filters)
+        with span('magnitudes'):
+            omag, amag = self.computeMagnitudes(mag, z_a, coeffs, self.filters)
         end = time()
 
         print('[{}] Finished compiuting magnitudes from SEDs. Took {}s'.format(
@@ -0,0 +1,292 @@
+from __future__ import print_function, division
+import numpy as np
+
+from .nBody import NBody
+from .trace import loadTraces
+
+# bytes held per particle and per galaxy while painting a domain,
+# including temporary arrays made while reading and cutting to the domain
+_bytes_per_particle = 208
+_bytes_per_galaxy = 600
+
+# default throughputs of each pipeline stage, in objects per second
+# per task. These are uncalibrated guesses, so estimates made with them
+# are only good for comparing domains. Calibrate them with the traces
+# of an earlier run on the same machine, see measureThroughputs.
+_default_throughputs = {'read': 5e6,
+                        'positions': 5e5,
+                        'seds': 5e4,
+                        'write': 1e6}
+
+# the object that the throughput of each stage is measured in
+_stage_units = {'read': 'n_part',
+                'positions': 'n_gal',
+                'seds': 'n_gal',
+                'write': 'n_gal'}
+
+
+def measureThroughputs(records):
+    """Measure the throughput of each stage in the cost model from the
+    spans of a traced run.
+
+    Each stage's spans are matched with the number of particles read
+    and galaxies drawn in the same domain, from the n_part of its read
+    span and the n_gal of its lf_draw span. Galaxies are counted as
+    drawn, including the buffer, as estimateGalaxies counts them.
+
+    Parameters
+    ----------
+    records : list
+        Span records, as returned by trace.loadTraces
+
+    Returns
+    -------
+    throughputs : dict
+        Objects processed per second per task by each stage that had
+        spans with known counts
+    """
+
+    counts = {}
+
+    for r in records:
+        if r['domain'] is None:
+            continue
+
+        if (r['name'] == 'read') & ('n_part' in r):
+            counts.setdefault(tuple(r['domain']), {})['n_part'] = r['n_part']
+        elif (r['name'] == 'lf_draw') & ('n_gal' in r):
+            counts.setdefault(tuple(r['domain']), {})['n_gal'] = r['n_gal']
+
+    n = dict([(stage, 0.) for stage in _stage_units])
+    dur = dict([(stage, 0.) for stage in _stage_units])
+
+    for r in records:
+        if (r['name'] not in _stage_units) or (r['domain'] is None):
+            continue
+
+        c = counts.get(tuple(r['domain']), {}).get(_stage_units[r['name']], None)
+
+        if c is None:
+            continue
+
+        n[r['name']] += c
+        dur[r['name']] += r['dur']
+
+    return dict([(stage, n[stage] / dur[stage]) for stage in _stage_units
+                 if (n[stage] > 0) & (dur[stage] > 0)])
+
+
+class CostModel(object):
+    """Estimates the amount of work needed to paint each domain, used to
+    order domains so that the most expensive ones are started first.
+    """
+
+    def __init__(self, cosmo, nb_config, throughputs=None,
+                 count_particles=True):
+        """Create CostModel object.
+
+        Parameters
+        ----------
+        cosmo : Cosmology
+            Object containing cosmology information
+        nb_config : dict
+            Keyword arguments used to construct NBody objects
+        throughputs : dict or str
+            Objects processed per second by each stage, overriding
+            the defaults, or the path prefix of the traces of an earlier
+            run to measure them from. Estimated times are only in
+            seconds if every stage's throughput is given or measured.
+        count_particles : bool
+            If False, don't read the lightcone indices, and assume
+            no particles are read.
+
+        Returns
+        -------
+        None
+        """
+
+        self.cosmo = cosmo
+        self.nb_config = nb_config
+        self.count_particles = count_particles
+
+        # traces are only read once an estimate is needed, since
+        # usually only one task makes estimates
+        self.trace_prefix = None
+        self.throughputs = dict(_default_throughputs)
+        self.calibrated = []
+
+        if isinstance(throughputs, str):
+            self.trace_prefix = throughputs
+        elif throughputs is not None:
+            self.setThroughputs(throughputs)
+
+    def setThroughputs(self, throughputs):
+        """Override the default throughputs of some stages.
+
+        Parameters
+        ----------
+        throughputs : dict
+            Objects processed per second by each stage
+
+        Returns
+        -------
+        None
+        """
+
+        for k in throughputs:
+            if k not in _stage_units:
+                raise(ValueError('{} is not a stage of the cost model, choose from {}'.format(k, list(_stage_units))))
+
+            self.throughputs[k] = float(throughputs[k])
+
+            if k not in self.calibrated:
+                self.calibrated.append(k)
+
+    def getThroughputs(self):
+        """Get the throughput of each stage, measuring them from traces
+        the first time if a trace prefix was given.
+
+        Returns
+        -------
+        throughputs : dict
+            Objects processed per second by each stage
+        """
+
+        if self.trace_prefix is not None:
+            records = loadTraces(self.trace_prefix)
+
+            if len(records) == 0:
+                raise(IOError('No trace files found for {}'.format(self.trace_prefix)))
+
+            self.setThroughputs(measureThroughputs(records))
+            self.trace_prefix = None
+
+        return self.throughputs
+
+    def isCalibrated(self):
+        """Whether every stage's throughput was given or measured, so
+        that estimated times are in seconds rather than relative.
+        """
+
+        self.getThroughputs()
+
+        return all([stage in self.calibrated for stage in _stage_units])
+
+    def estimateGalaxies(self, d):
+        """Estimate the number of galaxies that will be drawn in a domain,
+        including its buffer region, by integrating the luminosity function.
+
+        Parameters
+        ----------
+        d : Domain
+            Domain to estimate galaxy counts for
+
+        Returns
+        -------
+        n_gal : int
+            Expected number of galaxies, or 0 if the domain has no
+            luminosity function
+        """
+
+        if not hasattr(d, 'luminosityFunction'):
+            return 0
+
+        if d.fmt == 'BCCLightcone':
+            return d.luminosityFunction.integrateZL(d.zmin, d.zmax, d.getArea())
+        else:
+            # snapshot redshifts are not known until they are read, and
+            # all subboxes have the same volume
+            return 0
+
+    def estimateParticles(self, d):
+        """Estimate the number of particles that will be read for a domain.
+
+        Parameters
+        ----------
+        d : Domain
+            Domain to estimate particle counts for
+
+        Returns
+        -------
+        n_part : int
+            Number of particles
+        """
+
+        if not self.count_particles:
+            return 0
+
+        nbody = NBody(self.cosmo, d, **self.nb_config)
+
+        if d.fmt == 'BCCLightcone':
+            return nbody.particleCatalog.getNpartAll()
+        else:
+            nbox = d.nbox[d.boxnum]
+            return nbody.particleCatalog.getNPartSnapshot() // nbox**3
+
+    def estimateDomain(self, d):
+        """Estimate the galaxy and particle counts, memory and run time
+        of painting a domain.
+
+        Parameters
+        ----------
+        d : Domain
+            Domain to make estimates for
+
+        Returns
+        -------
+        est : dict
+            Dictionary containing n_gal, n_part, mem (bytes), time and
+            the time of each stage. Times are in seconds if the model
+            is calibrated, otherwise they are only relative.
+        """
+
+        throughputs = self.getThroughputs()
+
+        est = {}
+        est['n_gal'] = self.estimateGalaxies(d)
+        est['n_part'] = self.estimateParticles(d)
+        est['mem'] = (est['n_part'] * _bytes_per_particle +
+                      est['n_gal'] * _bytes_per_galaxy)
+
+        est['time'] = 0.
+        for stage in throughputs.keys():
+            est[stage] = est[_stage_units[stage]] / throughputs[stage]
+            est['time'] += est[stage]
+
+        return est
+
+    def estimateCost(self, d):
+        """Estimate the relative cost of painting a domain.
+
+        Parameters
+        ----------
+        d : Domain
+            Domain to estimate the cost of
+
+        Returns
+        -------
+        cost : float
+            Estimated run time of the domain, in seconds if the model
+            is calibrated
+        """
+
+        return self.estimateDomain(d)['time']
+
+    def orderDomains(self, domain):
+        """Order all domains in a decomposition from most to least
+        expensive.
+
+        Parameters
+        ----------
+        domain : Domain
+            Domain object that has already been decomposed
+
+        Returns
+        -------
+        order : list
+            Indices into domain.domains, most expensive first
+        """
+
+        cost = np.array([self.estimateCost(d) for d in domain.yieldAllDomains()])
+
+        return list(cost.argsort(kind='mergesort')[::-1])
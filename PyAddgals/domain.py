@@ -2,6 +2,7 @@ from __future__ import print_function, division
 from itertools import product
 from scipy.interpolate import interp1d
 from copy import copy
+import os
 import healpy as hp
 import numpy as np
 
@@ -16,11 +17,21 @@ class Domain(object):
     def __init__(self, cosmo, fmt='BCCLightcone', nside=4, nest=True,
                  rmin=None, rmax=None, nrbins=None, lbox=None, nbox=None,
                  pixlist=None, n_snaps=None, snaplist=None,
-                 luminosityFunctionConfig=None, **kwargs):
+                 luminosityFunctionConfig=None, max_mem=None, max_split=3,
+                 octants=None, footprint_file=None, **kwargs):
 
         self.fmt = fmt
         self.cosmo = cosmo
 
+        # memory budget per task in GB. Domains estimated to need more
+        # than this are split up to max_split times
+        if max_mem is not None:
+            self.max_mem = float(max_mem)
+        else:
+            self.max_mem = None
+
+        self.max_split = int(max_split)
+
         if fmt == 'BCCLightcone':
 
             self.subbox = None
@@ -78,8 +89,18 @@ class Domain(object):
                 self.nrbins = nrbins
 
             self.nside = nside
+            self.nside_decomp = nside
             self.nest = nest
 
+            # octants covered by the lightcone, and an optional file to
+            # cache the footprint in
+            if octants is None:
+                self.octants = [0, 1]
+            else:
+                self.octants = [int(o) for o in octants]
+
+            self.footprint_file = footprint_file
+
         if fmt == 'Snapshot':
 
             self.nside = None
@@ -164,7 +185,151 @@ class Domain(object):
 
         return vert
 
-    def decomp(self, comm, rank, ntasks):
+    def computeFootprint(self, comm=None):
+        """Calculate the fraction of each pixel that falls within the octants
+        covered by the lightcone. The footprint is calculated by a single
+        task, or read from footprint_file if it exists, and broadcast
+        to all other tasks in comm.
+
+        Parameters
+        ----------
+        comm : MPI.Intracomm
+            Communicator for tasks. If None, the footprint is
+            calculated by this task alone. Otherwise all tasks in comm
+            must call this.
+
+        Returns
+        -------
+        None
+        """
+
+        fp = None
+
+        if (comm is None) or (comm.rank == 0):
+            fpnside = self.nside * 2 ** self.max_split
+
+            if (self.footprint_file is not None) and os.path.exists(self.footprint_file):
+                fp = np.load(self.footprint_file)
+
+                # only use the cached footprint if it covers the same
+                # octants at high enough resolution
+                if (list(fp['octants']) == self.octants) & (int(fp['nside']) >= fpnside):
+                    fp = (int(fp['nside']), fp['fracarea'])
+                else:
+                    fp = None
+
+            if fp is None:
+                # high resolution nside that we'll use to calculate areas
+                # of pixels that overlap with the octants in question.
+                hrnside = 2048
+                fpnside = min(fpnside, hrnside)
+                allpix = []
+
+                for i in self.octants:
+                    vec = self.octVert(i)
+
+                    # only want pixels whose centers fall within the octants
+                    allpix.append(hp.query_polygon(hrnside, vec,
+                                                   inclusive=False,
+                                                   nest=True))
+
+                allpix = np.unique(np.hstack(allpix))
+
+                # only keep the fraction of area of each pixel at the highest
+                # nside that a domain may be split to
+                nhr = (hrnside // fpnside) ** 2
+                pcounts = np.bincount(allpix // nhr, minlength=12 * fpnside**2)
+                fp = (fpnside, pcounts / nhr)
+
+                if self.footprint_file is not None:
+                    tmp = '{}.{}.npz'.format(self.footprint_file, os.getpid())
+                    np.savez(tmp, nside=fp[0], fracarea=fp[1],
+                             octants=self.octants)
+                    os.rename(tmp, self.footprint_file)
+
+        if comm is not None:
+            fp = comm.bcast(fp, root=0)
+
+        # nest ordered fraction of the area of each pixel in the footprint
+        self.fpnside, self.fpmap = fp
+
+    def getFootprintPixels(self, nside):
+        """Get the pixels at nside that overlap with the footprint.
+
+        Parameters
+        ----------
+        nside : int
+            nside of the pixels to return
+
+        Returns
+        -------
+        allpix : np.array
+            Sorted pixels with some area in the footprint
+        fracarea : np.array
+            Fraction of the area of each pixel in the footprint
+        """
+
+        nfp = (self.fpnside // nside) ** 2
+        fracarea = self.fpmap.reshape(-1, nfp).mean(axis=1)
+        allpix = np.where(fracarea > 0)[0]
+
+        if not self.nest:
+            allpix = hp.nest2ring(nside, allpix)
+
+        pidx = allpix.argsort()
+
+        return allpix[pidx], fracarea[fracarea > 0][pidx]
+
+    def inFootprint(self, pos):
+        """Check which positions fall within the octants covered by the
+        lightcone.
+
+        Parameters
+        ----------
+        pos : np.array
+            (N, 3) array of cartesian positions
+
+        Returns
+        -------
+        idx : np.array
+            Boolean array, True for positions inside the footprint
+        """
+
+        idx = np.zeros(len(pos), dtype=np.bool)
+
+        for o in self.octants:
+            vert = self.octVert(o)
+            # each vertex of an octant is a positive or negative unit vector
+            idx |= ((pos[:, 0] * vert[0][0] >= 0) &
+                    (pos[:, 1] * vert[1][1] >= 0) &
+                    (pos[:, 2] * vert[2][2] >= 0))
+
+        return idx
+
+    def inCore(self, pos):
+        """Check which positions fall within the core of a lightcone
+        domain, i.e. its radial range without the redshift buffer, and
+        its pixel.
+
+        Parameters
+        ----------
+        pos : np.array
+            (N, 3) array of cartesian positions
+
+        Returns
+        -------
+        idx : np.array
+            Boolean array, True for positions inside the core
+        """
+
+        r = np.sqrt(np.sum(pos**2, axis=1))
+        pix = hp.vec2pix(self.nside, pos[:, 0], pos[:, 1], pos[:, 2],
+                         nest=self.nest)
+
+        return ((self.rcore[0] <= r) & (r < self.rcore[1]) &
+                (self.pix == pix))
+
+    def decomp(self, comm, rank, ntasks, costModel=None, manifest=None):
 
         for i, lb in enumerate(self.lbox):
             if self.fmt == 'BCCLightcone':
@@ -173,10 +338,50 @@ class Domain(object):
 
             self.decompSingleBox(comm, rank, ntasks, i)
 
+        # skip domains that were finished by a previous run
+        self.removeComplete(manifest)
+
+        if ((self.fmt == 'BCCLightcone') & (self.max_mem is not None) &
+                (costModel is not None)):
+            # estimating memory reads the index of every domain, so
+            # only do it once and share the split domains
+            if (comm is None) or (comm.rank == 0):
+                self.splitDomains(costModel)
+                split = (self.domains, self.domains_boxnum)
+            else:
+                split = None
+
+            if comm is not None:
+                self.domains, self.domains_boxnum = comm.bcast(split, root=0)
+
+            # split domains are recorded under their own keys
+            self.removeComplete(manifest)
+
         self.domains_task.extend(self.domains[self.rank::self.ntasks])
         self.domains_boxnum_task.extend(self.domains_boxnum[self.rank::self.ntasks])
         self.ndomains_task += len(self.domains[self.rank::self.ntasks])
 
+    def removeComplete(self, manifest):
+        """Remove domains that a previous run has finished.
+
+        Parameters
+        ----------
+        manifest : DomainManifest
+            Record of completed domains. Nothing is removed if None.
+
+        Returns
+        -------
+        None
+        """
+
+        if manifest is None:
+            return
+
+        keep = [not manifest.isComplete(self.getDomainKey(b, dom))
+                for b, dom in zip(self.domains_boxnum, self.domains)]
+        self.domains = [dom for dom, k in zip(self.domains, keep) if k]
+        self.domains_boxnum = [b for b, k in zip(self.domains_boxnum, keep) if k]
+
     def decompSingleBox(self, comm, rank, ntasks, boxnum):
         """Perform domain decomposition, creating domain objects for each process. Store information within object.
 
@@ -211,41 +416,10 @@ class Domain(object):
                 self.domains_boxnum_task = []
                 self.ndomains_task = 0
 
-            # get the pixels that overlap with the octants that we're using
-            allpix = []
-
-            # high resolution nside that we'll use to calculate areas of pixels
-            # that overlap with the octants in question.
-            hrnside = 2048
-            # for now only use two octants
-            for i in range(2):
-                vec = self.octVert(i)
-
-                # only want pixels whose centers fall within the octants
-                allpix.append(hp.query_polygon(hrnside, vec,
-                                               inclusive=False,
-                                               nest=self.nest))
+            if not hasattr(self, 'fpmap'):
+                self.computeFootprint()
 
-            allpix = np.hstack(allpix)
-            allpix = np.unique(allpix)
-
-            # get pixels at actual nside we want to use
-            if self.nest:
-                ud_map = hp.ud_grade(np.arange(12 * self.nside**2), hrnside,
-                                     order_in='NESTED', order_out='NESTED')
-            else:
-                ud_map = hp.ud_grade(np.arange(12 * self.nside**2), hrnside)
-
-            allpix = ud_map[allpix]
-
-            # calculate fraction of area
-            pcounts, e = np.histogram(
-                allpix, np.arange(12 * self.nside**2 + 1))
-            self.allpix = np.unique(allpix)
-            self.allpix.sort()
-
-            self.fracarea = pcounts[self.allpix] / 2 ** (2 * np.log2(hrnside /
-                                                                     self.nside))
+            self.allpix, self.fracarea = self.getFootprintPixels(self.nside)
 
             if self.pixlist is not None:
                 idx = np.in1d(self.allpix, self.pixlist)
@@ -314,76 +488,94 @@ class Domain(object):
             self.domains.extend(domains)
             self.domains_boxnum.extend(domains_boxnum)
 
-    def yieldDomains(self):
+    def getDomainLimits(self, boxnum, rbin, rcore=None):
+        """Get the radial and redshift limits of a lightcone domain,
+        including the buffer region around the radial bin.
 
-        for i in range(self.ndomains_task):
-            d = copy(self)
+        Parameters
+        ----------
+        boxnum : int
+            Index of the box the domain belongs to
+        rbin : int
+            Radial bin of the domain
+        rcore : tuple
+            Radial range of the domain without buffers, if it is
+            smaller than the radial bin
 
-            if self.fmt == 'BCCLightcone':
+        Returns
+        -------
+        rmin : float
+            Minimum radius, including buffer
+        rmax : float
+            Maximum radius, including buffer
+        zmin : float
+            Minimum redshift, including buffer
+        zmax : float
+            Maximum redshift, including buffer
+        """
 
-                d.boxnum = self.domains_boxnum_task[i]
-                d.rbin = self.domains_task[i][0]
-                d.pix = self.domains_task[i][1]
+        if rcore is None:
+            rcore = (self.rbins[boxnum][rbin], self.rbins[boxnum][rbin + 1])
 
-                d.rmin = self.rbins[d.boxnum][d.rbin]
-                d.rmax = self.rbins[d.boxnum][d.rbin + 1]
+        zmin = self.cosmo.zofR(rcore[0]) - 0.015
+        zmax = self.cosmo.zofR(rcore[1]) + 0.015
 
-                d.zmin = self.cosmo.zofR(d.rmin) - 0.015
-                d.zmax = self.cosmo.zofR(d.rmax) + 0.015
+        if zmin < 0:
+            zmin = 1.e-4
 
-                if d.zmin < 0:
-                    d.zmin = 1.e-4
+        rmin = self.cosmo.rofZ(zmin)
+        rmax = self.cosmo.rofZ(zmax)
 
-                d.rmin = self.cosmo.rofZ(d.zmin)
-                d.rmax = self.cosmo.rofZ(d.zmax)
+        return rmin, rmax, zmin, zmax
 
-                # volume weighted average radius
-                d.rmean = 0.75 * (d.rmax - d.rmin)
-                d.zmean = self.cosmo.zofR(d.rmean)
+    def makeDomain(self, boxnum, domain):
+        """Make the domain object for a single entry of self.domains.
 
-            elif self.fmt == 'Snapshot':
-                d.boxnum = self.domains_boxnum_task[i]
-                d.snapnum = self.domains_task[i][0]
-                d.subbox = self.domains_task[i][1]
-                d.pix = d.snapnum
-                d.rmin = None
-                d.rmax = None
-                # will be filled in when files are read
-                d.rmean = None
-                d.zmean = None
+        Parameters
+        ----------
+        boxnum : int
+            Index of the box the domain belongs to
+        domain : tuple
+            (rbin, pix) for lightcones, or (rbin, pix, nside, rcore_min,
+            rcore_max) for lightcone domains that have been split.
+            (snapnum, subbox) for snapshots
 
-            yield d
+        Returns
+        -------
+        d : Domain
+            Domain object for this piece of the simulation
+        """
 
-    def dummyDomain(self):
         d = copy(self)
+        d.key = self.getDomainKey(boxnum, domain)
 
         if self.fmt == 'BCCLightcone':
 
-            d.boxnum = self.domains_boxnum_task[0]
-            d.rbin = self.domains_task[0][0]
-            d.pix = self.domains_task[0][1]
-
-            d.rmin = self.rbins[d.boxnum][d.rbin]
-            d.rmax = self.rbins[d.boxnum][d.rbin + 1]
+            d.boxnum = boxnum
+            d.rbin = domain[0]
+            d.pix = domain[1]
 
-            d.zmin = self.cosmo.zofR(d.rmin) - 0.015
-            d.zmax = self.cosmo.zofR(d.rmax) + 0.015
-
-            if d.zmin < 0:
-                d.zmin = 1.e-4
+            if len(domain) > 2:
+                d.nside = domain[2]
+                d.rcore = (domain[3], domain[4])
+                d.basepix = self.getParentPixel(d.pix, d.nside, self.nside_decomp)
+            else:
+                d.rcore = (self.rbins[boxnum][d.rbin], self.rbins[boxnum][d.rbin + 1])
+                d.basepix = d.pix
 
-            d.rmin = self.cosmo.rofZ(d.zmin)
-            d.rmax = self.cosmo.rofZ(d.zmax)
+            d.rmin, d.rmax, d.zmin, d.zmax = self.getDomainLimits(d.boxnum, d.rbin,
+                                                                  rcore=d.rcore)
 
             # volume weighted average radius
             d.rmean = 0.75 * (d.rmax - d.rmin)
             d.zmean = self.cosmo.zofR(d.rmean)
 
         elif self.fmt == 'Snapshot':
-            d.boxnum = self.domains_boxnum_task[0]
-            d.snapnum = self.domains_task[0][0]
-            d.subbox = self.domains_task[0][1]
+            d.boxnum = boxnum
+            d.snapnum = domain[0]
+            d.subbox = domain[1]
             d.pix = d.snapnum
+            d.basepix = d.pix
             d.rmin = None
             d.rmax = None
             # will be filled in when files are read
@@ -392,6 +584,328 @@ class Domain(object):
 
         return d
 
+    def getDomainKey(self, boxnum, domain):
+        """Get a key uniquely identifying a domain, used to record which
+        domains have been written.
+
+        Parameters
+        ----------
+        boxnum : int
+            Index of the box the domain belongs to
+        domain : tuple
+            Entry of self.domains describing the domain
+
+        Returns
+        -------
+        key : tuple
+            (boxnum, rbin, pix) for lightcones, (boxnum, snapnum, subbox)
+            for snapshots, followed by nside and core radii for split domains
+        """
+
+        return tuple([int(boxnum)] + [e.item() if hasattr(e, 'item') else e
+                                      for e in domain])
+
+    def getIDBits(self):
+        """Get the number of bits of a galaxy ID used to store each part of
+        the key of the domain the galaxy belongs to, and the number
+        left for the index of the galaxy within its domain.
+
+        Returns
+        -------
+        bits : list
+            Number of bits for each entry returned by getIDFields
+        nlocal : int
+            Number of bits for the index within the domain
+        """
+
+        if self.fmt == 'BCCLightcone':
+            # split domains are labeled by the first of their pixels at
+            # the deepest split nside, and their position in the radial bin
+            nside_max = self.nside_decomp * 2 ** self.max_split
+            sizes = [len(self.lbox), max(self.nrbins), 12 * nside_max**2,
+                     2 ** self.max_split]
+        else:
+            sizes = [len(self.lbox), max(self.n_snaps), max(self.nbox) ** 3]
+
+        bits = [int(n - 1).bit_length() for n in sizes]
+        nlocal = 63 - sum(bits)
+
+        if nlocal < 24:
+            raise(ValueError('Decomposition has too many domains to make unique IDs'))
+
+        return bits, nlocal
+
+    def getIDFields(self):
+        """Get the parts of this domain's key that are stored in
+        galaxy IDs.
+
+        Returns
+        -------
+        fields : list
+            (boxnum, rbin, pix, radial split) for lightcones,
+            (boxnum, snapnum, subbox) for snapshots
+        """
+
+        if self.fmt == 'BCCLightcone':
+            nside_max = self.nside_decomp * 2 ** self.max_split
+
+            pix = self.pix
+            if not self.nest:
+                pix = hp.ring2nest(self.nside, pix)
+
+            pix = int(pix) * (nside_max // self.nside) ** 2
+
+            # radial splits divide the volume of a bin in half each time
+            r0 = self.rbins[self.boxnum][self.rbin]
+            r1 = self.rbins[self.boxnum][self.rbin + 1]
+            rsplit = int(np.round((self.rcore[0] ** 3 - r0 ** 3) /
+                                  (r1 ** 3 - r0 ** 3) * 2 ** self.max_split))
+
+            return [self.boxnum, self.rbin, pix, rsplit]
+        else:
+            return [self.boxnum, self.snapnum, self.subbox]
+
+    def makeIDs(self, n):
+        """Make IDs for galaxies in this domain from the domain's key and
+        the index of each galaxy within the domain. IDs are the same
+        every time a domain is painted with the same decomposition.
+
+        Parameters
+        ----------
+        n : int
+            Number of galaxies
+
+        Returns
+        -------
+        ids : np.array
+            int64 IDs
+        """
+
+        bits, nlocal = self.getIDBits()
+
+        if n > 2 ** nlocal:
+            raise(ValueError('Too many galaxies in domain to make unique IDs'))
+
+        base = 0
+        for f, b in zip(self.getIDFields(), bits):
+            base = (base << b) | int(f)
+
+        return np.int64(base << nlocal) + np.arange(n, dtype=np.int64)
+
+    def getParentPixel(self, pix, nside, nside_parent):
+        """Get the pixel at nside_parent containing pixel pix at nside.
+
+        Parameters
+        ----------
+        pix : int
+            Pixel number
+        nside : int
+            nside of pix
+        nside_parent : int
+            nside of the parent pixel, must be <= nside
+
+        Returns
+        -------
+        parent : int
+            Parent pixel number
+        """
+
+        if not self.nest:
+            pix = hp.ring2nest(nside, pix)
+
+        parent = pix // (nside // nside_parent) ** 2
+
+        if not self.nest:
+            parent = hp.nest2ring(nside_parent, parent)
+
+        return int(parent)
+
+    def getChildPixels(self, pix, nside, nside_child):
+        """Get the pixels at nside_child contained in pixel pix at nside.
+        """
+
+        if not self.nest:
+            pix = hp.ring2nest(nside, pix)
+
+        nchild = (nside_child // nside) ** 2
+        children = np.arange(pix * nchild, (pix + 1) * nchild)
+
+        if not self.nest:
+            children = hp.nest2ring(nside_child, children)
+
+        return children
+
+    def getFracArea(self, nside, pix):
+        """Fraction of the area of a pixel that is inside the footprint,
+        calculated from the footprint map.
+
+        Parameters
+        ----------
+        nside : int
+            nside of pix
+        pix : int
+            Pixel number
+
+        Returns
+        -------
+        fracarea : float
+            Fraction of the pixel area in the footprint
+        """
+
+        if not self.nest:
+            pix = hp.ring2nest(nside, pix)
+
+        nfp = (self.fpnside // nside) ** 2
+
+        return self.fpmap[pix * nfp:(pix + 1) * nfp].mean()
+
+    def splitDomain(self, d):
+        """Split a domain in two radially, or into its four child pixels
+        if its radial extent is already comparable to its buffers.
+
+        Parameters
+        ----------
+        d : Domain
+            The domain to split
+
+        Returns
+        -------
+        domains : list
+            Entries for self.domains describing the new domains
+        """
+
+        rlo, rhi = d.rcore
+
+        # radial splits add buffers, so only split radially while
+        # the core of the shell is thicker than the buffers
+        if (rhi - rlo) > ((rlo - d.rmin) + (d.rmax - rhi)):
+            # split into equal volumes
+            rmid = ((rlo ** 3 + rhi ** 3) / 2) ** (1 / 3)
+            return [(d.rbin, d.pix, d.nside, rlo, rmid),
+                    (d.rbin, d.pix, d.nside, rmid, rhi)]
+
+        nside_child = d.nside * 2
+        children = self.getChildPixels(d.pix, d.nside, nside_child)
+
+        return [(d.rbin, c, nside_child, rlo, rhi) for c in children
+                if self.getFracArea(nside_child, c) > 0]
+
+    def splitDomains(self, costModel):
+        """Recursively split domains whose estimated memory use is
+        larger than self.max_mem.
+
+        Parameters
+        ----------
+        costModel : CostModel
+            Model used to estimate the memory use of each domain
+
+        Returns
+        -------
+        None
+        """
+
+        max_mem = self.max_mem * 1024 ** 3
+        domains = []
+        domains_boxnum = []
+
+        for boxnum, dom in zip(self.domains_boxnum, self.domains):
+            to_check = [(dom, 0)]
+
+            while len(to_check) > 0:
+                dom, level = to_check.pop(0)
+                d = self.makeDomain(boxnum, dom)
+
+                if ((level >= self.max_split) |
+                        (costModel.estimateDomain(d)['mem'] <= max_mem)):
+                    domains.append(dom)
+                    domains_boxnum.append(boxnum)
+                else:
+                    to_check.extend([(sd, level + 1) for sd in self.splitDomain(d)])
+
+        self.domains = domains
+        self.domains_boxnum = domains_boxnum
+
+    def yieldDomains(self):
+
+        for i in range(self.ndomains_task):
+            yield self.makeDomain(self.domains_boxnum_task[i],
+                                  self.domains_task[i])
+
+    def yieldAllDomains(self):
+        """Yield every domain in the decomposition, regardless of
+        which task it is assigned to.
+        """
+
+        for i in range(len(self.domains)):
+            yield self.makeDomain(self.domains_boxnum[i], self.domains[i])
+
+    def yieldDomainsDynamic(self, root, tag):
+        """Yield domains handed out one at a time by a scheduler task,
+        rather than the static assignment made in decomp.
+
+        Parameters
+        ----------
+        root : int
+            Rank of the scheduling task
+        tag : int
+            MPI tag used for domain requests
+
+        Returns
+        -------
+        None
+        """
+
+        while True:
+            self.comm.send(None, dest=root, tag=tag)
+            i = self.comm.recv(source=root, tag=tag)
+
+            if i is None:
+                return
+
+            yield self.makeDomain(self.domains_boxnum[i], self.domains[i])
+
+    def yieldSnapshots(self):
+        """Yield one domain per snapshot, covering all of its subboxes.
+        Used to partition snapshots into subbox caches.
+        """
+
+        if self.fmt != 'Snapshot':
+            raise(ValueError('Can only yield snapshots for Snapshot domains'))
+
+        for boxnum in range(len(self.nbox)):
+            allsnaps = np.arange(self.n_snaps[boxnum])
+
+            if self.snaplist is not None:
+                allsnaps = allsnaps[np.in1d(allsnaps, self.snaplist)]
+
+            for snapnum in allsnaps:
+                d = copy(self)
+                d.boxnum = boxnum
+                d.snapnum = snapnum
+                d.subbox = None
+                d.pix = d.snapnum
+                d.rmin = None
+                d.rmax = None
+                d.rmean = None
+                d.zmean = None
+
+                yield d
+
+    def dummyDomain(self):
+
+        return self.makeDomain(self.domains_boxnum_task[0],
+                               self.domains_task[0])
+
+    def getPixFracArea(self):
+        """Fraction of this domain's pixel that is inside the footprint.
+        """
+
+        if self.nside == self.nside_decomp:
+            pidx = self.allpix.searchsorted(self.pix)
+            return self.fracarea[pidx]
+        else:
+            return self.getFracArea(self.nside, self.pix)
+
     def getArea(self):
 
         if self.fmt is 'Snapshot':
@@ -401,9 +915,8 @@ class Domain(object):
             return self.pixarea
 
         elif hasattr(self, 'pix'):
-            pidx = self.allpix.searchsorted(self.pix)
             self.pixarea = hp.nside2pixarea(self.nside, degrees=True)
-            self.pixarea *= self.fracarea[pidx]
+            self.pixarea *= self.getPixFracArea()
         else:
             return 1
 
@@ -425,9 +938,8 @@ class Domain(object):
             if not hasattr(self, 'pix'):
                 raise(ValueError('pix must be defined to calculate volume'))
 
-            pidx = self.allpix.searchsorted(self.pix)
             pixarea = hp.nside2pixarea(self.nside, degrees=True)
-            pixarea *= self.fracarea[pidx]
+            pixarea *= self.getPixFracArea()
 
             self.volume = 4 * np.pi * (pixarea / 41253.) * (self.rmax ** 3 -
                                                             self.rmin ** 3) / 3
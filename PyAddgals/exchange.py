@@ -0,0 +1,215 @@
+from __future__ import print_function, division
+import numpy as np
+import os
+
+from .catalogIO import FITSWriter
+
+
+def getOutputGroup(domain, d, nside_output):
+    """Get the group of output files that a domain writes to. Domains
+    in different groups never write to the same file.
+
+    Parameters
+    ----------
+    domain : Domain
+        Decomposed domain
+    d : Domain
+        Domain object for a single domain, as returned by makeDomain
+    nside_output : int
+        nside of the output files
+
+    Returns
+    -------
+    group : int
+        Pixel at min(nside_output, nside of the decomposition) containing
+        the domain for lightcones, or the snapshot number for snapshots
+    """
+
+    if d.fmt == 'BCCLightcone':
+        nside = min(nside_output, domain.nside_decomp)
+        return domain.getParentPixel(d.basepix, domain.nside_decomp, nside)
+    else:
+        return d.snapnum
+
+
+def getGroupOutputs(domain, group, nside_output):
+    """Get the output files, labeled by pixel or snapshot number, that the
+    domains of a group write to.
+    """
+
+    if domain.fmt == 'BCCLightcone':
+        nside = min(nside_output, domain.nside_decomp)
+        if nside_output > nside:
+            return list(domain.getChildPixels(group, nside, nside_output))
+
+    return [group]
+
+
+def planBatches(domain, ntasks, nside_output, min_domains=None):
+    """Split all domains into batches, such that each output file is
+    written to by the domains of only one batch.
+
+    Parameters
+    ----------
+    domain : Domain
+        Decomposed domain
+    ntasks : int
+        Number of tasks painting domains
+    nside_output : int
+        nside of the output files
+    min_domains : int
+        Minimum number of domains in a batch. Defaults to ntasks.
+
+    Returns
+    -------
+    batches : list
+        Each batch is a dict containing 'domains', a list of
+        (index into domain.domains, rank) for each domain in the batch,
+        and 'owners', a dict giving the rank that writes each output
+    """
+
+    if min_domains is None:
+        min_domains = ntasks
+
+    # group domains by the output files they write to, keeping
+    # the order of the decomposition
+    groups = {}
+    order = []
+
+    for i, d in enumerate(domain.yieldAllDomains()):
+        g = getOutputGroup(domain, d, nside_output)
+
+        if g not in groups:
+            groups[g] = []
+            order.append(g)
+
+        groups[g].append(i)
+
+    batches = []
+    batch_groups = []
+    ndomains = 0
+
+    for j, g in enumerate(order):
+        batch_groups.append(g)
+        ndomains += len(groups[g])
+
+        if (ndomains < min_domains) & (j < (len(order) - 1)):
+            continue
+
+        idx = [i for g in batch_groups for i in groups[g]]
+        outputs = [p for g in batch_groups
+                   for p in getGroupOutputs(domain, g, nside_output)]
+
+        batches.append({'domains': [(i, k % ntasks) for k, i in enumerate(idx)],
+                        'owners': dict([(p, k % ntasks) for k, p in enumerate(outputs)])})
+
+        batch_groups = []
+        ndomains = 0
+
+    return batches
+
+
+def exchangeGalaxies(comm, arr, dest):
+    """Send the rows of an array to the tasks given by dest, using a
+    single all to all exchange.
+
+    Parameters
+    ----------
+    comm : MPI.Intracomm
+        Communicator for tasks
+    arr : np.array
+        Rows to send. May be None if this task has nothing to send,
+        as long as some task has data.
+    dest : np.array
+        Rank to send each row to
+
+    Returns
+    -------
+    recv : np.array
+        Rows sent to this task, ordered by the rank that sent them.
+        None if no task had anything to send.
+    """
+
+    from mpi4py import MPI
+
+    # tasks with nothing to send still need to know what they'll receive
+    dtypes = [dt for dt in comm.allgather(None if arr is None else arr.dtype)
+              if dt is not None]
+
+    if len(dtypes) == 0:
+        return None
+
+    # rows are sent as raw bytes, so every task must use the same
+    # layout. All tasks see the same dtypes, so they all raise.
+    if len(set(dtypes)) > 1:
+        raise(ValueError('Tasks have different galaxy dtypes: {}'.format(sorted(set([str(dt) for dt in dtypes])))))
+
+    dtype = dtypes[0]
+
+    if arr is None:
+        arr = np.zeros(0, dtype=dtype)
+
+    sidx = dest.argsort(kind='mergesort')
+    arr = np.ascontiguousarray(arr[sidx])
+
+    scounts = np.bincount(dest, minlength=comm.size).astype(np.int64)
+    rcounts = np.array(comm.alltoall([int(c) for c in scounts]), dtype=np.int64)
+    sdispls = np.hstack([[0], np.cumsum(scounts)[:-1]])
+    rdispls = np.hstack([[0], np.cumsum(rcounts)[:-1]])
+
+    recv = np.zeros(np.sum(rcounts), dtype=dtype)
+
+    # send whole records so that counts stay small for large catalogs
+    rtype = MPI.BYTE.Create_contiguous(dtype.itemsize).Commit()
+    comm.Alltoallv([arr, (scounts, sdispls), rtype],
+                   [recv, (rcounts, rdispls), rtype])
+    rtype.Free()
+
+    return recv
+
+
+def writeOutput(filename, p, out, id_base=0, write_pos=False, writer=None):
+    """Write every galaxy in an output file at once, replacing any
+    existing file.
+
+    Parameters
+    ----------
+    filename : str
+        Output path prefix
+    p : int
+        Output pixel, or snapshot number
+    out : np.array
+        Structured array of galaxies to write
+    id_base : int
+        ID of the first galaxy in the file. If None, the IDs in out
+        are kept.
+    write_pos : bool
+        If True, also write a file containing only IDs and positions
+    writer : FITSWriter or HDF5Writer
+        Object used to write the output format. Defaults to FITS.
+
+    Returns
+    -------
+    written : list
+        (filename, first row, number of rows) for each file written
+    """
+
+    if id_base is not None:
+        out['ID'] = id_base + np.arange(len(out), dtype=np.int64)
+
+    if writer is None:
+        writer = FITSWriter()
+
+    fname = '{}.{}{}'.format(filename, p, writer.extension)
+    print('Writing to {}'.format(fname))
+    writer.write(fname + '.tmp', out)
+    os.rename(fname + '.tmp', fname)
+    written = [(fname, 0, len(out))]
+
+    if write_pos:
+        pfname = '{}.{}.lens{}'.format(filename, p, writer.extension)
+        writer.write(pfname + '.tmp', out[['ID', 'PX', 'PY', 'PZ']])
+        os.rename(pfname + '.tmp', pfname)
+        written.append((pfname, 0, len(out)))
+
+    return written
@@ -1,11 +1,13 @@
 from __future__ import print_function, division
 import numpy as np
 import healpy as hp
-import fitsio
-import os
 import sys
 
 from .addgalsModel import ADDGALSModel
+from .catalogIO import FITSWriter
+from .schema import (addPlaceholders, getPlaceholderNames, getPlaceholderColumns,
+                     getOutputDtype, snapshot_placeholder_columns)
+from .trace import span
 
 _available_models = ['ADDGALSModel']
 
@@ -20,8 +22,159 @@ class GalaxyCatalog(object):
 
         self.nbody = nbody
         self.catalog = {}
+        self.store = None
+        self.placeholders = None
 
-    def paintGalaxies(self, config):
+    def allocate(self, n, columns, placeholders=None):
+        """Allocate storage for all columns of the catalog at once, so
+        that painting stages can fill them in place. Columns are stored
+        as fields of a single structured array, and self.catalog holds
+        views of each field.
+
+        Parameters
+        ----------
+        n : int
+            Number of galaxies
+        columns : list
+            (name, dtype, shape) of each column, where shape is the
+            shape of one row
+        placeholders : list
+            Names of placeholder columns to allocate after the painted
+            columns, as zeros. If these are the placeholders that are
+            written, the storage has the output layout and is written
+            without copying it.
+
+        Returns
+        -------
+        None
+        """
+
+        if placeholders is not None:
+            columns = columns + getPlaceholderColumns(columns, placeholders)
+
+        self.store = np.zeros(n, dtype=[(name, dtype, shape)
+                                        for name, dtype, shape in columns])
+        self.catalog = dict([(name, self.store[name])
+                             for name in self.store.dtype.names])
+
+    def setColumn(self, name, value):
+        """Set a column, copying into the allocated storage if the
+        column has been allocated.
+
+        Parameters
+        ----------
+        name : str
+            Column name
+        value : np.array
+            Column values
+
+        Returns
+        -------
+        None
+        """
+
+        if (self.store is not None) and (name in self.store.dtype.names):
+            self.catalog[name][:] = value
+        else:
+            self.catalog[name] = value
+
+    def _vectorView(self, names):
+
+        # consecutive float64 fields can be viewed as an (N, 3) array
+        # without copying them
+        if (self.store is not None) and all([n in self.store.dtype.names
+                                             for n in names]):
+            fields = self.store.dtype.fields
+            offset = fields[names[0]][1]
+
+            if all([(fields[n][0] == np.float64) &
+                    (fields[n][1] == offset + 8 * i)
+                    for i, n in enumerate(names)]):
+                return np.ndarray((len(self.store), len(names)),
+                                  dtype=np.float64, buffer=self.store,
+                                  offset=offset,
+                                  strides=(self.store.dtype.itemsize, 8))
+
+        return np.vstack([self.catalog[n] for n in names]).T
+
+    def getPositions(self):
+        """Positions of galaxies as an (N, 3) array. This is a view of
+        the PX, PY and PZ columns if they have been allocated, so writing
+        to it sets them.
+        """
+
+        return self._vectorView(['PX', 'PY', 'PZ'])
+
+    def getVelocities(self):
+        """Velocities of galaxies as an (N, 3) array, a view of the VX,
+        VY and VZ columns if they have been allocated.
+        """
+
+        return self._vectorView(['VX', 'VY', 'VZ'])
+
+    def getPlaceholderNames(self, placeholders=None):
+        """Names of the placeholder columns written for this domain.
+        Snapshots have no lensing, and no magnitudes without colors.
+
+        Parameters
+        ----------
+        placeholders : str or list
+            Placeholder columns to write, see makeOutput
+
+        Returns
+        -------
+        names : list
+            Placeholder column names, in schema order
+        """
+
+        names = getPlaceholderNames(placeholders)
+
+        if self.nbody.domain.fmt == 'Snapshot':
+            if self.model.colorModel.no_colors:
+                return []
+
+            names = [p for p in names if p in snapshot_placeholder_columns]
+
+        return names
+
+    def _makeTable(self, idx, columns, placeholders, dtype_profile):
+
+        # describe the output columns without allocating them for
+        # every galaxy
+        cat = dict([(k, self.catalog[k][:0]) for k in self.catalog.keys()])
+
+        for name, dtype, shape in columns:
+            if name not in cat:
+                cat[name] = np.zeros((0,) + shape, dtype=dtype)
+
+        addPlaceholders(cat, placeholders)
+        cdtype = getOutputDtype(cat, dtype_profile)
+
+        # the allocated storage already has the output layout, so rows
+        # can be taken from it directly
+        if ((self.store is not None) & (cdtype == self.store.dtype) &
+                (len(self.catalog) == len(cdtype.names))):
+            if idx is None:
+                return self.store
+            else:
+                return self.store[idx]
+
+        if idx is None:
+            n = len(self.catalog['PX'])
+        else:
+            n = np.sum(idx)
+
+        out = np.zeros(n, dtype=cdtype)
+
+        for k in self.catalog.keys():
+            if idx is None:
+                out[k] = self.catalog[k]
+            else:
+                out[k] = self.catalog[k][idx]
+
+        return out
+
+    def paintGalaxies(self, config, placeholders=None, between_stages=None):
         """Apply a galaxy model to the nbody sim
 
         Parameters
@@ -29,12 +182,19 @@ class GalaxyCatalog(object):
         config : dict
             Galaxy model config file, must contain algorithm and
             relevant input information, e.g. LF, f_red(L,z), etc.
+        placeholders : str or list
+            Placeholder columns that will be written, see makeOutput.
+            They are allocated along with the painted columns.
+        between_stages : callable
+            Called with no arguments between painting stages
 
         Returns
         -------
         None
         """
 
+        self.placeholders = placeholders
+
         model_class = list(config.keys())[0]
 
         if not (model_class in _available_models):
@@ -48,203 +208,242 @@ class GalaxyCatalog(object):
                                                                                                  self.nbody.domain.pix,
                                                                                                  self.nbody.domain.nside))
 
-        self.model.paintGalaxies()
+        self.model.paintGalaxies(between_stages=between_stages)
 
-    def write(self, filename, nside_output, write_pos=False):
-        """Write galaxy catalog to disk.
+    def makeOutput(self, nside_output, id_scheme='sequential',
+                   placeholders=None, dtype_profile=None):
+        """Make the table of galaxies to be written for this domain, cut
+        to the core of the domain. The galaxy catalog is deleted.
+
+        Parameters
+        ----------
+        nside_output : int
+            nside of the output files
+        id_scheme : str
+            If 'deterministic', IDs are made from the domain key and
+            the index of each galaxy in the domain. If 'sequential', IDs
+            are assigned when galaxies are written.
+        placeholders : str or list
+            Columns filled in by later stages to write as zeros. 'all' or
+            None for all of them, 'none' to omit them, or a list of names.
+        dtype_profile : str
+            Name of the set of output column types in
+            schema.dtype_profiles, e.g. 'native' or 'reduced'
 
         Returns
         -------
-        None
+        out : np.array
+            Structured array of galaxies to write
+        opix : np.array
+            Output pixel of each galaxy
         """
 
         domain = self.nbody.domain
 
-        if 'ID' not in list(self.catalog.keys()):
-            self.catalog['ID'] = np.zeros(len(self.catalog['PX']))
-
-        if 'TRA' not in list(self.catalog.keys()):
-            self.catalog['TRA'], self.catalog['TDEC'] = hp.vec2ang(np.vstack([self.catalog['PX'],
-                                                                   self.catalog['PY'],
-                                                                   self.catalog['PZ']]).T,
-                                                                   lonlat=True)
-
-        self.catalog['EPSILON'] = np.zeros((len(self.catalog['PX']), 2))
-        self.catalog['SIZE'] = np.zeros(len(self.catalog['PX']))
-        self.catalog['KAPPA'] = np.zeros(len(self.catalog['PX']))
-        self.catalog['MU'] = np.zeros(len(self.catalog['PX']))
-        self.catalog['W'] = np.zeros(len(self.catalog['PX']))
+        if len(self.catalog) == 0:
+            return None, None
 
-        self.catalog['GAMMA1'] = np.zeros(len(self.catalog['PX']))
-        self.catalog['GAMMA2'] = np.zeros(len(self.catalog['PX']))
+        # cut off buffer region, make sure we only have the pixel we want.
+        # Painting already drops galaxies outside the core, so normally
+        # nothing is cut and the catalog is used without copying it.
+        print('Cutting catalog to {} <= z < {}'.format(self.nbody.cosmo.zofR(domain.rcore[0]),
+                                                       self.nbody.cosmo.zofR(domain.rcore[1])))
 
-        self.catalog['DEC'] = np.zeros(len(self.catalog['PX']))
-        self.catalog['RA'] = np.zeros(len(self.catalog['PX']))
-
-        self.catalog['LMAG'] = np.zeros_like(self.catalog['TMAG'])
-        self.catalog['OMAG'] = np.zeros_like(self.catalog['TMAG'])
-        self.catalog['OMAGERR'] = np.zeros_like(self.catalog['TMAG'])
-        self.catalog['FLUX'] = np.zeros_like(self.catalog['TMAG'])
-        self.catalog['IVAR'] = np.zeros_like(self.catalog['TMAG'])
+        sys.stdout.flush()
+        idx = domain.inCore(self.getPositions())
 
+        if idx.all():
+            idx = None
 
-        cdtype = np.dtype(list(zip(self.catalog.keys(),
-                                   [(self.catalog[k].dtype.type,
-                                    self.catalog[k].shape[1])
-                                    if len(self.catalog[k].shape) > 1
-                                    else self.catalog[k].dtype.type
-                                    for k in self.catalog.keys()])))
+        # columns filled in by later stages are left as zeros
+        out = self._makeTable(idx, [('ID', np.int64, ()),
+                                    ('TRA', np.float64, ()),
+                                    ('TDEC', np.float64, ())],
+                              self.getPlaceholderNames(placeholders),
+                              dtype_profile)
+        del idx
 
-        out = np.zeros(len(self.catalog[list(self.catalog.keys())[0]]),
-                       dtype=cdtype)
-        for k in self.catalog.keys():
-            out[k] = self.catalog[k]
+        out['TRA'], out['TDEC'] = hp.vec2ang(np.vstack([out['PX'],
+                                                        out['PY'],
+                                                        out['PZ']]).T,
+                                             lonlat=True)
 
-        r = np.sqrt(out['PX']**2 + out['PY']**2 + out['PZ']**2)
-        pix = hp.vec2pix(domain.nside, out['PX'], out['PY'], out['PZ'],
-                         nest=domain.nest)
+        if id_scheme == 'deterministic':
+            out['ID'] = domain.makeIDs(len(out))
 
-        boxnum = domain.boxnum
-        # cut off buffer region, make sure we only have the pixel we want
-        print('Cutting catalog to {} <= z < {}'.format(self.nbody.cosmo.zofR(domain.rbins[boxnum][domain.rbin]),
-                                                       self.nbody.cosmo.zofR(domain.rbins[boxnum][domain.rbin + 1])))
+        self.delete()
+        del self.catalog
 
-        sys.stdout.flush()
-        idx = ((domain.rbins[boxnum][domain.rbin] <= r) &
-               (r < domain.rbins[boxnum][domain.rbin + 1]) &
-               (domain.pix == pix))
+        opix = hp.vec2pix(nside_output, out['PX'], out['PY'], out['PZ'],
+                          nest=domain.nest)
 
+        # don't write output pixels that this domain barely overlaps
+        upix, counts = np.unique(opix, return_counts=True)
+        idx = np.in1d(opix, upix[counts >= 100])
         out = out[idx]
-        del idx
+        opix = opix[idx]
 
-        keys = list(self.catalog.keys())
+        return out, opix
 
-        if len(keys) == 0:
-            return
+    def write(self, filename, nside_output, write_pos=False,
+              id_scheme='sequential', writer=None, placeholders=None,
+              dtype_profile=None):
+        """Write galaxy catalog to disk.
 
-        for k in keys:
-            del self.catalog[k]
+        Parameters
+        ----------
+        filename : str
+            Output path prefix
+        nside_output : int
+            nside of the output files
+        write_pos : bool
+            If True, also write files containing only IDs and positions
+        id_scheme : str
+            'sequential' numbers galaxies in the order they are written
+            to each output pixel, 'deterministic' uses IDs made from the
+            domain key, which don't depend on what is already written.
+        writer : FITSWriter or HDF5Writer
+            Object used to write the output format. Defaults to FITS.
+        placeholders : str or list
+            Columns filled in by later stages to write, see makeOutput
+        dtype_profile : str
+            Name of the set of output column types, see makeOutput
 
-        del self.catalog
+        Returns
+        -------
+        written : list
+            (filename, first row, number of rows) for each file written to
+        """
 
-        if nside_output != domain.nside:
-            map_in = np.arange(12 * domain.nside**2)
+        # may be called from a background writer thread
+        with span('write', domain=self.nbody.domain.key) as sp:
+            out, opix = self.makeOutput(nside_output, id_scheme=id_scheme,
+                                        placeholders=placeholders,
+                                        dtype_profile=dtype_profile)
 
-            if domain.nest:
-                order = 'NESTED'
-            else:
-                order = 'RING'
+            if out is None:
+                return []
 
-            map_out = hp.ud_grade(map_in, nside_output, order_in=order,
-                                  order_out=order)
-            pix, = np.where(map_out == domain.pix)
+            sp.set(n_gal=len(out))
 
-        else:
-            pix = [domain.pix]
+            written = []
 
-        for p in pix:
-            fname = '{}.{}.fits'.format(filename, p)
-            print('Writing to {}'.format(fname))
+            if writer is None:
+                writer = FITSWriter()
 
-            if write_pos:
-                pfname = '{}.{}.lens.fits'.format(filename, p)
+            for p in np.unique(opix):
+                fname = '{}.{}{}'.format(filename, p, writer.extension)
+                print('Writing to {}'.format(fname))
 
-            if os.path.exists(fname):
-                f = fitsio.FITS(fname)
-                ngal = f[-1].read_header()['NAXIS2']
-                f.close()
-            else:
-                ngal = 0
+                # IDs are offset by the output pixel, and numbered by row
+                if id_scheme == 'sequential':
+                    id_base = np.int64(p) * 1000000000
+                else:
+                    id_base = None
 
-            pix = hp.vec2pix(nside_output, out['PX'], out['PY'], out['PZ'],
-                             nest=domain.nest)
+                og = out[opix == p]
+                ngal = writer.append(fname, og, id_base=id_base)
+                written.append((fname, ngal, len(og)))
 
-            idx = pix == p
-            if np.sum(idx) < 100:
-                continue
+                if write_pos:
+                    pfname = '{}.{}.lens{}'.format(filename, p, writer.extension)
+                    writer.append(pfname, og[['ID', 'PX', 'PY', 'PZ']])
+                    written.append((pfname, ngal, len(og)))
 
-            out['ID'][idx] = (p * 1e9 + np.arange(len(out['PX'][idx])) + ngal).astype(np.int64)
+                del og
 
-            if os.path.exists(fname):
-                with fitsio.FITS(fname, 'rw') as f:
-                    f[-1].append(out[idx])
-            else:
-                fitsio.write(fname, out[idx])
+            del out
 
-            if write_pos:
-                if os.path.exists(pfname):
-                    with fitsio.FITS(pfname, 'rw') as f:
-                        f[-1].append(out[['ID', 'PX', 'PY', 'PZ']][idx])
-                else:
-                    fitsio.write(pfname, out[['ID', 'PX', 'PY', 'PZ']][idx])
+        return written
 
-        del out
 
+    def makeSnapshotOutput(self, id_scheme='sequential', placeholders=None,
+                           dtype_profile=None):
+        """Make the table of galaxies to be written for this snapshot
+        domain. The galaxy catalog is deleted.
 
-    def writeSnapshot(self, filename):
-        """Write galaxy catalog to disk.
+        Parameters
+        ----------
+        id_scheme : str
+            If 'deterministic', IDs are made from the domain key and
+            the index of each galaxy in the domain.
+        placeholders : str or list
+            Columns filled in by later stages to write, see makeOutput
+        dtype_profile : str
+            Name of the set of output column types, see makeOutput
 
         Returns
         -------
-        None
+        out : np.array
+            Structured array of galaxies to write
         """
 
-        domain = self.nbody.domain
+        if len(self.catalog) == 0:
+            return None
 
-        if 'ID' not in list(self.catalog.keys()):
-            self.catalog['ID'] = np.zeros(len(self.catalog['PX']))
+        out = self._makeTable(None, [('ID', np.int64, ())],
+                              self.getPlaceholderNames(placeholders),
+                              dtype_profile)
 
-        if not self.model.colorModel.no_colors:
-            self.catalog['LMAG'] = np.zeros_like(self.catalog['TMAG'])
-            self.catalog['OMAG'] = np.zeros_like(self.catalog['TMAG'])
-            self.catalog['OMAGERR'] = np.zeros_like(self.catalog['TMAG'])
-            self.catalog['FLUX'] = np.zeros_like(self.catalog['TMAG'])
-            self.catalog['IVAR'] = np.zeros_like(self.catalog['TMAG'])
+        if id_scheme == 'deterministic':
+            out['ID'] = self.nbody.domain.makeIDs(len(out))
 
+        self.delete()
+        del self.catalog
 
-        cdtype = np.dtype(list(zip(self.catalog.keys(),
-                                   [(self.catalog[k].dtype.type,
-                                    self.catalog[k].shape[1])
-                                    if len(self.catalog[k].shape) > 1
-                                    else self.catalog[k].dtype.type
-                                    for k in self.catalog.keys()])))
+        return out
 
-        out = np.zeros(len(self.catalog[list(self.catalog.keys())[0]]),
-                       dtype=cdtype)
-        for k in self.catalog.keys():
-            out[k] = self.catalog[k]
+    def writeSnapshot(self, filename, id_scheme='sequential', writer=None,
+                      placeholders=None, dtype_profile=None):
+        """Write galaxy catalog to disk.
 
-        snapnum = domain.snapnum
+        Parameters
+        ----------
+        filename : str
+            Output path prefix
+        id_scheme : str
+            'sequential' or 'deterministic', see write
+        writer : FITSWriter or HDF5Writer
+            Object used to write the output format. Defaults to FITS.
+        placeholders : str or list
+            Columns filled in by later stages to write, see makeOutput
+        dtype_profile : str
+            Name of the set of output column types, see makeOutput
 
-        keys = list(self.catalog.keys())
+        Returns
+        -------
+        written : list
+            (filename, first row, number of rows) for each file written to
+        """
 
-        if len(keys) == 0:
-            return
+        with span('write', domain=self.nbody.domain.key) as sp:
+            snapnum = self.nbody.domain.snapnum
+            out = self.makeSnapshotOutput(id_scheme=id_scheme,
+                                          placeholders=placeholders,
+                                          dtype_profile=dtype_profile)
 
-        for k in keys:
-            del self.catalog[k]
+            if out is None:
+                return []
 
-        del self.catalog
+            sp.set(n_gal=len(out))
 
-        fname = '{}.{}.fits'.format(filename, snapnum)
-        print('Writing to {}'.format(fname))
+            if writer is None:
+                writer = FITSWriter()
 
-        if os.path.exists(fname):
-            f = fitsio.FITS(fname)
-            ngal = f[-1].read_header()['NAXIS2']
-            f.close()
-        else:
-            ngal = 0
+            fname = '{}.{}{}'.format(filename, snapnum, writer.extension)
+            print('Writing to {}'.format(fname))
 
-        out['ID'] = (np.arange(len(out['PX'])) + ngal).astype(np.int64)
+            if id_scheme == 'sequential':
+                id_base = 0
+            else:
+                id_base = None
 
-        if os.path.exists(fname):
-            with fitsio.FITS(fname, 'rw') as f:
-                f[-1].append(out)
-        else:
-            fitsio.write(fname, out)
+            ngal = writer.append(fname, out, id_base=id_base)
+            written = [(fname, ngal, len(out))]
+
+            del out
 
-        del out
+        return written
 
     def delete(self):
         """Delete galaxy catalog
@@ -260,8 +459,7 @@ class GalaxyCatalog(object):
 
         keys = list(self.catalog.keys())
 
-        if len(keys) == 0:
-            return
-
         for k in keys:
             del self.catalog[k]
+
+        self.store = None
@@ -12,12 +12,13 @@ class GalaxyModel(object):
         pass
 
     @abstractmethod
-    def paintGalaxies(self):
+    def paintGalaxies(self, between_stages=None):
         """Abstract method that populates the galaxyCatalog.catalog.
 
         Parameters
         ----------
-        None
+        between_stages : callable
+            Called with no arguments between painting stages
 
         Returns
         -------
@@ -2,6 +2,7 @@ from __future__ import print_function, division
 from halotools.sim_manager import TabularAsciiReader
 import numpy as np
 import healpy as hp
+import os
 
 
 class HaloCatalog(object):
@@ -83,28 +84,152 @@ class HaloCatalog(object):
         else:
             raise(NotImplementedError("fmt {} not recognized".format(fmt)))
 
-    def readRockstarLightconeFile(self):
+    def getLightconeCacheName(self):
+        """Get the base name of the columnar cache files for a lightcone
+        halo catalog. The cache is indexed by healpix cell at the domain
+        nside and ordering.
+
+        Returns
+        -------
+        fname : str
+            Base name of the cache files, or None if no cache path is set
+        """
+
+        cachepath = self.nbody.cachepath[self.nbody.boxnum]
+
+        if cachepath is None:
+            return None
+
+        if self.nbody.domain.nest:
+            order = 'nest'
+        else:
+            order = 'ring'
+
+        return '{}/halos_lightcone_{}.nside{}_{}'.format(cachepath, self.nbody.boxnum,
+                                                        self.nbody.domain.nside, order)
+
+    def needsLightconeCache(self):
+        """Whether this catalog is read from the columnar cache, but the
+        cache hasn't been made yet.
+        """
+
+        fname = self.getLightconeCacheName()
+
+        return (fname is not None) and (not os.path.exists('{}.offsets.npy'.format(fname)))
+
+    def readRockstarLightconeAscii(self):
 
         cdict = self.getColumnDict(self.nbody.domain.fmt)
         reader = TabularAsciiReader(
             self.nbody.halofile[self.nbody.boxnum], cdict)
         catalog = reader.read_ascii()
-        names = catalog.dtype.names
 
         rnn = np.loadtxt(self.nbody.halodensfile[self.nbody.boxnum])
 
-        # get the part of the catalog for this task
+        return catalog, rnn[:, 1]
+
+    def convertRockstarLightconeFile(self):
+        """Convert the ascii lightcone halo catalog and halo densities
+        into one binary file per column, sorted by healpix cell and radius,
+        along with an index of the offset of each cell.
+
+        Returns
+        -------
+        None
+        """
+
+        catalog, rnn = self.readRockstarLightconeAscii()
+
         r = np.sqrt(catalog['x']**2 + catalog['y']**2 + catalog['z']**2)
         pix = hp.vec2pix(self.nbody.domain.nside, catalog['x'],
                          catalog['y'], catalog['z'],
                          nest=self.nbody.domain.nest)
-        idx = (self.nbody.domain.rmin < r) & (r <= self.nbody.domain.rmax)
-        idx = (self.nbody.domain.pix == pix) & idx
-        catalog = catalog[idx]
-        r = r[idx]
-        rnn = rnn[idx]
 
-        del idx
+        idx = np.lexsort((r, pix))
+        counts = np.bincount(pix, minlength=12 * self.nbody.domain.nside**2)
+        offsets = np.hstack([[0], np.cumsum(counts)]).astype(np.int64)
+
+        fname = self.getLightconeCacheName()
+        print('Writing halo cache {}'.format(fname))
+
+        columns = [(k, catalog[k][idx]) for k in catalog.dtype.names]
+        columns += [('rnn', rnn[idx]), ('r', r[idx])]
+
+        # use a per-process temporary name since several tasks may
+        # convert the same catalog at once. offsets are written last, and
+        # their presence marks a complete cache
+        for k, data in columns + [('offsets', offsets)]:
+            tmp = '{}.{}.npy.{}.tmp'.format(fname, k, os.getpid())
+            with open(tmp, 'wb') as fp:
+                np.save(fp, data)
+
+            os.rename(tmp, '{}.{}.npy'.format(fname, k))
+
+    def readRockstarLightconeCache(self):
+        """Read the halos in this domain's healpix cell and radial range
+        from the columnar cache.
+
+        Returns
+        -------
+        catalog : dict
+            Dictionary of halo columns
+        rnn : np.array
+            Halo densities
+        r : np.array
+            Halo radii
+        """
+
+        fname = self.getLightconeCacheName()
+        pix = self.nbody.domain.pix
+
+        offsets = np.load('{}.offsets.npy'.format(fname))
+        r = np.load('{}.r.npy'.format(fname), mmap_mode='r')
+        r = r[offsets[pix]:offsets[pix + 1]]
+
+        # halos in each cell are sorted by radius
+        lo = offsets[pix] + r.searchsorted(self.nbody.domain.rmin, side='right')
+        hi = offsets[pix] + r.searchsorted(self.nbody.domain.rmax, side='right')
+
+        catalog = {}
+        for k in list(self.getColumnDict(self.nbody.domain.fmt).keys()) + ['rnn', 'r']:
+            data = np.load('{}.{}.npy'.format(fname, k), mmap_mode='r')
+            catalog[k] = np.array(data[lo:hi])
+
+        return catalog, catalog.pop('rnn'), catalog.pop('r')
+
+    def readRockstarLightconeFile(self):
+
+        cachefile = self.getLightconeCacheName()
+        halos = getattr(self.nbody.domain, 'halos', None)
+
+        if (cachefile is not None) and (halos is None):
+            # converting here would have every task convert the same
+            # catalog at once, so the cache is made before painting
+            if self.needsLightconeCache():
+                raise(IOError('Halo cache {} has not been made, run bin/make_halo_cache.py'.format(cachefile)))
+
+            catalog, rnn, r = self.readRockstarLightconeCache()
+
+        else:
+            if halos is not None:
+                # halos already distributed to this task by distributeHalos
+                catalog = halos[self.nbody.boxnum]
+                rnn = catalog['rnn']
+            else:
+                catalog, rnn = self.readRockstarLightconeAscii()
+
+            # get the part of the catalog for this task
+            r = np.sqrt(catalog['x']**2 + catalog['y']**2 + catalog['z']**2)
+            pix = hp.vec2pix(self.nbody.domain.nside, catalog['x'],
+                             catalog['y'], catalog['z'],
+                             nest=self.nbody.domain.nest)
+            idx = (self.nbody.domain.rmin < r) & (r <= self.nbody.domain.rmax)
+            idx = (self.nbody.domain.pix == pix) & idx
+            catalog = catalog[idx]
+            r = r[idx]
+            rnn = rnn[idx]
+
+            del idx
 
         self.catalog = {}
 
@@ -112,21 +237,16 @@ class HaloCatalog(object):
         self.catalog['z'] = self.nbody.cosmo.zofR(r)
         del r
         self.catalog['id'] = catalog['id']
-
-        ind = [names.index(c) for c in ['x', 'y', 'z']]
-        self.catalog['pos'] = catalog.view(
-            (np.float, len(cdict.keys())))[:, ind]
-
-        ind = [names.index(c) for c in ['vx', 'vy', 'vz']]
-        self.catalog['vel'] = catalog.view(
-            (np.float, len(cdict.keys())))[:, ind]
-
+        self.catalog['pos'] = np.vstack([catalog['x'], catalog['y'],
+                                         catalog['z']]).T
+        self.catalog['vel'] = np.vstack([catalog['vx'], catalog['vy'],
+                                         catalog['vz']]).T
         self.catalog['pid'] = catalog['pid']
         self.catalog['mass'] = catalog['mass']
         self.catalog['radius'] = catalog['radius'] / \
             1000.  # convert kpc to mpc
         self.catalog['rs'] = catalog['rs'] / 1000.  # convert kpc to mpc
-        self.catalog['rnn'] = rnn[:, 1]
+        self.catalog['rnn'] = rnn
 
     def readHaloRnn(self, filepath):
         """
@@ -139,15 +259,53 @@ class HaloCatalog(object):
         delta = np.genfromtxt(filepath, dtype=dtype)
         return delta['delta']
 
-    def readRockstarSnapshotFile(self):
+    def getSubboxIndex(self, catalog):
+        """Get the index of the subbox that each halo falls in.
+
+        Parameters
+        ----------
+        catalog : np.array
+            Halo catalog containing x, y, z columns
+
+        Returns
+        -------
+        idx : np.array
+            Subbox index of each halo
+        """
+
         boxnum = self.nbody.boxnum
         nbox = self.nbody.domain.nbox[boxnum]
 
-        snapnum = self.nbody.domain.snapnum
-        if snapnum < 10:
-            snapnum = '0{}'.format(snapnum)
-        else:
-            snapnum = '{}'.format(snapnum)
+        idxx = nbox * catalog['x'] // self.nbody.domain.lbox[boxnum]
+        idxy = nbox * catalog['y'] // self.nbody.domain.lbox[boxnum]
+        idxz = nbox * catalog['z'] // self.nbody.domain.lbox[boxnum]
+        idx = idxx * nbox ** 2 + idxy * nbox + idxz
+
+        return idx.astype(np.int64)
+
+    def getSnapshotCacheName(self, snapnum):
+        """Get the base name of the subbox cache files for a snapshot
+        halo catalog.
+
+        Parameters
+        ----------
+        snapnum : str
+            Zero padded snapshot number
+
+        Returns
+        -------
+        fname : str
+            Base name of the cache files, or None if no cache path is set
+        """
+
+        cachepath = self.nbody.cachepath[self.nbody.boxnum]
+
+        if cachepath is None:
+            return None
+
+        return '{}/halos_{}_{}'.format(cachepath, self.nbody.boxnum, snapnum)
+
+    def readRockstarSnapshotAscii(self, snapnum):
 
         cdict = self.getColumnDict(self.nbody.domain.fmt)
 
@@ -159,21 +317,92 @@ class HaloCatalog(object):
 
         reader = TabularAsciiReader(halofile, cdict)
         catalog = reader.read_ascii()
-        names = catalog.dtype.names
 
         rnn = self.readHaloRnn(halornnfile)
 
-        # get the part of the catalog for this task
-        idxx = nbox * catalog['x'] // self.nbody.domain.lbox[boxnum]
-        idxy = nbox * catalog['y'] // self.nbody.domain.lbox[boxnum]
-        idxz = nbox * catalog['z'] // self.nbody.domain.lbox[boxnum]
-        idx = idxx * nbox ** 2 + idxy * nbox + idxz
-        idx = idx == self.nbody.domain.subbox
+        return catalog, rnn
+
+    def partitionRockstarSnapshot(self):
+        """Parse a snapshot halo catalog once and write it, along with
+        the halo densities, to binary cache files sorted by subbox with an
+        offset index.
+
+        Returns
+        -------
+        None
+        """
 
-        catalog = catalog[idx]
-        rnn = rnn[idx]
+        boxnum = self.nbody.boxnum
+        nsubbox = self.nbody.domain.nbox[boxnum] ** 3
 
-        del idx
+        snapnum = self.nbody.domain.snapnum
+        if snapnum < 10:
+            snapnum = '0{}'.format(snapnum)
+        else:
+            snapnum = '{}'.format(snapnum)
+
+        catalog, rnn = self.readRockstarSnapshotAscii(snapnum)
+
+        sidx = self.getSubboxIndex(catalog)
+        idx = (0 <= sidx) & (sidx < nsubbox)
+        sidx = sidx[idx]
+
+        order = sidx.argsort(kind='mergesort')
+        counts = np.bincount(sidx, minlength=nsubbox)
+        offsets = np.hstack([[0], np.cumsum(counts)]).astype(np.int64)
+
+        fname = self.getSnapshotCacheName(snapnum)
+        print('Writing subbox cache {}'.format(fname))
+
+        # offsets are written last, and their presence marks
+        # a complete cache
+        for ext, data in [('rnn', rnn[idx][order]),
+                          ('halos', catalog[idx][order]),
+                          ('offsets', offsets)]:
+            with open('{}.{}.npy.tmp'.format(fname, ext), 'wb') as fp:
+                np.save(fp, data)
+
+            os.rename('{}.{}.npy.tmp'.format(fname, ext),
+                      '{}.{}.npy'.format(fname, ext))
+
+    def readRockstarSnapshotCache(self, snapnum):
+
+        fname = self.getSnapshotCacheName(snapnum)
+        subbox = self.nbody.domain.subbox
+
+        offsets = np.load('{}.offsets.npy'.format(fname))
+        catalog = np.load('{}.halos.npy'.format(fname), mmap_mode='r')
+        rnn = np.load('{}.rnn.npy'.format(fname), mmap_mode='r')
+
+        catalog = np.array(catalog[offsets[subbox]:offsets[subbox + 1]])
+        rnn = np.array(rnn[offsets[subbox]:offsets[subbox + 1]])
+
+        return catalog, rnn
+
+    def readRockstarSnapshotFile(self):
+        snapnum = self.nbody.domain.snapnum
+        if snapnum < 10:
+            snapnum = '0{}'.format(snapnum)
+        else:
+            snapnum = '{}'.format(snapnum)
+
+        cdict = self.getColumnDict(self.nbody.domain.fmt)
+
+        cachefile = self.getSnapshotCacheName(snapnum)
+        if (cachefile is not None) and os.path.exists('{}.offsets.npy'.format(cachefile)):
+            catalog, rnn = self.readRockstarSnapshotCache(snapnum)
+        else:
+            catalog, rnn = self.readRockstarSnapshotAscii(snapnum)
+
+            # get the part of the catalog for this task
+            idx = self.getSubboxIndex(catalog) == self.nbody.domain.subbox
+
+            catalog = catalog[idx]
+            rnn = rnn[idx]
+
+            del idx
+
+        names = catalog.dtype.names
 
         self.catalog = {}
 
@@ -0,0 +1,207 @@
+from __future__ import print_function, division
+from glob import glob
+import json
+import re
+import os
+
+from .catalogIO import FITSWriter
+
+
+class DomainManifest(object):
+    """Record of the domains of a run that have been completely written,
+    and the rows of each output file that they wrote.
+
+    Each line of the manifest is a JSON record of one domain, appended only
+    after all of its output has been written. Rows of an output file not
+    accounted for by the manifest belong to a domain whose write was
+    interrupted, and are removed when a run is restarted.
+    """
+
+    def __init__(self, filename):
+        """Create a DomainManifest.
+
+        Parameters
+        ----------
+        filename : str
+            Path of the manifest file
+
+        Returns
+        -------
+        None
+        """
+
+        self.filename = filename
+        self.completed = set()
+        self.nrows = {}
+        self.fp = None
+
+    def load(self):
+        """Read the domains and row ranges recorded in an existing manifest.
+        A partially written last line, e.g. from a job that was killed,
+        is ignored.
+
+        Returns
+        -------
+        None
+        """
+
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename, 'r') as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                self._addRecord(record)
+
+    def _addRecord(self, record):
+
+        if 'domains' in record:
+            self.completed.update([tuple(key) for key in record['domains']])
+        else:
+            self.completed.add(tuple(record['domain']))
+
+        for fname, start, count in record['files']:
+            self.nrows[fname] = max(self.nrows.get(fname, 0), start + count)
+
+    def isComplete(self, key):
+        """Check whether a domain has already been written.
+
+        Parameters
+        ----------
+        key : tuple
+            Domain key, as returned by Domain.getDomainKey
+
+        Returns
+        -------
+        complete : bool
+            True if the domain is in the manifest
+        """
+
+        return tuple(key) in self.completed
+
+    def recover(self, outpath, writer=None):
+        """Remove rows from output files that were written by domains
+        that did not finish. Files with no completed rows are deleted.
+
+        Parameters
+        ----------
+        outpath : str
+            Output path prefix, as used by GalaxyCatalog.write. A * in
+            the prefix matches any rank, e.g. for shard prefixes.
+        writer : FITSWriter or HDF5Writer
+            Object used to read and write the output format.
+            Defaults to FITS.
+
+        Returns
+        -------
+        None
+        """
+
+        if writer is None:
+            writer = FITSWriter()
+
+        # only touch the files that this prefix's writes are named as,
+        # <outpath>.<pix or snapnum>[.lens]<ext>, so that e.g. shards of an
+        # earlier run in another write mode are left alone
+        pattern = re.compile(r'{}\.\d+(\.lens)?{}$'.format(re.escape(outpath).replace(r'\*', r'\d+'),
+                                                         re.escape(writer.extension)))
+
+        for fname in glob('{}.*{}'.format(outpath, writer.extension)):
+            if pattern.match(fname) is None:
+                continue
+
+            nrows = self.nrows.get(fname, 0)
+
+            if nrows == 0:
+                print('Removing incomplete file {}'.format(fname))
+                os.remove(fname)
+                continue
+
+            nrows_file = writer.nrows(fname)
+
+            if nrows_file > nrows:
+                print('Truncating {} from {} to {} rows'.format(fname, nrows_file,
+                                                               nrows))
+                writer.resize(fname, nrows)
+            elif nrows_file < nrows:
+                raise(IOError('{} has {} rows, but the manifest records {}'.format(fname,
+                                                                                   nrows_file,
+                                                                                   nrows)))
+
+    def open(self, restart=True):
+        """Open the manifest for appending records.
+
+        Parameters
+        ----------
+        restart : bool
+            If False, any existing manifest is discarded
+
+        Returns
+        -------
+        None
+        """
+
+        if restart:
+            self.fp = open(self.filename, 'a')
+        else:
+            self.completed = set()
+            self.nrows = {}
+            self.fp = open(self.filename, 'w')
+
+    def add(self, key, files):
+        """Record a domain whose output has been completely written.
+
+        Parameters
+        ----------
+        key : tuple
+            Domain key, as returned by Domain.getDomainKey
+        files : list
+            (filename, first row, number of rows) for each file written
+
+        Returns
+        -------
+        None
+        """
+
+        record = {'domain': list(key),
+                  'files': [[f, int(s), int(c)] for f, s, c in files]}
+        self._addRecord(record)
+
+        self.fp.write(json.dumps(record) + '\n')
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    def addBatch(self, keys, files):
+        """Record a group of domains whose output was written together.
+        They are recorded in a single line, so that either all or none
+        of them are complete when a run is restarted.
+
+        Parameters
+        ----------
+        keys : list
+            Domain keys, as returned by Domain.getDomainKey
+        files : list
+            (filename, first row, number of rows) for each file written
+
+        Returns
+        -------
+        None
+        """
+
+        record = {'domains': [list(key) for key in keys],
+                  'files': [[f, int(s), int(c)] for f, s, c in files]}
+        self._addRecord(record)
+
+        self.fp.write(json.dumps(record) + '\n')
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    def close(self):
+
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
@@ -0,0 +1,193 @@
+from __future__ import print_function, division
+from glob import glob
+import numpy as np
+import json
+import os
+
+from .catalogIO import FITSWriter
+
+
+def getShardPrefix(outpath, rank):
+    """Output path prefix used by a task writing its own shard files.
+
+    Parameters
+    ----------
+    outpath : str
+        Output path prefix of the merged catalog
+    rank : int
+        Rank of the task writing the shards
+
+    Returns
+    -------
+    prefix : str
+        Prefix to pass to GalaxyCatalog.write
+    """
+
+    return '{}.shard{}'.format(outpath, rank)
+
+
+def findShards(outpath, extension='.fits'):
+    """Find the shard files written by every task, grouped by the
+    output file they will be merged into.
+
+    Parameters
+    ----------
+    outpath : str
+        Output path prefix of the merged catalog
+    extension : str
+        File extension of the output format
+
+    Returns
+    -------
+    shards : dict
+        Keys are output file suffixes, e.g. '17.fits' or '17.lens.fits',
+        values are the shard files for that output, ordered by rank
+    """
+
+    prefix = '{}.shard'.format(outpath)
+    shards = {}
+
+    for fname in glob('{}*{}'.format(prefix, extension)):
+        rank, suffix = fname[len(prefix):].split('.', 1)
+
+        try:
+            rank = int(rank)
+        except ValueError:
+            continue
+
+        shards.setdefault(suffix, []).append((rank, fname))
+
+    return {suffix: [f for r, f in sorted(shards[suffix])] for suffix in shards}
+
+
+def mergeShards(outpath, suffix, shards, id_base=0, writer=None,
+                chunk_size=1000000):
+    """Concatenate the shards of one output file, optionally assigning
+    IDs that are contiguous within the merged file. If the merged file
+    already exists, e.g. from before a restart, its rows are kept ahead
+    of the shards'. The shards are removed once merged.
+
+    Parameters
+    ----------
+    outpath : str
+        Output path prefix of the merged catalog
+    suffix : str
+        Suffix of the output file, as returned by findShards
+    shards : list
+        Shard files to merge, in order
+    id_base : int
+        ID of the first galaxy in the merged file. If None, the IDs
+        in the shards are kept.
+    writer : FITSWriter or HDF5Writer
+        Object used to read and write the output format. Defaults to FITS.
+    chunk_size : int
+        Number of rows of an existing merged file to copy at a time
+
+    Returns
+    -------
+    nrows : int
+        Number of rows in the merged file
+    """
+
+    if writer is None:
+        writer = FITSWriter()
+
+    fname = '{}.{}'.format(outpath, suffix)
+    tmp = '{}.tmp'.format(fname)
+    print('Merging {} shards into {}'.format(len(shards), fname))
+
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    nrows = 0
+    reads = []
+
+    # domains merged before a restart are marked complete in the
+    # manifest and won't be repainted, so keep them
+    if os.path.exists(fname):
+        n = writer.nrows(fname)
+        reads.extend([(fname, np.arange(i, min(i + chunk_size, n)))
+                      for i in range(0, n, chunk_size)])
+
+    reads.extend([(s, None) for s in shards])
+
+    # read one shard at a time so that memory use doesn't depend on
+    # the size of the merged file
+    for f, rows in reads:
+        g = writer.read(f, rows=rows)
+
+        if id_base is not None:
+            g['ID'] = id_base + nrows + np.arange(len(g), dtype=np.int64)
+
+        writer.append(tmp, g)
+
+        nrows += len(g)
+        del g
+
+    # record which shards are in the new file before it replaces the
+    # old one, so that a restart removes them instead of merging them
+    # again if the job dies before they are removed
+    record = '{}.merged'.format(fname)
+    with open(record + '.tmp', 'w') as fp:
+        json.dump(list(shards), fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    os.rename(record + '.tmp', record)
+
+    finishMerge(fname)
+
+    return nrows
+
+
+def finishMerge(fname):
+    """Finish a merge whose shards have been recorded in fname.merged,
+    moving the merged file into place if that hasn't been done yet and
+    removing the recorded shards.
+
+    Parameters
+    ----------
+    fname : str
+        Merged file
+
+    Returns
+    -------
+    None
+    """
+
+    record = '{}.merged'.format(fname)
+    tmp = '{}.tmp'.format(fname)
+
+    with open(record, 'r') as fp:
+        shards = json.load(fp)
+
+    # the record is only written once the merged file is complete
+    if os.path.exists(tmp):
+        os.rename(tmp, fname)
+
+    for s in shards:
+        if os.path.exists(s):
+            os.remove(s)
+
+    os.remove(record)
+
+
+def recoverMerges(outpath):
+    """Finish merges interrupted after their shards were recorded, e.g.
+    by a job being killed. Must be called before any new shards are
+    written, since they reuse the names of earlier runs' shards.
+
+    Parameters
+    ----------
+    outpath : str
+        Output path prefix of the merged catalog
+
+    Returns
+    -------
+    None
+    """
+
+    for record in glob('{}.*.merged'.format(outpath)):
+        fname = record[:-len('.merged')]
+        print('Finishing interrupted merge into {}'.format(fname))
+        finishMerge(fname)
@@ -1,8 +1,12 @@
 from __future__ import print_function, division
+from copy import copy
+import healpy as hp
+import numpy as np
 
 from .particle import ParticleCatalog
 from .halo import HaloCatalog
 from .galaxy import GalaxyCatalog
+from .trace import span
 
 
 class NBody(object):
@@ -11,7 +15,7 @@ class NBody(object):
 
     def __init__(self, cosmo, domain, partpath=None, denspath=None,
                  hinfopath=None, halofile=None, halodensfile=None,
-                 n_blocks=None, f_downsample=1.):
+                 n_blocks=None, f_downsample=1., cachepath=None):
         """Create NBody object.
 
         Parameters
@@ -32,6 +36,10 @@ class NBody(object):
             Path to halo catalog
         n_blocks : int/str or list
             Number of blocks in the snapshot
+        cachepath : str or list
+            Path to subbox cache files for snapshots. If the cache
+            exists, subbox domains read from it instead of the
+            full snapshot.
 
         Returns
         -------
@@ -98,6 +106,11 @@ class NBody(object):
             else:
                 self.n_blocks = n_blocks
 
+        if isinstance(cachepath, str) | (cachepath is None):
+            self.cachepath = [cachepath] * len(self.partpath)
+        else:
+            self.cachepath = cachepath
+
         if isinstance(f_downsample, str) | isinstance(f_downsample, (int, float, complex)):
             self.f_downsample = [f_downsample] * len(self.partpath)
         else:
@@ -110,14 +123,175 @@ class NBody(object):
         self.boxnum = self.domain.boxnum
 
     def read(self):
-        if self.domain.fmt == 'BCCLightcone':
-            self.haloCatalog.read()
-            self.particleCatalog.read()
+        # may be called from a prefetching thread, so give the domain
+        with span('read', domain=self.domain.key) as sp:
+            if self.domain.fmt == 'BCCLightcone':
+                with span('read_halos'):
+                    self.haloCatalog.read()
+                with span('read_particles'):
+                    self.particleCatalog.read()
+            else:
+                with span('read_particles'):
+                    self.particleCatalog.read()
+                with span('read_halos'):
+                    self.haloCatalog.read()
+
+            sp.set(n_part=len(self.particleCatalog.catalog.get('pos', [])),
+                   n_halo=len(self.haloCatalog.catalog.get('mass', [])))
+
+    def partitionSnapshot(self, block):
+        """Write the subbox cache for one block of a snapshot. A block
+        of -1 partitions the halo catalog.
+
+        Parameters
+        ----------
+        block : int
+            Snapshot block to partition, or -1 for the halo catalog
+
+        Returns
+        -------
+        None
+        """
+
+        if self.cachepath[self.boxnum] is None:
+            raise(ValueError("cachepath must be defined to partition snapshots"))
+
+        if block < 0:
+            self.haloCatalog.partitionRockstarSnapshot()
         else:
-            self.particleCatalog.read()
-            self.haloCatalog.read()
+            self.particleCatalog.partitionSnapshotBlock(block)
 
     def delete(self):
         self.particleCatalog.delete()
         self.haloCatalog.delete()
         self.galaxyCatalog.delete()
+
+
+def distributeHalos(comm, cosmo, domain, nb_config, owners, root=0):
+    """Read the lightcone halo catalogs once on the root task, and
+    send every task only the halos that fall in the domains it owns,
+    including their buffer regions. The halos are stored in domain.halos,
+    keyed by box number, and are used by HaloCatalog instead of reading
+    the halo catalog again.
+
+    Parameters
+    ----------
+    comm : MPI.Intracomm
+        Communicator for tasks
+    cosmo : Cosmology
+        Object containing cosmology information
+    domain : Domain
+        Domain object that has already been decomposed
+    nb_config : dict
+        Keyword arguments used to construct NBody objects
+    owners : list
+        Rank of the task that owns each domain in domain.domains
+    root : int
+        Rank of the task that reads the halo catalogs
+
+    Returns
+    -------
+    None
+    """
+
+    from mpi4py import MPI
+
+    if domain.fmt != 'BCCLightcone':
+        raise(ValueError('Can only distribute halos for BCCLightcone domains'))
+
+    # e.g. a restart where every domain is complete, so nothing
+    # needs to be read
+    if comm.bcast(len(domain.domains), root=root) == 0:
+        return
+
+    if comm.rank == root:
+        halos = []
+        dest = []
+        d = copy(domain)
+
+        for boxnum in range(len(domain.lbox)):
+            d.boxnum = boxnum
+            nbody = NBody(cosmo, d, **nb_config)
+            catalog, rnn = nbody.haloCatalog.readRockstarLightconeAscii()
+
+            r = np.sqrt(catalog['x']**2 + catalog['y']**2 + catalog['z']**2)
+            pix = hp.vec2pix(domain.nside, catalog['x'], catalog['y'],
+                             catalog['z'], nest=domain.nest)
+
+            # sort by pixel, then radius, so each domain is a contiguous slice
+            idx = np.lexsort((r, pix))
+            catalog = catalog[idx]
+            rnn = rnn[idx]
+            r = r[idx]
+            pix = pix[idx]
+
+            cdtype = np.dtype(catalog.dtype.descr + [('rnn', np.float64),
+                                                     ('boxnum', np.int64)])
+            hbox = np.zeros(len(catalog), dtype=cdtype)
+            for k in catalog.dtype.names:
+                hbox[k] = catalog[k]
+            hbox['rnn'] = rnn
+            hbox['boxnum'] = boxnum
+            del catalog, rnn
+
+            # boxes with no halos in any domain still give the dtype
+            halos.append(hbox[:0])
+            dest.append(np.zeros(0, dtype=np.int64))
+
+            task_idx = [[] for i in range(comm.size)]
+
+            for j, dj in enumerate(domain.yieldAllDomains()):
+                if dj.boxnum != boxnum:
+                    continue
+
+                # split domains are sent all halos in their unsplit pixel
+                plo = pix.searchsorted(dj.basepix, side='left')
+                phi = pix.searchsorted(dj.basepix, side='right')
+                lo = plo + r[plo:phi].searchsorted(dj.rmin, side='right')
+                hi = plo + r[plo:phi].searchsorted(dj.rmax, side='right')
+
+                task_idx[owners[j]].append(np.arange(lo, hi))
+
+            for i in range(comm.size):
+                if len(task_idx[i]) > 0:
+                    # domains overlap in their buffers, only send each halo once
+                    halos.append(hbox[np.unique(np.hstack(task_idx[i]))])
+                    dest.append(np.zeros(len(halos[-1]), dtype=np.int64) + i)
+
+            del hbox, r, pix
+
+        halos = np.hstack(halos)
+        dest = np.hstack(dest)
+
+        idx = dest.argsort(kind='mergesort')
+        halos = halos[idx]
+        counts = np.bincount(dest, minlength=comm.size)
+        displs = np.hstack([[0], np.cumsum(counts)[:-1]])
+        del dest, idx
+
+        dtype = halos.dtype
+    else:
+        halos = None
+        counts = None
+        displs = None
+        dtype = None
+
+    dtype = comm.bcast(dtype, root=root)
+    count = comm.scatter(counts, root=root)
+
+    # send whole records so that counts stay small for large catalogs
+    rtype = MPI.BYTE.Create_contiguous(dtype.itemsize).Commit()
+
+    recv = np.zeros(count, dtype=dtype)
+
+    if comm.rank == root:
+        comm.Scatterv([halos, counts, displs, rtype], [recv, rtype], root=root)
+    else:
+        comm.Scatterv(None, [recv, rtype], root=root)
+
+    rtype.Free()
+    del halos
+
+    domain.halos = {}
+    for boxnum in range(len(domain.lbox)):
+        domain.halos[boxnum] = recv[recv['boxnum'] == boxnum]
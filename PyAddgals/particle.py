@@ -4,6 +4,7 @@ from collections import namedtuple
 import healpy as hp
 import numpy as np
 import struct
+import os
 
 
 class ParticleCatalog(object):
@@ -13,6 +14,10 @@ class ParticleCatalog(object):
     GadgetHeader = namedtuple('GadgetHeader',
                               'npart mass time redshift flag_sfr flag_feedback npartTotal flag_cooling num_files BoxSize Omega0 OmegaLambda HubbleParam flag_age flag_metals NallHW flag_entr_ics')
 
+    __snapshot_cache_dtype = np.dtype([('pos', np.float32, 3),
+                                       ('vel', np.float32, 3),
+                                       ('rnn', np.float32)])
+
     def __init__(self, nbody, **kwargs):
         """Short summary.
 
@@ -205,7 +210,7 @@ class ParticleCatalog(object):
         data.append(h)
 
         # read the peano index
-        idx = np.fromstring(fp.read(idxfmt.itemsize * indexnpix), idxfmt)
+        idx = np.fromfile(fp, idxfmt, indexnpix)
         counter += idxfmt.itemsize * indexnpix
 
         data.append(idx)
@@ -243,8 +248,8 @@ class ParticleCatalog(object):
                                 fmt[i].itemsize * npart_seek[j], 1)
 
                         d[npart_read_cum[j] * item_per_row[i]:npart_read_cum[j + 1] * item_per_row[i]] = \
-                            np.fromstring(
-                                fp.read(int(npart_read[j] * item_per_row[i] * fmt[i].itemsize)), fmt[i])
+                            np.fromfile(fp, fmt[i],
+                                        int(npart_read[j] * item_per_row[i]))
 
                     fp.seek(
                         int(npart * item_per_row[i] * fmt[i].itemsize) + counter, 0)
@@ -283,7 +288,7 @@ class ParticleCatalog(object):
             for j, p in enumerate(peano_inds):
                 fp.seek(fmt.itemsize * npart_seek[j], 1)
                 d[npart_read_cum[j]:npart_read_cum[j + 1]
-                  ] = np.fromstring(fp.read(int(npart_read[j] * fmt.itemsize)), fmt)
+                  ] = np.fromfile(fp, fmt, int(npart_read[j]))
 
             fp.seek(int(fmt.itemsize * (npart - npart_read_cum[-1])), 1)
 
@@ -308,7 +313,7 @@ class ParticleCatalog(object):
             for j, p in enumerate(peano_inds):
                 fp.seek(fmt.itemsize * npart_seek[j], 1)
                 d[npart_read_cum[j]:npart_read_cum[j + 1]
-                  ] = np.fromstring(fp.read(int(npart_read[j] * fmt.itemsize)), fmt)
+                  ] = np.fromfile(fp, fmt, int(npart_read[j]))
 
             fp.seek(int(fmt.itemsize * (npart - npart_read_cum[-1])), 1)
 
@@ -382,11 +387,9 @@ class ParticleCatalog(object):
         r = np.sqrt(np.sum(pos**2, axis=1))
         idx = (self.nbody.domain.rmin <= r) & (r < self.nbody.domain.rmax)
 
-        # cut to first two octants
-        ra, dec = hp.vec2ang(pos, lonlat=True)
-        idx &= (ra <= 180) & (dec >= 0)
+        # cut to the octants in the footprint
+        idx &= self.nbody.domain.inFootprint(pos)
         r = r[idx]
-        del ra, dec
 
         self.catalog['z'] = self.nbody.cosmo.zofR(r)
         del r
@@ -406,7 +409,7 @@ class ParticleCatalog(object):
 
     def readGadgetSnapshot(self, filename, read_pos=True, read_vel=True, read_id=False,
                            read_mass=False, print_header=False, single_type=-1,
-                           lgadget=True):
+                           lgadget=True, mmap=False):
         """
         This function reads the Gadget-2 snapshot file. Taken from Yao-Yuan Mao's
         helpers module.
@@ -431,6 +434,9 @@ class ParticleCatalog(object):
         lgadget : bool, optional
             Set to True if the particle file comes from l-gadget.
             Default is false.
+        mmap : bool, optional
+            If True, return read-only memory maps of the requested blocks
+            instead of reading them into memory. Default is false.
 
         Returns
         -------
@@ -503,8 +509,13 @@ class ParticleCatalog(object):
                         npart_this = npart[single_type]
                     else:
                         npart_this = sum(npart)
-                    data = np.fromstring(
-                        f.read(npart_this * size_per_part), fmt)
+                    if mmap:
+                        data = np.memmap(filename, dtype=fmt, mode='r',
+                                         offset=f.tell(),
+                                         shape=(npart_this * item_per_part,))
+                        f.seek(npart_this * size_per_part, 1)
+                    else:
+                        data = np.fromfile(f, fmt, npart_this * item_per_part)
                     if item_per_part > 1:
                         data.shape = (npart_this, item_per_part)
                     ret.append(data)
@@ -516,20 +527,52 @@ class ParticleCatalog(object):
         #
         return tuple(ret)
 
-    def readPartRnn(self, filepath):
+    def readPartRnn(self, filepath, start=0, count=None, mmap=False):
         """
         Read binary output from calcRnn code for particles
         into a numpy array
+
+        Parameters
+        ----------
+        filepath : str
+            Path to the density file
+        start : int, optional
+            Index of the first particle to read
+        count : int, optional
+            Number of particles to read. Defaults to all particles
+            after start.
+        mmap : bool, optional
+            If True, return a read-only memory map rather than reading
+            the densities into memory.
+
+        Returns
+        -------
+        delta : np.array
+            float32 array of particle densities
         """
 
+        fmt = np.dtype(np.float32)
+
         with open(filepath, 'rb') as fp:
             # read header
-            bytes = fp.read(4 * 5)
-            head = struct.unpack('iiiii', bytes)
-            # read in densities
-            bytes = fp.read()
-            delta = struct.unpack('{0}f'.format(head[1]), bytes[:-4])
-            delta = np.array(delta)
+            head = np.fromfile(fp, np.int32, 5)
+            npart = int(head[1])
+
+            if count is None:
+                count = npart - start
+
+            if (start < 0) | (start + count > npart):
+                raise(ValueError('Requested particles {}:{} of {} in {}'.format(start, start + count,
+                                                                              npart, filepath)))
+
+            offset = head.nbytes + start * fmt.itemsize
+
+            if mmap:
+                delta = np.memmap(filepath, dtype=fmt, mode='r',
+                                  offset=offset, shape=(count,))
+            else:
+                fp.seek(offset, 0)
+                delta = np.fromfile(fp, fmt, count)
 
         return delta
 
@@ -545,6 +588,163 @@ class ParticleCatalog(object):
 
         return hdr.npartTotal[1] + hdr.NallHW[1] * 2**32
 
+    def getSubboxIndex(self, pos):
+        """Get the index of the subbox that each position falls in.
+
+        Parameters
+        ----------
+        pos : np.array
+            Array of positions of shape (N, 3)
+
+        Returns
+        -------
+        idx : np.array
+            Subbox index of each position
+        """
+
+        boxnum = self.nbody.boxnum
+        nbox = self.nbody.domain.nbox[boxnum]
+
+        idx = nbox * pos // self.nbody.domain.lbox[boxnum]
+        idx = idx[:, 0] * nbox ** 2 + idx[:, 1] * nbox + idx[:, 2]
+
+        return idx.astype(np.int64)
+
+    def getSnapshotCacheName(self, snapnum, block):
+        """Get the name of the subbox cache file for a snapshot block.
+
+        Parameters
+        ----------
+        snapnum : str
+            Zero padded snapshot number
+        block : int
+            Snapshot block number
+
+        Returns
+        -------
+        fname : str
+            Name of the cache file, or None if no cache path is set
+        """
+
+        cachepath = self.nbody.cachepath[self.nbody.boxnum]
+
+        if cachepath is None:
+            return None
+
+        return '{}/snapshot_{}_{}.{}'.format(cachepath, self.nbody.boxnum,
+                                             snapnum, block)
+
+    def partitionSnapshotBlock(self, block):
+        """Read a single snapshot block and its densities and write them
+        to a cache file sorted by subbox, with an offset index, so that
+        each subbox domain only has to read its own particles.
+
+        Parameters
+        ----------
+        block : int
+            Snapshot block to partition
+
+        Returns
+        -------
+        None
+        """
+
+        boxnum = self.nbody.boxnum
+        snapnum = self.nbody.domain.snapnum
+        if snapnum < 10:
+            snapnum = '0{}'.format(snapnum)
+        else:
+            snapnum = '{}'.format(snapnum)
+
+        nsubbox = self.nbody.domain.nbox[boxnum] ** 3
+
+        partpath = '{}.{}'.format(self.nbody.partpath[boxnum].format(snapnum=snapnum), block)
+        denspath = '{}.{}'.format(self.nbody.denspath[boxnum].format(snapnum=snapnum), block)
+
+        hdr, pos, vel = self.readGadgetSnapshot(partpath)
+        rnn = self.readPartRnn(denspath)
+
+        sidx = self.getSubboxIndex(pos)
+        idx = (0 <= sidx) & (sidx < nsubbox)
+        sidx = sidx[idx]
+
+        order = sidx.argsort(kind='mergesort')
+        counts = np.bincount(sidx, minlength=nsubbox)
+        offsets = np.hstack([[0], np.cumsum(counts)]).astype(np.int64)
+
+        data = np.zeros(len(sidx), dtype=ParticleCatalog.__snapshot_cache_dtype)
+        data['pos'] = pos[idx][order]
+        del pos
+        data['vel'] = vel[idx][order]
+        del vel
+        data['rnn'] = rnn[idx][order]
+        del rnn, sidx, order
+
+        fname = self.getSnapshotCacheName(snapnum, block)
+        print('Writing subbox cache {}'.format(fname))
+
+        # write to a temporary file first so that a partially written
+        # cache is never read
+        with open(fname + '.tmp', 'wb') as fp:
+            np.array([nsubbox], dtype=np.int64).tofile(fp)
+            offsets.tofile(fp)
+            np.array([hdr.redshift, hdr.mass[1] * 10**10],
+                     dtype=np.float64).tofile(fp)
+            data.tofile(fp)
+
+        os.rename(fname + '.tmp', fname)
+
+    def readSnapshotCache(self, snapnum):
+        """Read this domain's particles from the subbox cache files
+        written by partitionSnapshotBlock.
+
+        Parameters
+        ----------
+        snapnum : str
+            Zero padded snapshot number
+
+        Returns
+        -------
+        None
+        """
+
+        boxnum = self.nbody.boxnum
+        subbox = self.nbody.domain.subbox
+        dtype = ParticleCatalog.__snapshot_cache_dtype
+
+        data = []
+
+        for i in range(self.nbody.n_blocks[boxnum]):
+            with open(self.getSnapshotCacheName(snapnum, i), 'rb') as fp:
+                nsubbox = np.fromfile(fp, np.int64, 1)[0]
+                offsets = np.fromfile(fp, np.int64, nsubbox + 1)
+                redshift, part_mass = np.fromfile(fp, np.float64, 2)
+
+                fp.seek(int(offsets[subbox] * dtype.itemsize), 1)
+                data.append(np.fromfile(fp, dtype,
+                                        offsets[subbox + 1] - offsets[subbox]))
+
+            if i == 0:
+                self.nbody.domain.zmean = redshift
+                self.nbody.domain.zmin = redshift
+                self.nbody.domain.zmax = redshift
+                print(self.nbody.domain.zmean)
+                self.part_mass = part_mass
+
+        data = np.hstack(data)
+
+        self.catalog = {}
+        self.catalog['pos'] = data['pos'].astype(np.float64)
+        self.catalog['vel'] = data['vel'].astype(np.float64)
+        self.catalog['rnn'] = data['rnn'].astype(np.float64)
+        del data
+
+        self.catalog['z'] = np.zeros_like(self.catalog['rnn']) + self.nbody.domain.zmean
+        self.catalog['rhalo'] = np.zeros_like(self.catalog['rnn'])
+        self.catalog['radius'] = np.zeros_like(self.catalog['rnn'])
+        self.catalog['haloid'] = np.zeros_like(self.catalog['rnn'])
+        self.catalog['mass'] = np.zeros_like(self.catalog['rnn'])
+
     def readSnapshot(self):
         """Read particles and densities for snapshot catalog.
 
@@ -560,6 +760,14 @@ class ParticleCatalog(object):
         else:
             snapnum = '{}'.format(snapnum)
 
+        # only use the cache if every block was partitioned, e.g. not
+        # after an interrupted partitioning run
+        cachefiles = [self.getSnapshotCacheName(snapnum, i)
+                      for i in range(self.nbody.n_blocks[boxnum])]
+        if (cachefiles[0] is not None) and all([os.path.exists(f) for f in cachefiles]):
+            self.readSnapshotCache(snapnum)
+            return
+
         nbox = self.nbody.domain.nbox[boxnum]
 
         npart_tot = self.getNPartSnapshot()
@@ -585,9 +793,7 @@ class ParticleCatalog(object):
 
             rnni = self.readPartRnn(denspath)
 
-            idx = nbox * posi // self.nbody.domain.lbox[boxnum]
-            idx = idx[:, 0] * nbox ** 2 + idx[:, 1] * nbox + idx[:, 2]
-            idx = idx == self.nbody.domain.subbox
+            idx = self.getSubboxIndex(posi) == self.nbody.domain.subbox
 
             posi = posi[idx]
             veli = veli[idx]
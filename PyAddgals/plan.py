@@ -0,0 +1,181 @@
+from __future__ import print_function, division
+import numpy as np
+import argparse
+
+from .config import parseConfig
+from .cosmology import Cosmology
+from .domain import Domain
+from .costModel import CostModel
+
+
+def makespan(times, ntasks, dynamic=False):
+    """Time taken for ntasks to work through domains with the given
+    run times.
+
+    Parameters
+    ----------
+    times : np.array
+        Estimated run time of each domain, in decomposition order
+    ntasks : int
+        Number of tasks painting domains
+    dynamic : bool
+        If True, domains are handed out largest first to whichever task
+        is free. Otherwise tasks take domains[rank::ntasks].
+
+    Returns
+    -------
+    task_times : np.array
+        Total run time of each task
+    """
+
+    if not dynamic:
+        return np.array([np.sum(times[i::ntasks]) for i in range(ntasks)])
+
+    task_times = np.zeros(ntasks)
+    for t in np.sort(times)[::-1]:
+        task_times[task_times.argmin()] += t
+
+    return task_times
+
+
+def planDomains(config, count_particles=True, throughputs=None):
+    """Estimate galaxy counts, particle counts, memory and run time of
+    every domain for a config, without MPI.
+
+    Parameters
+    ----------
+    config : dict
+        Parsed config file
+    count_particles : bool
+        If False, don't read lightcone indices to count particles
+    throughputs : dict or str
+        Throughputs of each stage, or the trace prefix of an earlier run
+        to measure them from. Overrides the throughputs in the config.
+
+    Returns
+    -------
+    domain : Domain
+        Decomposed domain
+    est : list
+        Estimates for each domain in domain.domains
+    model : CostModel
+        Model used to make the estimates
+    """
+
+    nb_config = config['NBody']
+    runtime_config = config.get('Runtime', {})
+
+    cosmo = Cosmology(**config['Cosmology'])
+    domain = Domain(cosmo, luminosityFunctionConfig=config['GalaxyModel']['ADDGALSModel']['luminosityFunctionConfig'],
+                    **nb_config.pop('Domain'))
+    if throughputs is None:
+        throughputs = runtime_config.get('throughputs', None)
+
+    model = CostModel(cosmo, nb_config, throughputs=throughputs,
+                      count_particles=count_particles)
+
+    domain.decomp(None, 0, 1, costModel=model)
+
+    est = [model.estimateDomain(d) for d in domain.yieldAllDomains()]
+
+    return domain, est, model
+
+
+def printPlan(domain, est, ntasks=None, max_mem=None, efficiency=0.8,
+              calibrated=True):
+    """Print a per-domain and load balance report, along with a
+    suggested number of tasks. If calibrated is False, times are
+    reported as relative costs rather than seconds.
+    """
+
+    if calibrated:
+        unit = '(s)'
+    else:
+        unit = '(rel)'
+        print('Throughputs are not calibrated, so times are relative costs. Pass the trace')
+        print('prefix of an earlier run with --throughputs to estimate them in seconds.')
+        print('')
+
+    times = np.array([e['time'] for e in est])
+    mem = np.array([e['mem'] for e in est]) / 1024 ** 3
+    n_gal = np.array([e['n_gal'] for e in est])
+    n_part = np.array([e['n_part'] for e in est])
+
+    print('{:>6} {:>5} {:>6} {:>6} {:>12} {:>12} {:>8} {:>10}'.format('boxnum', 'rbin', 'nside', 'pix',
+                                                                   'n_gal', 'n_part',
+                                                                   'mem(GB)', 'time' + unit))
+
+    for i, (boxnum, dom) in enumerate(zip(domain.domains_boxnum, domain.domains)):
+        # split domains carry their own nside
+        if len(dom) > 2:
+            nside = dom[2]
+        else:
+            nside = domain.nside
+
+        print('{:>6} {:>5} {:>6} {:>6} {:>12} {:>12} {:>8.2f} {:>10.1f}'.format(boxnum, dom[0], nside, dom[1],
+                                                                             n_gal[i], n_part[i],
+                                                                             mem[i], times[i]))
+
+    print('')
+    print('Number of domains: {}'.format(len(times)))
+    print('Total galaxies, particles: {}, {}'.format(np.sum(n_gal), np.sum(n_part)))
+    print('Total time: {:.1f} {}'.format(np.sum(times), 'core-s' if calibrated else '(relative)'))
+    print('Largest domain: {:.1f} {}, {:.2f} GB'.format(np.max(times), 's' if calibrated else '(relative)',
+                                                       np.max(mem)))
+
+    if ntasks is None:
+        ntasks = [2 ** i for i in range(int(np.log2(len(times))) + 1)]
+
+    print('')
+    print('{:>8} {:>14} {:>10} {:>14} {:>10}'.format('ntasks', 'static' + unit, 'eff',
+                                                     'dynamic' + unit, 'eff'))
+
+    suggested = None
+
+    for n in ntasks:
+        ts = makespan(times, n)
+        td = makespan(times, n, dynamic=True)
+        effs = np.sum(times) / (n * np.max(ts))
+        effd = np.sum(times) / (n * np.max(td))
+
+        print('{:>8} {:>14.1f} {:>10.2f} {:>14.1f} {:>10.2f}'.format(n, np.max(ts), effs,
+                                                                     np.max(td), effd))
+
+        if effd >= efficiency:
+            suggested = n
+
+    print('')
+
+    if suggested is not None:
+        # bin/addgals uses one extra task as the write arbiter
+        print('Suggested number of tasks: {} ({} painting with the dynamic scheduler)'.format(suggested + 1,
+                                                                                             suggested))
+
+    if np.max(times) > np.sum(times) / len(times) * 5:
+        print('The largest domain takes {:.1f}x the mean, consider increasing nrbins or nside'.format(
+            np.max(times) / np.mean(times)))
+
+    if (max_mem is not None) and (np.max(mem) > max_mem):
+        print('{} domains exceed {} GB, consider increasing nrbins, nside or max_split'.format(np.sum(mem > max_mem),
+                                                                                    max_mem))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Estimate the cost of each domain in a config without running it')
+    parser.add_argument('config_file', type=str, help='Config file')
+    parser.add_argument('--ntasks', type=int, nargs='+', default=None,
+                        help='Numbers of painting tasks to report load balance for')
+    parser.add_argument('--max-mem', type=float, default=None,
+                        help='Memory available per task in GB')
+    parser.add_argument('--no-particles', action='store_true',
+                        help='Do not read lightcone indices to count particles')
+    parser.add_argument('--throughputs', type=str, default=None,
+                        help='Trace prefix of an earlier run to measure stage throughputs from')
+    args = parser.parse_args()
+
+    config = parseConfig(args.config_file)
+    domain, est, model = planDomains(config, count_particles=not args.no_particles,
+                                     throughputs=args.throughputs)
+    printPlan(domain, est, ntasks=args.ntasks, max_mem=args.max_mem,
+              calibrated=model.isCalibrated())
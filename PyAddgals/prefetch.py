@@ -0,0 +1,176 @@
+from __future__ import print_function, division
+from threading import Thread, Condition
+from time import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .nBody import NBody
+from .costModel import _bytes_per_particle
+
+
+class DomainPrefetcher(object):
+    """Iterate over a task's domains, reading the inputs of the next domain
+    in a background thread while the current one is being painted.
+
+    The prefetch thread reserves an estimate of the memory needed for each
+    domain before reading it. If the domains currently held in memory plus
+    the next one would exceed max_mem, the thread waits until the main
+    thread releases a finished domain.
+    """
+
+    def __init__(self, cosmo, domains, nb_config, max_mem=None,
+                 prefetch=True):
+        """Create a DomainPrefetcher.
+
+        Parameters
+        ----------
+        cosmo : Cosmology
+            Object containing cosmology information
+        domains : iterable
+            Domains to read, e.g. the generator returned by
+            Domain.yieldDomains
+        nb_config : dict
+            Keyword arguments used to construct NBody objects
+        max_mem : float
+            Maximum number of GB of particle data to hold in memory
+            at one time. If None, no limit is imposed.
+        prefetch : bool
+            If False, read each domain synchronously when it is requested.
+
+        Returns
+        -------
+        None
+        """
+
+        self.cosmo = cosmo
+        self.domains = domains
+        self.nb_config = nb_config
+        self.prefetch = bool(prefetch)
+
+        if max_mem is not None:
+            self.max_mem = float(max_mem) * 1024 ** 3
+        else:
+            self.max_mem = None
+
+        self.mem_reserved = 0
+        self.reserved = {}
+        self.cond = Condition()
+
+    def estimateMemory(self, nbody):
+        """Estimate the number of bytes needed to read a domain.
+
+        Parameters
+        ----------
+        nbody : NBody
+            NBody object for the domain to be read
+
+        Returns
+        -------
+        nbytes : int
+            Estimated number of bytes
+        """
+
+        domain = nbody.domain
+
+        if domain.fmt == 'BCCLightcone':
+            npart = nbody.particleCatalog.getNpartAll()
+        elif domain.fmt == 'Snapshot':
+            nbox = domain.nbox[domain.boxnum]
+            npart = int(1.3 * nbody.particleCatalog.getNPartSnapshot() //
+                        nbox**3)
+        else:
+            raise(ValueError('Cannot estimate memory for fmt {}'.format(domain.fmt)))
+
+        return npart * _bytes_per_particle
+
+    def reserve(self, nbody):
+        """Block until there is enough memory to read nbody. At most
+        two domains, the one being painted and the one being read, are
+        held in memory at once.
+        """
+
+        if self.max_mem is not None:
+            nbytes = self.estimateMemory(nbody)
+        else:
+            nbytes = 0
+
+        with self.cond:
+            # always allow a domain to be read if nothing else is in memory,
+            # even if it is larger than the cap
+            while ((len(self.reserved) > 1) |
+                   ((self.max_mem is not None) & (len(self.reserved) > 0) &
+                    (self.mem_reserved + nbytes > self.max_mem))):
+                self.cond.wait()
+
+            self.mem_reserved += nbytes
+            self.reserved[id(nbody)] = nbytes
+
+    def release(self, nbody):
+        """Release the memory reserved for a domain that is finished.
+
+        Parameters
+        ----------
+        nbody : NBody
+            NBody object that has been deleted
+
+        Returns
+        -------
+        None
+        """
+
+        with self.cond:
+            self.mem_reserved -= self.reserved.pop(id(nbody), 0)
+            self.cond.notify_all()
+
+    def readDomain(self, d):
+
+        nbody = NBody(self.cosmo, d, **self.nb_config)
+        self.reserve(nbody)
+
+        start = time()
+        nbody.read()
+        end = time()
+        nbody.read_time = end - start
+
+        return nbody
+
+    def _worker(self, q):
+
+        try:
+            for d in self.domains:
+                q.put((self.readDomain(d), None))
+        except Exception as e:
+            q.put((None, e))
+            return
+
+        q.put((None, None))
+
+    def __iter__(self):
+
+        if not self.prefetch:
+            for d in self.domains:
+                yield self.readDomain(d)
+
+            return
+
+        q = queue.Queue(maxsize=1)
+        t = Thread(target=self._worker, args=(q,))
+        t.daemon = True
+        t.start()
+
+        while True:
+            nbody, err = q.get()
+
+            if err is not None:
+                t.join()
+                raise err
+
+            if nbody is None:
+                break
+
+            yield nbody
+
+        t.join()
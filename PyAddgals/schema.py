@@ -0,0 +1,271 @@
+from __future__ import print_function, division
+import numpy as np
+
+# Columns that are not filled in when galaxies are painted, but by later
+# stages of the pipeline, e.g. lensing and photometric errors. Each entry
+# is (name, shape), where shape is the shape of one row, or the name of
+# a painted column whose shape and type are copied.
+placeholder_columns = [('EPSILON', (2,)),
+                       ('SIZE', ()),
+                       ('KAPPA', ()),
+                       ('MU', ()),
+                       ('W', ()),
+                       ('GAMMA1', ()),
+                       ('GAMMA2', ()),
+                       ('DEC', ()),
+                       ('RA', ()),
+                       ('LMAG', 'TMAG'),
+                       ('OMAG', 'TMAG'),
+                       ('OMAGERR', 'TMAG'),
+                       ('FLUX', 'TMAG'),
+                       ('IVAR', 'TMAG')]
+
+# placeholders written for snapshots, which have no lensing
+snapshot_placeholder_columns = ['LMAG', 'OMAG', 'OMAGERR', 'FLUX', 'IVAR']
+
+
+def getPlaceholderNames(placeholders=None):
+    """Get the names of the placeholder columns to write.
+
+    Parameters
+    ----------
+    placeholders : str or list
+        'all' or None for every placeholder column, 'none' for no
+        placeholder columns, or a list of column names
+
+    Returns
+    -------
+    names : list
+        Placeholder column names, in schema order
+    """
+
+    if (placeholders is None) or (placeholders == 'all'):
+        return [p[0] for p in placeholder_columns]
+    elif placeholders == 'none':
+        return []
+
+    names = [p[0] for p in placeholder_columns]
+
+    for p in placeholders:
+        if p not in names:
+            raise(ValueError('{} is not a placeholder column'.format(p)))
+
+    return [n for n in names if n in placeholders]
+
+
+def addPlaceholders(catalog, names):
+    """Add zero filled placeholder columns to a dictionary of columns.
+
+    Parameters
+    ----------
+    catalog : dict
+        Galaxy catalog columns, modified in place
+    names : list
+        Placeholder columns to add
+
+    Returns
+    -------
+    None
+    """
+
+    n = len(catalog['PX'])
+    shapes = dict(placeholder_columns)
+
+    for name in names:
+        shape = shapes[name]
+
+        if isinstance(shape, str):
+            if shape not in catalog:
+                continue
+
+            catalog[name] = np.zeros_like(catalog[shape])
+        else:
+            catalog[name] = np.zeros((n,) + shape)
+
+
+def getPlaceholderColumns(columns, names):
+    """Describe placeholder columns so that they can be allocated along
+    with the painted columns, giving them the same types that
+    addPlaceholders would.
+
+    Parameters
+    ----------
+    columns : list
+        (name, dtype, shape) of each painted column
+    names : list
+        Placeholder columns to describe
+
+    Returns
+    -------
+    placeholders : list
+        (name, dtype, shape) of each placeholder column not already in
+        columns, in the order of names
+    """
+
+    painted = dict([(c[0], c) for c in columns])
+    shapes = dict(placeholder_columns)
+    placeholders = []
+
+    for name in names:
+        if name in painted:
+            continue
+
+        shape = shapes[name]
+
+        if isinstance(shape, str):
+            if shape not in painted:
+                continue
+
+            placeholders.append((name, painted[shape][1], painted[shape][2]))
+        else:
+            placeholders.append((name, np.float64, shape))
+
+    return placeholders
+
+
+def addColumns(out, names=None):
+    """Add any placeholder columns missing from a catalog that was
+    written without them, for stages that fill them in.
+
+    Parameters
+    ----------
+    out : np.array
+        Structured array read from a galaxy catalog
+    names : list
+        Placeholder columns to add. All placeholder columns are
+        added if None.
+
+    Returns
+    -------
+    out : np.array
+        Structured array containing the original and added columns
+    """
+
+    names = getPlaceholderNames(names)
+    shapes = dict(placeholder_columns)
+    dtype = out.dtype.descr
+
+    for name in names:
+        if name in out.dtype.names:
+            continue
+
+        shape = shapes[name]
+
+        if isinstance(shape, str):
+            if shape not in out.dtype.names:
+                continue
+
+            dtype.append((name, out.dtype[shape].base, out.dtype[shape].shape))
+        else:
+            dtype.append((name, np.float64, shape))
+
+    if len(dtype) == len(out.dtype.descr):
+        return out
+
+    new = np.zeros(len(out), dtype=dtype)
+
+    for name in out.dtype.names:
+        new[name] = out[name]
+
+    return new
+
+
+# Types that columns are written with under each dtype profile. Columns
+# not listed keep the type they were painted with, which is float64 for
+# most columns.
+#
+# Precision of the reduced profile, for float32's 24 bit significand
+# (relative error 6e-8):
+#   positions PX, PY, PZ    < 3e-4 Mpc/h at r < 4000 Mpc/h
+#   velocities VX, VY, VZ   < 1e-3 km/s at |v| < 10^4 km/s
+#   Z, Z_COS                < 4e-7 at z < 6
+#   magnitudes              < 3e-6 mag at |m| < 50
+#   M200                    6e-8 relative
+#   SIGMA5, DIST8, R200,
+#   RHALO, sizes, shapes    6e-8 relative
+# TRA and TDEC stay float64, as float32 would limit angular positions to
+# ~0.1 arcsec. IDs are int64, HALOID int64, SEDID int32 and the flags
+# CENTRAL and BAD_ASSIGN int8. Use auditPrecision to check the error of
+# a particular catalog.
+_reduced_float = ['PX', 'PY', 'PZ', 'VX', 'VY', 'VZ', 'Z', 'Z_COS',
+                  'MAG_R', 'MAG_R_EVOL', 'TMAG', 'AMAG', 'SIGMA5', 'PSIGMA5',
+                  'DIST8', 'M200', 'R200', 'RHALO', 'TSIZE', 'TE',
+                  'EPSILON_IA', 'COMOVING_SIZE'] + [p[0] for p in placeholder_columns
+                                                    if p[0] not in ['RA', 'DEC']]
+
+dtype_profiles = {'native': {'ID': np.int64},
+                  'reduced': dict([(c, np.float32) for c in _reduced_float] +
+                                  [('ID', np.int64),
+                                   ('HALOID', np.int64),
+                                   ('SEDID', np.int32),
+                                   ('CENTRAL', np.int8),
+                                   ('BAD_ASSIGN', np.int8)])}
+
+
+def getOutputDtype(catalog, profile=None):
+    """Get the structured dtype used to write a catalog.
+
+    Parameters
+    ----------
+    catalog : dict
+        Galaxy catalog columns
+    profile : str
+        Name of a dtype profile in dtype_profiles. Defaults to 'native'.
+
+    Returns
+    -------
+    dtype : np.dtype
+        Structured dtype, with one field per column
+    """
+
+    if profile is None:
+        profile = 'native'
+
+    if profile not in dtype_profiles:
+        raise(ValueError('dtype profile {} is not implemented'.format(profile)))
+
+    types = dtype_profiles[profile]
+
+    return np.dtype([(k, types.get(k, catalog[k].dtype.type), catalog[k].shape[1:])
+                     for k in catalog.keys()])
+
+
+def auditPrecision(catalog, profile='reduced'):
+    """Measure the error introduced by writing a catalog with a
+    dtype profile.
+
+    Parameters
+    ----------
+    catalog : dict or np.array
+        Galaxy catalog columns, at the precision they were painted with
+    profile : str
+        Name of a dtype profile in dtype_profiles
+
+    Returns
+    -------
+    errors : dict
+        (maximum absolute error, maximum relative error) of each column
+        whose type is changed by the profile
+    """
+
+    if hasattr(catalog, 'dtype'):
+        catalog = dict([(k, catalog[k]) for k in catalog.dtype.names])
+
+    dtype = getOutputDtype(catalog, profile)
+    errors = {}
+
+    for k in catalog.keys():
+        if dtype[k].base == catalog[k].dtype:
+            continue
+
+        v = catalog[k].astype(np.float64)
+        dv = np.abs(catalog[k].astype(dtype[k].base).astype(np.float64) - v)
+
+        if dv.size == 0:
+            errors[k] = (0., 0.)
+            continue
+
+        nz = v != 0
+        errors[k] = (np.max(dv), np.max(dv[nz] / np.abs(v[nz])) if nz.any() else 0.)
+
+    return errors
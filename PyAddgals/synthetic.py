@@ -0,0 +1,814 @@
+from __future__ import print_function, division
+from scipy.spatial import cKDTree
+from pixlc.pixLC import nest2peano
+import healpy as hp
+import numpy as np
+import argparse
+import struct
+import yaml
+import os
+
+from .config import parseConfig
+
+# mean matter density for omega_m = 1, in h^2 Msun / Mpc^3, and G in
+# Mpc (km/s)^2 / Msun
+_rho_crit = 2.775e11
+_G = 4.301e-9
+
+# width of the radial shells of pixLC lightcone files, in Mpc/h
+_shell_width = 25.
+
+_lightcone_header_fmt = 'QIIffQfdddd'
+_gadget_header_fmt = '6I6dddii6Iiiddddii6Ii'
+
+_hinfo_dtype = np.dtype([('haloid', np.int64),
+                         ('rhalo', np.float64),
+                         ('mass', np.float64),
+                         ('radius', np.float64)])
+
+# Rockstar columns read by HaloCatalog, in file order. Radii are in
+# kpc/h, as in the Rockstar outputs.
+_halo_dtype = np.dtype([('id', np.int64), ('descid', np.int64),
+                        ('mass', np.float64), ('vmax', np.float64),
+                        ('vrms', np.float64), ('radius', np.float64),
+                        ('rs', np.float64), ('np', np.int64),
+                        ('x', np.float64), ('y', np.float64),
+                        ('z', np.float64), ('vx', np.float64),
+                        ('vy', np.float64), ('vz', np.float64),
+                        ('pid', np.int64)])
+
+_default_cosmology = {'omega_m': 0.286, 'omega_b': 0.046, 'h': 1.0,
+                      'n_s': 0.96, 'sigma8': 0.82, 'w': -1.0}
+
+
+def getParticleMass(density, omega_m):
+    """Mass of a particle in a box with a given particle number density.
+
+    Parameters
+    ----------
+    density : float
+        Particles per (Mpc/h)^3
+    omega_m : float
+        Matter density
+
+    Returns
+    -------
+    part_mass : float
+        Particle mass in Msun/h
+    """
+
+    return _rho_crit * omega_m / density
+
+
+def makeHalos(lbox, part_mass, omega_m, f_halo=0.3, mmin=1e12, mmax=1e15,
+              alpha=0.9, concentration=5., rng=None):
+    """Draw a Rockstar-like catalog of parent halos, uniformly distributed
+    in a periodic box, with masses from dn/dlnM ~ M^-alpha.
+
+    Parameters
+    ----------
+    lbox : float
+        Box size in Mpc/h
+    part_mass : float
+        Particle mass in Msun/h
+    omega_m : float
+        Matter density
+    f_halo : float
+        Fraction of the mass of the box in halos
+    mmin, mmax : float
+        Mass range of the halos, in Msun/h
+    alpha : float
+        Slope of the mass function
+    concentration : float
+        Ratio of the halo radius to the scale radius
+    rng : np.random.RandomState
+        Random number generator
+
+    Returns
+    -------
+    halos : np.array
+        Structured array with the columns in _halo_dtype
+    """
+
+    if rng is None:
+        rng = np.random.RandomState()
+
+    rho_m = _rho_crit * omega_m
+
+    # mean of the mass function, to get the number of halos
+    # containing f_halo of the mass
+    m_mean = (alpha / (1 - alpha) * (mmax**(1 - alpha) - mmin**(1 - alpha)) /
+              (mmin**-alpha - mmax**-alpha))
+    n_halo = int(f_halo * rho_m * lbox**3 / m_mean)
+
+    u = rng.uniform(size=n_halo)
+    mass = (mmin**-alpha + u * (mmax**-alpha - mmin**-alpha))**(-1 / alpha)
+
+    # R200b in Mpc/h
+    radius = (3 * mass / (4 * np.pi * 200 * rho_m))**(1 / 3)
+    vcirc = np.sqrt(_G * mass / radius)
+
+    halos = np.zeros(n_halo, dtype=_halo_dtype)
+    halos['id'] = np.arange(n_halo)
+    halos['descid'] = -1
+    halos['mass'] = mass
+    halos['vmax'] = 1.1 * vcirc
+    halos['vrms'] = np.sqrt(1.5) * vcirc
+    halos['radius'] = 1000. * radius
+    halos['rs'] = 1000. * radius / concentration
+    halos['np'] = np.maximum(np.round(mass / part_mass), 1).astype(np.int64)
+    halos['pid'] = -1
+
+    pos = rng.uniform(0, lbox, size=(n_halo, 3))
+    vel = rng.normal(0, 300., size=(n_halo, 3))
+
+    for i, k in enumerate(['x', 'y', 'z']):
+        halos[k] = pos[:, i]
+        halos['v' + k] = vel[:, i]
+
+    return halos
+
+
+def makeParticles(halos, lbox, density, rng=None):
+    """Draw particles in a periodic box. Each halo gets as many particles
+    as its mass is worth, distributed as a singular isothermal sphere
+    out to its radius, and the rest of the particles are uniform.
+
+    Parameters
+    ----------
+    halos : np.array
+        Halo catalog returned by makeHalos
+    lbox : float
+        Box size in Mpc/h
+    density : float
+        Particles per (Mpc/h)^3
+    rng : np.random.RandomState
+        Random number generator
+
+    Returns
+    -------
+    pos : np.array
+        (N, 3) positions in [0, lbox)
+    vel : np.array
+        (N, 3) velocities in km/s
+    hinfo : np.array
+        Halo each particle is associated with, in the format written
+        by the halo association code. Particles outside of halos are
+        associated with the nearest halo center.
+    """
+
+    if rng is None:
+        rng = np.random.RandomState()
+
+    hpos = np.vstack([halos['x'], halos['y'], halos['z']]).T
+    hvel = np.vstack([halos['vx'], halos['vy'], halos['vz']]).T
+    hrad = halos['radius'] / 1000.
+
+    hidx = np.repeat(np.arange(len(halos)), halos['np'])
+    n_halo_part = len(hidx)
+    n_field = max(int(density * lbox**3) - n_halo_part, 0)
+
+    # isotropic directions, with p(r) constant for rho ~ r^-2
+    rhalo = rng.uniform(size=n_halo_part)
+    u = rng.normal(size=(n_halo_part, 3))
+    u /= np.sqrt(np.sum(u**2, axis=1)).reshape(-1, 1)
+
+    sigma = halos['vrms'][hidx] / np.sqrt(3)
+
+    pos = np.zeros((n_halo_part + n_field, 3))
+    vel = np.zeros((n_halo_part + n_field, 3))
+    hinfo = np.zeros(n_halo_part + n_field, dtype=_hinfo_dtype)
+
+    pos[:n_halo_part] = hpos[hidx] + (rhalo * hrad[hidx]).reshape(-1, 1) * u
+    vel[:n_halo_part] = hvel[hidx] + sigma.reshape(-1, 1) * rng.normal(size=(n_halo_part, 3))
+    hinfo['haloid'][:n_halo_part] = halos['id'][hidx]
+    hinfo['rhalo'][:n_halo_part] = rhalo
+
+    pos[n_halo_part:] = rng.uniform(0, lbox, size=(n_field, 3))
+    vel[n_halo_part:] = rng.normal(0, 300., size=(n_field, 3))
+
+    if (n_field > 0) & (len(halos) > 0):
+        tree = cKDTree(hpos, boxsize=lbox)
+        d, nearest = tree.query(pos[n_halo_part:])
+        hidx = np.hstack([hidx, nearest])
+        hinfo['haloid'][n_halo_part:] = halos['id'][nearest]
+        hinfo['rhalo'][n_halo_part:] = d / hrad[nearest]
+    elif n_field > 0:
+        hidx = np.hstack([hidx, np.zeros(n_field, dtype=hidx.dtype)])
+        hinfo['haloid'][n_halo_part:] = -1
+        hinfo['rhalo'][n_halo_part:] = np.inf
+
+    if len(halos) > 0:
+        hinfo['mass'] = halos['mass'][hidx]
+        hinfo['radius'] = hrad[hidx]
+
+    pos = wrapPositions(pos, lbox)
+
+    return pos, vel, hinfo
+
+
+def wrapPositions(pos, lbox):
+    """Wrap positions into [0, lbox), as required by periodic KD trees.
+    """
+
+    pos = np.mod(pos, lbox)
+    pos[pos >= lbox] = 0.
+
+    return pos
+
+
+def calcRnn(pos, lbox, k=8, query=None):
+    """Distance to the k-th nearest particle, standing in for the output
+    of calcRnn.
+
+    Parameters
+    ----------
+    pos : np.array
+        (N, 3) particle positions in [0, lbox)
+    lbox : float
+        Box size in Mpc/h
+    k : int
+        Neighbor to measure the distance to
+    query : np.array
+        Positions to measure densities at, e.g. halo centers. Defaults
+        to the particles themselves, excluding each particle from its
+        own neighbors.
+
+    Returns
+    -------
+    rnn : np.array
+        Distances in Mpc/h
+    """
+
+    tree = cKDTree(pos, boxsize=lbox)
+
+    if query is None:
+        d, _ = tree.query(pos, k + 1)
+    else:
+        d, _ = tree.query(wrapPositions(query, lbox), k)
+
+    return d[:, -1]
+
+
+def makeBox(lbox, density, cosmology=None, f_halo=0.3, mmin=1e12,
+            mmax=1e15, rnn_k=8, seed=None):
+    """Make a periodic box of halos and particles, along with their
+    densities and halo associations.
+
+    Parameters
+    ----------
+    lbox : float
+        Box size in Mpc/h
+    density : float
+        Particles per (Mpc/h)^3
+    cosmology : dict
+        Cosmology config, defaults to _default_cosmology
+    f_halo : float
+        Fraction of particles in halos
+    mmin, mmax : float
+        Mass range of the halos, in Msun/h
+    rnn_k : int
+        Neighbor used to measure densities
+    seed : int
+        Random seed
+
+    Returns
+    -------
+    box : dict
+        lbox, part_mass, cosmology, halos, halo_rnn, pos, vel, ids,
+        rnn and hinfo
+    """
+
+    if cosmology is None:
+        cosmology = _default_cosmology
+
+    rng = np.random.RandomState(seed)
+
+    part_mass = getParticleMass(density, cosmology['omega_m'])
+    halos = makeHalos(lbox, part_mass, cosmology['omega_m'], f_halo=f_halo,
+                      mmin=mmin, mmax=mmax, rng=rng)
+    pos, vel, hinfo = makeParticles(halos, lbox, density, rng=rng)
+
+    print('Made box with {} halos and {} particles of mass {:.3e}'.format(len(halos), len(pos),
+                                                                           part_mass))
+
+    box = {'lbox': lbox, 'part_mass': part_mass, 'cosmology': cosmology,
+           'halos': halos, 'pos': pos, 'vel': vel, 'hinfo': hinfo,
+           'ids': np.arange(len(pos), dtype=np.uint64)}
+
+    box['rnn'] = calcRnn(pos, lbox, k=rnn_k)
+    hpos = np.vstack([halos['x'], halos['y'], halos['z']]).T
+    box['halo_rnn'] = calcRnn(pos, lbox, k=rnn_k, query=hpos)
+
+    return box
+
+
+def getAreaPixels(area, nside):
+    """Nest ordered pixels covering at least area square degrees,
+    starting from pixel 0. Pixels below 3438 square degrees all fall
+    in base pixel 0, i.e. within the first octant.
+    """
+
+    npix = int(np.ceil(area / hp.nside2pixarea(nside, degrees=True)))
+
+    return list(range(min(npix, 12 * nside**2)))
+
+
+def getPixelOctants(nside, pixels):
+    """Octants, numbered as in Domain.octVert, that overlap nest
+    ordered pixels.
+    """
+
+    octants = set()
+
+    for p in pixels:
+        vec = hp.boundaries(nside, p, step=4, nest=True).T
+        vec = np.vstack([vec, hp.pix2vec(nside, p, nest=True)])
+
+        for x, y, z in vec:
+            o = {(True, True): 0, (False, True): 1, (False, False): 2,
+                 (True, False): 3}[(x >= 0, y >= 0)]
+            if z < 0:
+                o += 4
+
+            octants.add(o)
+
+    return sorted(octants)
+
+
+def replicateBox(box, rmax, nside, pixels):
+    """Tile a box around an observer at the origin, keeping the halos
+    and particles within rmax and a set of pixels.
+
+    Parameters
+    ----------
+    box : dict
+        Box returned by makeBox
+    rmax : float
+        Maximum radius in Mpc/h
+    nside : int
+        nside of pixels
+    pixels : list
+        Nest ordered pixels to keep
+
+    Returns
+    -------
+    lightcone : dict
+        Particle pos, vel, ids, rnn and hinfo, and the halos and
+        halo_rnn. IDs of halos and particles in each replica are offset
+        by the replica number times the number in the box.
+    """
+
+    lbox = box['lbox']
+    n_halo = len(box['halos'])
+    n_part = len(box['pos'])
+    hpos = np.vstack([box['halos']['x'], box['halos']['y'], box['halos']['z']]).T
+    pixels = np.array(pixels)
+
+    nrep = int(np.ceil(rmax / lbox))
+    parts = []
+    halos = []
+    replica = 0
+
+    for ix in range(-nrep, nrep):
+        for iy in range(-nrep, nrep):
+            for iz in range(-nrep, nrep):
+                off = np.array([ix, iy, iz]) * lbox
+
+                # skip replicas that don't intersect the sphere
+                dmin = np.maximum(np.maximum(off, -off - lbox), 0)
+                if np.sqrt(np.sum(dmin**2)) >= rmax:
+                    continue
+
+                for src, out, is_halo in [(box['pos'], parts, False), (hpos, halos, True)]:
+                    p = src + off
+                    r = np.sqrt(np.sum(p**2, axis=1))
+                    idx, = np.where(r < rmax)
+                    pix = hp.vec2pix(nside, p[idx, 0], p[idx, 1], p[idx, 2], nest=True)
+                    idx = idx[np.in1d(pix, pixels)]
+                    out.append((replica, idx, p[idx]))
+
+                replica += 1
+
+    lightcone = {}
+    lightcone['pos'] = np.vstack([p for _, _, p in parts])
+    lightcone['vel'] = np.vstack([box['vel'][i] for _, i, _ in parts])
+    lightcone['ids'] = np.hstack([box['ids'][i] + np.uint64(rep * n_part)
+                                  for rep, i, _ in parts])
+    lightcone['rnn'] = np.hstack([box['rnn'][i] for _, i, _ in parts])
+    lightcone['hinfo'] = np.hstack([box['hinfo'][i] for _, i, _ in parts])
+
+    haloid = np.hstack([np.zeros(len(i), dtype=np.int64) + rep * n_halo
+                        for rep, i, _ in parts])
+    lightcone['hinfo']['haloid'] = np.where(lightcone['hinfo']['haloid'] >= 0,
+                                            lightcone['hinfo']['haloid'] + haloid, -1)
+
+    lightcone['halos'] = np.hstack([box['halos'][i] for _, i, _ in halos])
+    lightcone['halos']['id'] += np.hstack([np.zeros(len(i), dtype=np.int64) + rep * n_halo
+                                           for rep, i, _ in halos])
+    hpos = np.vstack([p for _, _, p in halos])
+    for i, k in enumerate(['x', 'y', 'z']):
+        lightcone['halos'][k] = hpos[:, i]
+
+    lightcone['halo_rnn'] = np.hstack([box['halo_rnn'][i] for _, i, _ in halos])
+
+    return lightcone
+
+
+def writeRadialBin(fname, hdr, idx, pos, vel, ids):
+    """Write a pixLC lightcone file, as read by
+    ParticleCatalog.readPartialRadialBin. Particles must be sorted by
+    peano index.
+    """
+
+    with open(fname, 'wb') as fp:
+        fp.write(struct.pack(_lightcone_header_fmt, *hdr))
+        idx.astype(np.int64).tofile(fp)
+        pos.astype(np.float32).tofile(fp)
+        vel.astype(np.float32).tofile(fp)
+        ids.astype(np.uint64).tofile(fp)
+
+
+def writeRnn(fname, rnn):
+    """Write particle densities in the calcRnn format, a five int32
+    header with the number of particles second, followed by float32
+    densities.
+    """
+
+    with open(fname, 'wb') as fp:
+        np.array([0, len(rnn), 0, 0, 0], dtype=np.int32).tofile(fp)
+        rnn.astype(np.float32).tofile(fp)
+
+
+def writeHinfo(fname, hinfo):
+    """Write particle halo associations, as read by
+    ParticleCatalog.readPartialHinfo.
+    """
+
+    with open(fname, 'wb') as fp:
+        hinfo.astype(_hinfo_dtype).tofile(fp)
+
+
+def writeRockstar(fname, densfname, halos, rnn):
+    """Write an ascii Rockstar halo catalog, with the columns read by
+    HaloCatalog, and the matching halo density file.
+    """
+
+    fmt = ['%d' if halos.dtype[k].kind == 'i' else '%.7g' for k in halos.dtype.names]
+    data = np.vstack([halos[k].astype(np.float64) for k in halos.dtype.names]).T
+
+    np.savetxt(fname, data, fmt=fmt, header=' '.join(halos.dtype.names))
+    np.savetxt(densfname, np.vstack([halos['id'], rnn]).T, fmt=['%d', '%.7g'])
+
+
+def writeLightcone(outdir, lightcone, box, rmax, nside, pixels, nside_index=32):
+    """Write a lightcone in the pixLC, calcRnn, halo association and
+    Rockstar formats read by ParticleCatalog.readBCCLightcone and
+    HaloCatalog.readRockstarLightconeFile.
+
+    Parameters
+    ----------
+    outdir : str
+        Directory to write to
+    lightcone : dict
+        Lightcone returned by replicateBox
+    box : dict
+        Box returned by makeBox
+    rmax : float
+        Maximum radius of the lightcone. Shells are written up to the
+        one containing rmax.
+    nside : int
+        nside of the lightcone files
+    pixels : list
+        Nest ordered pixels to write
+    nside_index : int
+        nside of the peano index of each file
+
+    Returns
+    -------
+    paths : dict
+        partpath, denspath, hinfopath, halofile and halodensfile
+    """
+
+    paths = {'partpath': os.path.join(outdir, 'pixlc'),
+             'denspath': os.path.join(outdir, 'calcrnn'),
+             'hinfopath': os.path.join(outdir, 'pixlc'),
+             'halofile': os.path.join(outdir, 'halos', 'lightcone_halos.parents'),
+             'halodensfile': os.path.join(outdir, 'halos', 'rnn_lightcone_halos.parents')}
+
+    for p in ['partpath', 'denspath', 'halofile']:
+        d = paths[p] if p != 'halofile' else os.path.dirname(paths[p])
+        if not os.path.exists(d):
+            os.makedirs(d)
+
+    pos = lightcone['pos']
+    r = np.sqrt(np.sum(pos**2, axis=1))
+    shell = (r // _shell_width).astype(np.int64)
+    pix = hp.vec2pix(nside, pos[:, 0], pos[:, 1], pos[:, 2], nest=True)
+    peano = nest2peano(hp.vec2pix(nside_index, pos[:, 0], pos[:, 1], pos[:, 2], nest=True),
+                       int(np.log2(nside_index)))
+
+    order = np.lexsort((peano, pix, shell))
+    key = shell[order] * 12 * nside**2 + pix[order]
+
+    cosmo = box['cosmology']
+
+    # readers take the header from pixel 0 of every shell, so it's
+    # always written, even if empty
+    file_pixels = sorted(set(pixels) | set([0]))
+
+    for s in range(int(rmax // _shell_width) + 1):
+        for p in file_pixels:
+            lo, hi = key.searchsorted([s * 12 * nside**2 + p, s * 12 * nside**2 + p + 1])
+            idx = order[lo:hi]
+
+            hdr = [len(idx), nside_index, nside, s * _shell_width, (s + 1) * _shell_width,
+                   0, box['lbox'], box['part_mass'] / 1e10, cosmo['omega_m'],
+                   1 - cosmo['omega_m'], cosmo['h']]
+            counts = np.bincount(peano[idx], minlength=12 * nside_index**2)
+
+            writeRadialBin('{}/snapshot_Lightcone_{}_{}'.format(paths['partpath'], s, p),
+                           hdr, counts, pos[idx], lightcone['vel'][idx], lightcone['ids'][idx])
+            writeRnn('{}/rnn_snapshot_Lightcone_{}_{}'.format(paths['denspath'], s, p),
+                     lightcone['rnn'][idx])
+            writeHinfo('{}/hinfo_snapshot_Lightcone_{}_{}'.format(paths['hinfopath'], s, p),
+                       lightcone['hinfo'][idx])
+
+    writeRockstar(paths['halofile'], paths['halodensfile'], lightcone['halos'],
+                  lightcone['halo_rnn'])
+
+    print('Wrote {} particles and {} halos to lightcone in {}'.format(len(pos),
+                                                                      len(lightcone['halos']),
+                                                                      outdir))
+
+    return paths
+
+
+def writeGadgetSnapshot(fname, pos, vel, ids, part_mass, npart_total, num_files,
+                        redshift, lbox, omega_m, h):
+    """Write one block of an L-Gadget2 snapshot, as read by
+    ParticleCatalog.readGadgetSnapshot with lgadget=True. All particles
+    are type 1, and the high word of the total number of particles goes
+    in the slot L-Gadget2 uses for it.
+    """
+
+    npart = [0, len(pos), 0, 0, 0, 0]
+    mass = [0., part_mass / 1e10, 0., 0., 0., 0.]
+    npart_all = [0, npart_total % 2**32, npart_total // 2**32, 0, 0, 0]
+
+    hdr = (npart + mass + [1 / (1 + redshift), redshift, 0, 0] + npart_all +
+           [0, num_files, lbox, omega_m, 1 - omega_m, h, 0, 0] + [0] * 6 + [0])
+    hdr = struct.pack(_gadget_header_fmt, *hdr)
+
+    with open(fname, 'wb') as fp:
+        for data in [hdr + b'\0' * (256 - len(hdr)),
+                     pos.astype(np.float32).tobytes(),
+                     vel.astype(np.float32).tobytes(),
+                     ids.astype(np.uint64).tobytes()]:
+            fp.write(struct.pack('I', len(data)))
+            fp.write(data)
+            fp.write(struct.pack('I', len(data)))
+
+
+def writeSnapshots(outdir, box, redshifts, n_blocks=2):
+    """Write a box as a set of L-Gadget2 snapshots, with calcRnn densities
+    and Rockstar halo catalogs, as read by ParticleCatalog.readSnapshot
+    and HaloCatalog.readRockstarSnapshotFile. The same box is written
+    for every snapshot, with only the redshift in the header changing.
+
+    Parameters
+    ----------
+    outdir : str
+        Directory to write to
+    box : dict
+        Box returned by makeBox
+    redshifts : list
+        Redshift of each snapshot
+    n_blocks : int
+        Number of files per snapshot
+
+    Returns
+    -------
+    paths : dict
+        partpath, denspath, halofile and halodensfile, with snapnum
+        left to be formatted
+    """
+
+    paths = {'partpath': os.path.join(outdir, 'snapshots', 'snapshot_{snapnum}'),
+             'denspath': os.path.join(outdir, 'snapshots', 'rnn_snapshot_{snapnum}'),
+             'halofile': os.path.join(outdir, 'halos', 'out_{snapnum}.parents'),
+             'halodensfile': os.path.join(outdir, 'halos', 'rnn_out_{snapnum}.parents')}
+
+    for p in ['partpath', 'halofile']:
+        d = os.path.dirname(paths[p])
+        if not os.path.exists(d):
+            os.makedirs(d)
+
+    cosmo = box['cosmology']
+    npart = len(box['pos'])
+    blocks = np.array_split(np.arange(npart), n_blocks)
+
+    for i, z in enumerate(redshifts):
+        snapnum = '{:02d}'.format(i)
+
+        for j, idx in enumerate(blocks):
+            writeGadgetSnapshot('{}.{}'.format(paths['partpath'].format(snapnum=snapnum), j),
+                                box['pos'][idx], box['vel'][idx], box['ids'][idx],
+                                box['part_mass'], npart, n_blocks, z, box['lbox'],
+                                cosmo['omega_m'], cosmo['h'])
+            writeRnn('{}.{}'.format(paths['denspath'].format(snapnum=snapnum), j),
+                     box['rnn'][idx])
+
+        writeRockstar(paths['halofile'].format(snapnum=snapnum),
+                      paths['halodensfile'].format(snapnum=snapnum),
+                      box['halos'], box['halo_rnn'])
+
+    print('Wrote {} snapshots of {} particles to {}'.format(len(redshifts), npart, outdir))
+
+    return paths
+
+
+def makeConfig(paths, domain, outpath, cosmology=None, template=None):
+    """Make an addgals config for synthetic inputs.
+
+    Parameters
+    ----------
+    paths : dict
+        NBody paths returned by writeLightcone or writeSnapshots
+    domain : dict
+        Domain config
+    outpath : str
+        Output path prefix of the galaxy catalog
+    cosmology : dict
+        Cosmology config, defaults to _default_cosmology
+    template : str
+        Config file to take the GalaxyModel section, and any other
+        Runtime settings, from. The synthetic inputs only replace the
+        simulation, so model files still have to be available.
+
+    Returns
+    -------
+    config : dict
+        Config, without GalaxyModel if no template is given
+    """
+
+    if cosmology is None:
+        cosmology = _default_cosmology
+
+    config = {}
+    runtime = {}
+
+    if template is not None:
+        tcfg = parseConfig(template)
+        config['GalaxyModel'] = tcfg['GalaxyModel']
+        runtime.update(tcfg.get('Runtime', {}))
+
+    runtime['outpath'] = outpath
+    runtime.setdefault('write_pos', False)
+
+    if domain['fmt'] == 'BCCLightcone':
+        runtime['nside_output'] = domain['nside']
+    else:
+        runtime.pop('nside_output', None)
+
+    nbody = dict(paths)
+    nbody['Domain'] = domain
+
+    config['Runtime'] = runtime
+    config['NBody'] = nbody
+    config['Cosmology'] = dict(cosmology)
+
+    return config
+
+
+def writeConfig(fname, config):
+    """Write a config file readable by parseConfig.
+    """
+
+    with open(fname, 'w') as fp:
+        yaml.safe_dump(config, fp, default_flow_style=False)
+
+
+def makeLightconeInputs(outdir, box, rmax, nside, pixels, nside_index=32,
+                        nrbins=4, template=None):
+    """Write a lightcone made from a box, and a config to run it.
+
+    Parameters
+    ----------
+    outdir : str
+        Directory to write to
+    box : dict
+        Box returned by makeBox
+    rmax : float
+        Maximum radius of the lightcone in Mpc/h
+    nside : int
+        nside of the lightcone files and decomposition
+    pixels : list
+        Nest ordered pixels to cover
+    nside_index : int
+        nside of the peano index of each file
+    nrbins : int
+        Number of radial bins of the decomposition
+    template : str
+        Config to take the GalaxyModel and Runtime settings from
+
+    Returns
+    -------
+    config_file : str
+        Config file written to outdir
+    """
+
+    for d in [outdir, os.path.join(outdir, 'galaxies')]:
+        if not os.path.exists(d):
+            os.makedirs(d)
+
+    rmax_shell = _shell_width * (int(rmax // _shell_width) + 1)
+    lightcone = replicateBox(box, rmax_shell, nside, pixels)
+    paths = writeLightcone(outdir, lightcone, box, rmax, nside, pixels,
+                           nside_index=nside_index)
+    del lightcone
+
+    domain = {'fmt': 'BCCLightcone', 'lbox': int(box['lbox']), 'rmin': 1.0,
+              'rmax': float(rmax), 'nrbins': nrbins, 'nside': nside,
+              'nest': True, 'pixlist': [int(p) for p in pixels],
+              'octants': getPixelOctants(nside, pixels)}
+
+    config = makeConfig(paths, domain, os.path.join(outdir, 'galaxies', 'Synthetic_lightcone'),
+                        cosmology=box['cosmology'], template=template)
+    config_file = os.path.join(outdir, 'config_lightcone.yaml')
+    writeConfig(config_file, config)
+
+    return config_file
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Write miniature synthetic simulation inputs and addgals configs')
+    parser.add_argument('outdir', type=str, help='Directory to write to')
+    parser.add_argument('--fmt', type=str, default='BCCLightcone',
+                        choices=['BCCLightcone', 'Snapshot', 'both'],
+                        help='Input format to write')
+    parser.add_argument('--lbox', type=float, default=256.,
+                        help='Box size in Mpc/h')
+    parser.add_argument('--density', type=float, default=0.1,
+                        help='Particles per (Mpc/h)^3')
+    parser.add_argument('--f-halo', type=float, default=0.3,
+                        help='Fraction of particles in halos')
+    parser.add_argument('--halo-mmin', type=float, default=1e12,
+                        help='Minimum halo mass in Msun/h')
+    parser.add_argument('--rnn-k', type=int, default=8,
+                        help='Neighbor used to measure densities')
+    parser.add_argument('--rmax', type=float, default=600.,
+                        help='Maximum radius of the lightcone in Mpc/h')
+    parser.add_argument('--nrbins', type=int, default=4,
+                        help='Number of radial bins of the lightcone decomposition')
+    parser.add_argument('--nside', type=int, default=4,
+                        help='nside of the lightcone files and decomposition')
+    parser.add_argument('--nside-index', type=int, default=32,
+                        help='nside of the peano index of the lightcone files')
+    parser.add_argument('--pixels', type=int, nargs='+', default=None,
+                        help='Nest ordered pixels to cover')
+    parser.add_argument('--area', type=float, default=None,
+                        help='Sky area to cover in square degrees, instead of --pixels')
+    parser.add_argument('--redshifts', type=float, nargs='+', default=[0.1, 0.3],
+                        help='Redshifts of the snapshots')
+    parser.add_argument('--n-blocks', type=int, default=2,
+                        help='Number of files per snapshot')
+    parser.add_argument('--nbox', type=int, default=2,
+                        help='Subboxes per side of the snapshot decomposition')
+    parser.add_argument('--template', type=str, default=None,
+                        help='Config to take the GalaxyModel and Runtime settings from')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed')
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.outdir, 'galaxies')):
+        os.makedirs(os.path.join(args.outdir, 'galaxies'))
+
+    box = makeBox(args.lbox, args.density, f_halo=args.f_halo,
+                  mmin=args.halo_mmin, rnn_k=args.rnn_k, seed=args.seed)
+
+    if args.fmt in ['BCCLightcone', 'both']:
+        if args.area is not None:
+            pixels = getAreaPixels(args.area, args.nside)
+        elif args.pixels is not None:
+            pixels = args.pixels
+        else:
+            pixels = [0]
+
+        makeLightconeInputs(args.outdir, box, args.rmax, args.nside, pixels,
+                            nside_index=args.nside_index, nrbins=args.nrbins,
+                            template=args.template)
+
+    if args.fmt in ['Snapshot', 'both']:
+        paths = writeSnapshots(args.outdir, box, args.redshifts, n_blocks=args.n_blocks)
+        paths['n_blocks'] = args.n_blocks
+
+        domain = {'fmt': 'Snapshot', 'lbox': float(args.lbox), 'nbox': args.nbox,
+                  'n_snaps': len(args.redshifts)}
+
+        config = makeConfig(paths, domain, os.path.join(args.outdir, 'galaxies', 'Synthetic_snapshot'),
+                            template=args.template)
+        writeConfig(os.path.join(args.outdir, 'config_snapshot.yaml'), config)
+
+    if args.template is None:
+        print('No --template given, so the configs have no GalaxyModel section')
@@ -0,0 +1,747 @@
+from __future__ import print_function, division
+from threading import Lock, local, current_thread
+from glob import glob
+from time import time
+import numpy as np
+import resource
+import argparse
+import json
+import os
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Tracer that spans are recorded to. Spans are ignored if it's None.
+_tracer = None
+
+# Stages that the largest live allocations are recorded for, when
+# tracing memory with top_allocations > 0
+snapshot_stages = ['read_particles', 'particles', 'seds', 'write']
+
+
+def _getRSS():
+
+    # current and peak resident set size in bytes. /proc is only
+    # available on linux, elsewhere the peak is over the whole run
+    try:
+        with open('/proc/self/status', 'r') as fp:
+            status = dict([line.split(':', 1) for line in fp if ':' in line])
+
+        return (int(status['VmRSS'].split()[0]) * 1024,
+                int(status['VmHWM'].split()[0]) * 1024)
+    except (IOError, OSError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return None, peak
+
+
+def _resetRSSPeak():
+
+    # resets VmHWM to the current RSS, without scanning any pages
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class Span(object):
+    """A timed stage of the pipeline. Spans opened inside another span
+    on the same thread are its children, and inherit its domain.
+    """
+
+    def __init__(self, tracer, name, domain=None, **attrs):
+
+        self.tracer = tracer
+        self.name = name
+        self.domain = domain
+        self.attrs = attrs
+        self.parent = None
+
+    def set(self, **attrs):
+        """Attach values, e.g. galaxy counts, to the span's record.
+        """
+
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+
+        stack = self.tracer._stack()
+
+        if len(stack) > 0:
+            self.parent = stack[-1]
+
+            if self.domain is None:
+                self.domain = self.parent.domain
+
+        self.depth = len(stack)
+        stack.append(self)
+
+        if self.tracer.memory:
+            self.tracer._enterMemory(self)
+
+        self.start = time()
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.end = time()
+
+        if self.tracer.memory:
+            self.tracer._exitMemory(self)
+
+        self.tracer._stack().pop()
+        self.tracer._record(self)
+
+        return False
+
+
+class Tracer(object):
+    """Records nested, timed spans of the pipeline as JSON lines, one
+    record per span, written when the span ends.
+
+    Each record contains the span's name, the rank and thread it ran on,
+    the key of the domain it belongs to, its start time and duration in
+    seconds, its depth and the name of its parent, along with any values
+    attached with Span.set.
+
+    If memory is True, records also contain the resident set size at the
+    start and end of the span and its peak during the span (rss_start,
+    rss_end, rss_peak), and the same for memory allocated by python and
+    numpy as measured by tracemalloc (py_start, py_end, py_peak), all in
+    bytes. Memory is measured for the whole process, so stages running
+    at the same time in other threads, e.g. prefetching or background
+    writes, count towards each other's peaks. The py values are None
+    without tracemalloc.
+    """
+
+    def __init__(self, filename, rank=0, memory=False, top_allocations=0):
+        """Create a Tracer.
+
+        Parameters
+        ----------
+        filename : str
+            JSON lines file to write records to
+        rank : int
+            Rank of the task being traced
+        memory : bool
+            If True, record memory use of each span. Starts tracemalloc,
+            which slows down small allocations.
+        top_allocations : int
+            Number of the largest live allocation sites to record at the
+            end of spans in snapshot_stages, if memory is True
+
+        Returns
+        -------
+        None
+        """
+
+        self.filename = filename
+        self.rank = rank
+        self.memory = memory
+        self.top_allocations = int(top_allocations)
+        self.lock = Lock()
+        self.local = local()
+        self.fp = open(filename, 'w')
+
+        # spans that memory is being measured for, in every thread
+        self.open = set()
+
+        if self.memory:
+            if (tracemalloc is not None) and (not tracemalloc.is_tracing()):
+                tracemalloc.start()
+
+            self.reset_rss = _resetRSSPeak()
+
+    def _getMemory(self):
+
+        rss, rss_peak = _getRSS()
+
+        if tracemalloc is not None:
+            py, py_peak = tracemalloc.get_traced_memory()
+        else:
+            py, py_peak = None, None
+
+        return rss, rss_peak, py, py_peak
+
+    def _updatePeaks(self, rss_peak, py_peak):
+
+        for o in self.open:
+            o.rss_seen = max(o.rss_seen, rss_peak)
+
+            if py_peak is not None:
+                o.py_seen = max(o.py_seen, py_peak)
+
+    def _enterMemory(self, s):
+
+        # peaks are reset at the start of every span, in any thread, so
+        # the peak so far is first passed to every span that's open
+        with self.lock:
+            s.rss_start, rss_peak, s.py_start, py_peak = self._getMemory()
+            self._updatePeaks(rss_peak, py_peak)
+
+            if self.reset_rss:
+                _resetRSSPeak()
+                s.rss_seen = s.rss_start
+            else:
+                s.rss_seen = rss_peak
+
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+                s.py_seen = s.py_start
+            else:
+                s.py_seen = py_peak
+
+            self.open.add(s)
+
+    def _exitMemory(self, s):
+
+        with self.lock:
+            s.rss_end, rss_peak, s.py_end, py_peak = self._getMemory()
+            self._updatePeaks(rss_peak, py_peak)
+            self.open.remove(s)
+
+        s.set(rss_start=s.rss_start, rss_end=s.rss_end, rss_peak=s.rss_seen,
+              py_start=s.py_start, py_end=s.py_end, py_peak=s.py_seen)
+
+        if ((self.top_allocations > 0) & (s.name in snapshot_stages) &
+                (tracemalloc is not None)):
+            stats = tracemalloc.take_snapshot().statistics('lineno')
+            s.set(top_allocations=[['{}:{}'.format(st.traceback[0].filename,
+                                                   st.traceback[0].lineno),
+                                    st.size, st.count]
+                                   for st in stats[:self.top_allocations]])
+
+    def _stack(self):
+
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+
+        return self.local.stack
+
+    def span(self, name, domain=None, **attrs):
+
+        return Span(self, name, domain=domain, **attrs)
+
+    def _record(self, s):
+
+        rec = {'name': s.name,
+               'rank': self.rank,
+               'thread': current_thread().name,
+               'domain': list(s.domain) if s.domain is not None else None,
+               'start': s.start,
+               'dur': s.end - s.start,
+               'depth': s.depth,
+               'parent': s.parent.name if s.parent is not None else None}
+        rec.update(s.attrs)
+
+        line = json.dumps(rec, default=_toJSON)
+
+        with self.lock:
+            self.fp.write(line + '\n')
+
+            # records are flushed as each domain finishes, so that they
+            # survive a task being killed
+            if s.depth == 0:
+                self.fp.flush()
+
+    def close(self):
+
+        with self.lock:
+            self.fp.close()
+
+
+def _toJSON(obj):
+
+    # numpy scalars
+    if hasattr(obj, 'item'):
+        return obj.item()
+
+    raise(TypeError('{} is not JSON serializable'.format(type(obj))))
+
+
+def getTraceFile(prefix, rank):
+    """JSON lines file that a task writes its spans to.
+    """
+
+    return '{}.trace.{}.jsonl'.format(prefix, rank)
+
+
+def startTracing(prefix, rank=0, memory=False, top_allocations=0):
+    """Start recording spans for this task.
+
+    Parameters
+    ----------
+    prefix : str
+        Path prefix of the trace files
+    rank : int
+        Rank of this task
+    memory : bool
+        If True, also record memory use of each span
+    top_allocations : int
+        Number of the largest allocation sites to record for stages in
+        snapshot_stages
+
+    Returns
+    -------
+    tracer : Tracer
+    """
+
+    global _tracer
+
+    _tracer = Tracer(getTraceFile(prefix, rank), rank=rank, memory=memory,
+                     top_allocations=top_allocations)
+
+    return _tracer
+
+
+def stopTracing():
+    """Stop recording spans and close the trace file.
+    """
+
+    global _tracer
+
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+
+def span(name, domain=None, **attrs):
+    """Time a stage of the pipeline, for use in a with statement. Does
+    nothing unless tracing has been started.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, e.g. 'read' or 'sed_match'
+    domain : tuple
+        Key of the domain the stage belongs to. Inherited from the
+        enclosing span if None.
+    attrs : dict
+        Values to store in the span's record
+
+    Returns
+    -------
+    span : Span
+    """
+
+    if _tracer is None:
+        return _null_span
+
+    return _tracer.span(name, domain=domain, **attrs)
+
+
+def loadTraces(prefix):
+    """Read the spans written by every task of a run.
+
+    Parameters
+    ----------
+    prefix : str
+        Path prefix of the trace files
+
+    Returns
+    -------
+    records : list
+        Span records from all tasks
+    """
+
+    records = []
+
+    for fname in sorted(glob(getTraceFile(prefix, '*'))):
+        with open(fname, 'r') as fp:
+            for line in fp:
+                # the last line may be incomplete if the task was killed
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+    return records
+
+
+def summarizeStages(records, percentiles=[50, 90, 99]):
+    """Total and percentiles of the time spent in each stage.
+
+    Parameters
+    ----------
+    records : list
+        Span records, as returned by loadTraces
+    percentiles : list
+        Percentiles of the per span durations to report
+
+    Returns
+    -------
+    summary : dict
+        For each stage name, a dict containing the number of spans, total
+        and maximum duration, and each requested percentile
+    """
+
+    durs = {}
+
+    for r in records:
+        durs.setdefault(r['name'], []).append(r['dur'])
+
+    summary = {}
+
+    for name in durs:
+        d = np.array(durs[name])
+        summary[name] = {'count': len(d), 'total': np.sum(d), 'max': np.max(d)}
+
+        for p in percentiles:
+            summary[name]['p{}'.format(p)] = np.percentile(d, p)
+
+    return summary
+
+
+def findStragglers(records, stage='domain', factor=3.):
+    """Find domains whose time in a stage is much larger than typical.
+
+    Parameters
+    ----------
+    records : list
+        Span records, as returned by loadTraces
+    stage : str
+        Name of the stage to compare domains on
+    factor : float
+        Domains taking more than factor times the median are returned
+
+    Returns
+    -------
+    stragglers : list
+        (duration, domain key, rank) of each straggler, slowest first
+    """
+
+    times = {}
+
+    for r in records:
+        if (r['name'] != stage) | (r['domain'] is None):
+            continue
+
+        key = tuple(r['domain'])
+        dur, rank = times.get(key, (0., r['rank']))
+        times[key] = (dur + r['dur'], rank)
+
+    if len(times) == 0:
+        return []
+
+    median = np.median([t[0] for t in times.values()])
+
+    return sorted([(t[0], key, t[1]) for key, t in times.items()
+                   if t[0] > factor * median], reverse=True)
+
+
+def findMemoryPeaks(records, n=10):
+    """Find the domains with the largest peak memory use, and the stage
+    in which each of them peaked.
+
+    Parameters
+    ----------
+    records : list
+        Span records, as returned by loadTraces, with memory recorded
+    n : int
+        Number of domains to return
+
+    Returns
+    -------
+    peaks : list
+        (peak RSS in bytes, domain key, rank, stage) for the n domains
+        with the largest peak, largest first
+    """
+
+    peaks = {}
+
+    for r in records:
+        if ('rss_peak' not in r) | (r['domain'] is None) | (r['name'] == 'domain'):
+            continue
+
+        key = tuple(r['domain'])
+
+        # the deepest stage reaching the peak is the most specific
+        if ((key not in peaks) or (r['rss_peak'] > peaks[key][0]) or
+                ((r['rss_peak'] == peaks[key][0]) & (r['depth'] > peaks[key][3]))):
+            peaks[key] = (r['rss_peak'], r['rank'], r['name'], r['depth'])
+
+    return sorted([(p[0], key, p[1], p[2]) for key, p in peaks.items()],
+                  reverse=True)[:n]
+
+
+def summarizeSearch(records, n=10):
+    """Summarize the search statistics recorded by the assignment
+    kernels, when the galaxy model's search_stats option is set.
+
+    Parameters
+    ----------
+    records : list
+        Span records, as returned by loadTraces
+    n : int
+        Number of domains with the longest searches to return
+
+    Returns
+    -------
+    totals : dict
+        For each kernel span, the number of galaxies or halos reaching
+        each search phase, the number of candidates scanned in each
+        phase, and the summed scan length histogram of each phase
+    worst : list
+        (candidates scanned, kernel, domain key, rank) for the n kernel
+        calls that scanned the most candidates, largest first
+    """
+
+    totals = {}
+    worst = []
+
+    for r in records:
+        if 'search_steps' not in r:
+            continue
+
+        t = totals.setdefault(r['name'], {'search_n': np.zeros(len(r['search_n']), dtype=np.int64),
+                                          'search_steps': np.zeros(len(r['search_steps']), dtype=np.int64),
+                                          'search_hist': np.zeros((len(r['search_n']), 0), dtype=np.int64)})
+
+        t['search_n'] += r['search_n']
+        t['search_steps'] += r['search_steps']
+
+        hist = np.array(r['search_hist'], dtype=np.int64)
+        nbins = max(hist.shape[1], t['search_hist'].shape[1])
+        h = np.zeros((hist.shape[0], nbins), dtype=np.int64)
+        h[:, :hist.shape[1]] += hist
+        h[:, :t['search_hist'].shape[1]] += t['search_hist']
+        t['search_hist'] = h
+
+        worst.append((int(np.sum(r['search_steps'])), r['name'],
+                      tuple(r['domain']) if r['domain'] is not None else None,
+                      r['rank']))
+
+    return totals, sorted(worst, reverse=True)[:n]
+
+
+def getDomainMemory(records):
+    """Peak memory and size of each domain, e.g. for calibrating the
+    memory estimates of CostModel.
+
+    Parameters
+    ----------
+    records : list
+        Span records, as returned by loadTraces, with memory recorded
+
+    Returns
+    -------
+    domains : list
+        A dict for each domain, containing its key, rank, peak RSS and
+        python memory in bytes, the stage of the peak, and the numbers of
+        particles, halos and galaxies where they were recorded
+    """
+
+    domains = {}
+
+    for r in records:
+        if r['domain'] is None:
+            continue
+
+        d = domains.setdefault(tuple(r['domain']), {'domain': r['domain'],
+                                                    'rank': r['rank']})
+
+        for k in ['n_part', 'n_halo', 'n_gal']:
+            if (k in r) and (r['name'] in ['read', 'write']):
+                d[k] = r[k]
+
+        if ('py_peak' in r) and (r['py_peak'] is not None):
+            d['py_peak'] = max(d.get('py_peak', 0), r['py_peak'])
+
+    for peak, key, rank, stage in findMemoryPeaks(records, n=len(domains)):
+        domains[key]['rss_peak'] = peak
+        domains[key]['peak_stage'] = stage
+
+    return list(domains.values())
+
+
+def writeChromeTrace(records, filename):
+    """Write spans in the Chrome trace event format, which can be viewed
+    as a timeline in chrome://tracing or Perfetto. Each rank is shown as
+    a process and each of its threads as a track.
+
+    Parameters
+    ----------
+    records : list
+        Span records, as returned by loadTraces
+    filename : str
+        JSON file to write
+
+    Returns
+    -------
+    None
+    """
+
+    if len(records) == 0:
+        t0 = 0.
+    else:
+        t0 = min([r['start'] for r in records])
+
+    skip = ['name', 'rank', 'thread', 'start', 'dur', 'depth', 'parent']
+    events = []
+    tids = {}
+
+    for r in records:
+        # viewers need integer thread ids, so name them with metadata
+        if (r['rank'], r['thread']) not in tids:
+            tid = len([k for k in tids if k[0] == r['rank']])
+            tids[(r['rank'], r['thread'])] = tid
+
+            if tid == 0:
+                events.append({'name': 'process_name', 'ph': 'M',
+                               'pid': r['rank'], 'tid': tid,
+                               'args': {'name': 'rank {}'.format(r['rank'])}})
+
+            events.append({'name': 'thread_name', 'ph': 'M',
+                           'pid': r['rank'], 'tid': tid,
+                           'args': {'name': r['thread']}})
+
+        events.append({'name': r['name'],
+                       'ph': 'X',
+                       'ts': (r['start'] - t0) * 1e6,
+                       'dur': r['dur'] * 1e6,
+                       'pid': r['rank'],
+                       'tid': tids[(r['rank'], r['thread'])],
+                       'args': dict([(k, v) for k, v in r.items() if k not in skip])})
+
+        # memory is shown as a counter track for each rank
+        if 'rss_end' in r:
+            counters = dict([(k + '_GB', r[k + '_end'] / 1024 ** 3) for k in ['rss', 'py']
+                             if r[k + '_end'] is not None])
+            events.append({'name': 'memory', 'ph': 'C',
+                           'ts': (r['start'] + r['dur'] - t0) * 1e6,
+                           'pid': r['rank'],
+                           'args': counters})
+
+    with open(filename, 'w') as fp:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+
+
+def printReport(records, factor=3.):
+    """Print per stage totals and percentiles, and straggler domains.
+    """
+
+    summary = summarizeStages(records)
+    total = sum([summary[name]['total'] for name in summary
+                 if name == 'domain'])
+
+    print('{:>16} {:>8} {:>12} {:>8} {:>10} {:>10} {:>10} {:>10}'.format('stage', 'count', 'total(s)',
+                                                                         'frac', 'p50(s)', 'p90(s)',
+                                                                         'p99(s)', 'max(s)'))
+
+    for name in sorted(summary, key=lambda n: -summary[n]['total']):
+        s = summary[name]
+        frac = s['total'] / total if total > 0 else np.nan
+        print('{:>16} {:>8} {:>12.1f} {:>8.3f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(name, s['count'],
+                                                                                           s['total'], frac,
+                                                                                           s['p50'], s['p90'],
+                                                                                           s['p99'], s['max']))
+
+    stragglers = findStragglers(records, factor=factor)
+
+    print('')
+    print('{} domains took more than {}x the median domain time'.format(len(stragglers), factor))
+
+    for dur, key, rank in stragglers:
+        print('  {:>10.1f} s  rank {:>5}  domain {}'.format(dur, rank, key))
+
+    totals, worst = summarizeSearch(records)
+
+    if len(totals) > 0:
+        print('')
+        print('{:>18} {:>6} {:>14} {:>10} {:>16} {:>14}'.format('kernel', 'phase', 'n', 'frac',
+                                                               'scanned', 'scanned/n'))
+
+        for name in sorted(totals):
+            t = totals[name]
+
+            for i in range(len(t['search_n'])):
+                if t['search_n'][i] == 0:
+                    continue
+
+                print('{:>18} {:>6} {:>14} {:>10.4f} {:>16} {:>14.1f}'.format(name, i, t['search_n'][i],
+                                                                              t['search_n'][i] / t['search_n'][0],
+                                                                              t['search_steps'][i],
+                                                                              t['search_steps'][i] / t['search_n'][i]))
+
+        print('')
+        print('Kernel calls scanning the most candidates:')
+
+        for steps, name, key, rank in worst:
+            print('  {:>14}  {:>18}  rank {:>5}  domain {}'.format(steps, name, rank, key))
+
+    if not any(['rss_peak' in r for r in records]):
+        return
+
+    print('')
+    print('{:>16} {:>14} {:>14} {:>14}'.format('stage', 'max rss(GB)', 'max py(GB)', 'max py inc(GB)'))
+
+    for name in sorted(summary):
+        mem = [r for r in records if (r['name'] == name) & ('rss_peak' in r)]
+        if len(mem) == 0:
+            continue
+
+        py = [r for r in mem if r['py_peak'] is not None]
+
+        if len(py) > 0:
+            py_peak = max([r['py_peak'] for r in py]) / 1024 ** 3
+            py_inc = max([r['py_peak'] - r['py_start'] for r in py]) / 1024 ** 3
+        else:
+            py_peak = py_inc = np.nan
+
+        print('{:>16} {:>14.2f} {:>14.2f} {:>14.2f}'.format(name,
+                                                           max([r['rss_peak'] for r in mem]) / 1024 ** 3,
+                                                           py_peak, py_inc))
+
+    print('')
+    print('Domains with the largest peak memory:')
+
+    for peak, key, rank, stage in findMemoryPeaks(records):
+        print('  {:>8.2f} GB  rank {:>5}  stage {:>16}  domain {}'.format(peak / 1024 ** 3, rank, stage, key))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Summarize the trace files written by an addgals run')
+    parser.add_argument('prefix', type=str, help='Path prefix of the trace files, i.e. the trace setting of the run')
+    parser.add_argument('--straggler-factor', type=float, default=3.,
+                        help='Report domains taking more than this times the median')
+    parser.add_argument('--chrome', type=str, default=None,
+                        help='Also write a Chrome trace to this file')
+    parser.add_argument('--domains', type=str, default=None,
+                        help='Also write the peak memory and size of each domain to this JSON file')
+    args = parser.parse_args()
+
+    records = loadTraces(args.prefix)
+
+    if len(records) == 0:
+        raise(IOError('No trace files found for {}'.format(args.prefix)))
+
+    printReport(records, factor=args.straggler_factor)
+
+    if args.chrome is not None:
+        writeChromeTrace(records, args.chrome)
+        print('')
+        print('Wrote Chrome trace to {}'.format(os.path.abspath(args.chrome)))
+
+    if args.domains is not None:
+        with open(args.domains, 'w') as fp:
+            json.dump(getDomainMemory(records), fp, indent=1)
@@ -0,0 +1,205 @@
+from __future__ import print_function, division
+from threading import Thread, Condition
+from time import time
+
+
+class AsyncWriter(object):
+    """Write finished galaxy catalogs in a background thread while the
+    main thread goes on to the next domain.
+
+    Writes are queued along with an estimate of the memory held by the
+    catalog being written. Submitting blocks while max_depth writes are
+    already queued, or while the queued catalogs would exceed max_mem.
+    By default no MPI calls are made from the writer thread, so the
+    main thread collects finished writes with completed or wait and
+    does any communication itself. If MPI supports threads, on_complete
+    can instead act on each write from the writer thread as soon as it
+    finishes.
+    """
+
+    def __init__(self, max_depth=1, max_mem=None, on_complete=None):
+        """Create an AsyncWriter.
+
+        Parameters
+        ----------
+        max_depth : int
+            Maximum number of catalogs waiting to be written, including
+            the one being written
+        max_mem : float
+            Maximum number of GB of catalogs waiting to be written. A
+            catalog is always accepted if nothing else is queued.
+        on_complete : callable
+            If not None, called as on_complete(tag, result) in the writer
+            thread when each write finishes, instead of returning the
+            write from completed or wait. Errors it raises are raised
+            in the main thread like errors from writes.
+
+        Returns
+        -------
+        None
+        """
+
+        self.max_depth = int(max_depth)
+        self.on_complete = on_complete
+
+        if max_mem is not None:
+            self.max_mem = float(max_mem) * 1024 ** 3
+        else:
+            self.max_mem = None
+
+        self.cond = Condition()
+        self.jobs = []
+        self.results = []
+        self.mem_queued = 0
+        self.error = None
+        self.closed = False
+
+        self.thread = Thread(target=self._worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def estimateMemory(self, galaxyCatalog):
+        """Number of bytes held by the columns of a galaxy catalog.
+        """
+
+        return sum([v.nbytes for v in galaxyCatalog.catalog.values()])
+
+    def submit(self, galaxyCatalog, write, tag=None):
+        """Queue a galaxy catalog to be written. The caller must not use
+        the catalog afterwards.
+
+        Parameters
+        ----------
+        galaxyCatalog : GalaxyCatalog
+            Catalog to write
+        write : callable
+            Called with no arguments in the writer thread to write the
+            catalog, e.g. a partial of galaxyCatalog.write. Its return
+            value is returned by completed or wait.
+        tag : object
+            Returned along with the result of write, to identify it
+
+        Returns
+        -------
+        None
+        """
+
+        nbytes = self.estimateMemory(galaxyCatalog)
+
+        with self.cond:
+            while ((self.error is None) &
+                   ((len(self.jobs) >= self.max_depth) |
+                    ((self.max_mem is not None) & (len(self.jobs) > 0) &
+                     (self.mem_queued + nbytes > self.max_mem)))):
+                self.cond.wait()
+
+            self._raise()
+
+            self.mem_queued += nbytes
+            self.jobs.append((write, tag, nbytes))
+            self.cond.notify_all()
+
+    def _raise(self):
+
+        if self.error is not None:
+            err = self.error
+            self.error = None
+            raise err
+
+    def _worker(self):
+
+        while True:
+            with self.cond:
+                while (len(self.jobs) == 0) & (not self.closed):
+                    self.cond.wait()
+
+                if len(self.jobs) == 0:
+                    return
+
+                write, tag, nbytes = self.jobs[0]
+
+            try:
+                start = time()
+                result = write()
+                end = time()
+                print('Background write took {} s'.format(end - start))
+
+                if self.on_complete is not None:
+                    self.on_complete(tag, result)
+            except Exception as e:
+                with self.cond:
+                    self.error = e
+                    self.jobs = []
+                    self.mem_queued = 0
+                    self.cond.notify_all()
+                return
+
+            with self.cond:
+                self.jobs.pop(0)
+                self.mem_queued -= nbytes
+                if self.on_complete is None:
+                    self.results.append((tag, result))
+                self.cond.notify_all()
+
+    def completed(self):
+        """Get the writes that have finished since the last call.
+
+        Returns
+        -------
+        results : list
+            (tag, result) for each finished write, in submission order
+        """
+
+        with self.cond:
+            self._raise()
+            results = self.results
+            self.results = []
+
+        return results
+
+    def wait(self, max_pending=0):
+        """Block until at most max_pending writes are unfinished.
+
+        Parameters
+        ----------
+        max_pending : int
+            Number of writes allowed to still be queued
+
+        Returns
+        -------
+        results : list
+            (tag, result) for each finished write, in submission order
+        """
+
+        with self.cond:
+            while (self.error is None) & (len(self.jobs) > max_pending):
+                self.cond.wait()
+
+        return self.completed()
+
+    def pending(self):
+        """Tags of writes that haven't finished.
+        """
+
+        with self.cond:
+            return [job[1] for job in self.jobs]
+
+    def close(self):
+        """Finish all queued writes and stop the writer thread.
+
+        Returns
+        -------
+        results : list
+            (tag, result) for each write that finished since the
+            last call to completed or wait
+        """
+
+        results = self.wait(0)
+
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+        self.thread.join()
+
+        return results
@@ -0,0 +1,514 @@
+from __future__ import print_function, division
+import numpy as np
+import healpy as hp
+import tempfile
+import fitsio
+import shutil
+import os
+
+from PyAddgals.addgalsModel import assign, assignLcen, RdelModel
+from PyAddgals.colorModel import ColorModel
+from PyAddgals.cosmology import Cosmology
+from PyAddgals.domain import Domain
+from PyAddgals.galaxy import GalaxyCatalog
+from PyAddgals.kcorrect import KCorrect, k_reconstruct_maggies
+from PyAddgals.luminosityFunction import DSGLuminosityFunction
+from PyAddgals.schema import getPlaceholderNames
+from PyAddgals.shape import GMM, GMMShapes
+from PyAddgals.synthetic import _default_cosmology
+
+_filters = ['desy3/desy3std_g.par', 'desy3/desy3std_r.par',
+            'desy3/desy3std_i.par', 'desy3/desy3std_z.par',
+            'desy3/desy3_Y.par']
+
+_cosmo = None
+
+
+def getCosmology():
+    """Cosmology shared by all benchmarks, created on first use.
+    """
+
+    global _cosmo
+
+    if _cosmo is None:
+        _cosmo = Cosmology(**_default_cosmology)
+
+    return _cosmo
+
+
+class _Holder(object):
+    """Stands in for the NBody and Domain objects that kernels only
+    take a few attributes from.
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class KernelBenchmark(object):
+    """A kernel timed on synthetic inputs of increasing size.
+
+    setup makes the inputs for n elements, run calls the kernel on
+    them and is the only part that is timed, and teardown cleans up
+    anything run leaves behind. Inputs are made again for every run,
+    since some kernels modify them.
+    """
+
+    name = None
+
+    # largest size that finishes in reasonable time, for kernels
+    # whose cost per element is high
+    max_size = 10**8
+
+    def setup(self, n):
+        raise(NotImplementedError)
+
+    def run(self, state):
+        raise(NotImplementedError)
+
+    def teardown(self, state):
+        pass
+
+
+class Assign(KernelBenchmark):
+    """assign with n galaxies and two particles per galaxy, both with
+    log-normal densities, galaxies sorted by magnitude and particles by
+    density as in ADDGALSModel.assignParticles.
+    """
+
+    name = 'assign'
+    part_per_gal = 2
+
+    def setup(self, n):
+
+        n_part = self.part_per_gal * n
+
+        magnitude = np.sort(np.random.uniform(-23., -16., n))
+        redshift = np.random.uniform(0.1, 0.2, n)
+        density = np.random.lognormal(0., 0.8, n)
+        density_part = np.sort(np.random.lognormal(0., 0.8, n_part))
+        z_part = np.random.uniform(0.1, 0.2, n_part)
+
+        return (magnitude, redshift, density, z_part, density_part)
+
+    def run(self, state):
+
+        return assign(*state)
+
+
+class AssignLcen(KernelBenchmark):
+    """assignLcen with n galaxies sorted by density, and one halo above
+    3e12 Msun/h for every 20 galaxies. The central luminosity relation
+    spans -22.6 < mr0 < -19.4 over the halo masses.
+    """
+
+    name = 'assignLcen'
+    gal_per_halo = 20
+    params = np.array([-21.5, 2e13, 1.0, 0.5, 0.75])
+    scatter = 0.17
+
+    def setup(self, n):
+
+        n_halo = max(n // self.gal_per_halo, 1)
+
+        density = np.sort(np.random.lognormal(0., 0.8, n))
+        magnitude = np.random.uniform(-23.5, -17., n)
+        redshift = np.random.uniform(0.1, 0.2, n)
+
+        u = np.random.uniform(size=n_halo)
+        mass_halo = (3e12**-0.9 + u * (1e15**-0.9 - 3e12**-0.9))**(-1 / 0.9)
+        density_halo = np.sort(np.random.lognormal(-0.5, 0.6, n_halo))
+        z_halo = np.random.uniform(0.1, 0.2, n_halo)
+
+        return (redshift, magnitude, density, mass_halo, density_halo,
+                z_halo, self.params, self.scatter)
+
+    def run(self, state):
+
+        return assignLcen(*state)
+
+
+def makeRdelModel():
+    """RdelModel read from synthetic model files, with a density
+    distribution that doesn't depend on redshift or magnitude.
+    """
+
+    tmp = tempfile.mkdtemp()
+
+    try:
+        # parameters are read in sorted order, 15 coefficients each
+        # of muc, sigmac, muf, sigmaf and p
+        const = [('a_muc', -1.0), ('b_sigc', 0.6), ('c_muf', 2.0),
+                 ('d_sigf', 1.0), ('e_p', 0.5)]
+
+        rdelfile = os.path.join(tmp, 'rdel.txt')
+        with open(rdelfile, 'w') as fp:
+            for name, value in const:
+                for i in range(15):
+                    fp.write('{}_{:02d} {}\n'.format(name, i, value if i == 0 else 0.))
+
+        lcen = np.zeros(2, dtype=[('scale', 'f8'), ('M0', 'f8'), ('Mc', 'f8'),
+                                  ('a', 'f8'), ('b', 'f8'), ('k', 'f8')])
+        lcen['scale'] = [0., 1.]
+        lcen['M0'] = AssignLcen.params[0]
+        lcen['Mc'] = np.log10(AssignLcen.params[1])
+        lcen['a'], lcen['b'], lcen['k'] = AssignLcen.params[2:]
+
+        lcenfile = os.path.join(tmp, 'lcen.fits')
+        fitsio.write(lcenfile, lcen, clobber=True)
+
+        rdel = RdelModel(None, DSGLuminosityFunction(getCosmology()),
+                         rdelModelFile=rdelfile, lcenModelFile=lcenfile,
+                         lcenMassMin=[3e12], scatter=AssignLcen.scatter)
+    finally:
+        shutil.rmtree(tmp)
+
+    return rdel
+
+
+class SampleDensity(KernelBenchmark):
+    """RdelModel.sampleDensity for n galaxies at 0.1 < z < 0.2 and
+    -23 < M_r < -16.
+    """
+
+    name = 'sampleDensity'
+
+    def __init__(self):
+
+        self.rdel = None
+        self.domain = _Holder(zmin=0.1, zmax=0.2)
+
+    def setup(self, n):
+
+        if self.rdel is None:
+            self.rdel = makeRdelModel()
+
+        z = np.random.uniform(self.domain.zmin, self.domain.zmax, n)
+        mag = np.random.uniform(-23., -16., n)
+
+        return (self.domain, z, mag)
+
+    def run(self, state):
+
+        return self.rdel.sampleDensity(*state)
+
+
+class SampleLuminosities(KernelBenchmark):
+    """DSGLuminosityFunction.sampleLuminosities for n sorted redshifts
+    at 0.1 < z < 0.2.
+    """
+
+    name = 'sampleLuminosities'
+
+    def __init__(self):
+
+        self.lf = None
+        self.domain = _Holder(zmin=0.1, zmax=0.2)
+
+    def setup(self, n):
+
+        if self.lf is None:
+            self.lf = DSGLuminosityFunction(getCosmology(), magmin=25.)
+
+        z = np.sort(np.random.uniform(self.domain.zmin, self.domain.zmax, n))
+
+        return (self.domain, z)
+
+    def run(self, state):
+
+        return self.lf.sampleLuminosities(*state)
+
+
+def makeColorModel():
+    """ColorModel without a training set, for the kernels that don't
+    use one.
+    """
+
+    nbody = _Holder(cosmo=getCosmology())
+
+    return ColorModel(nbody, trainingSetFile='synthetic',
+                      redFractionModelFile='synthetic', filters=_filters,
+                      no_colors=True)
+
+
+class ComputeSigma5(KernelBenchmark):
+    """ColorModel.computeSigma5 for n galaxies at 0.3 < z < 0.4, in a
+    patch whose area grows with n to keep 2e4 galaxies per square
+    degree. The search window is the one computeRankSigma5 uses.
+    """
+
+    name = 'computeSigma5'
+    surface_density = 2e4
+
+    def __init__(self):
+
+        self.cm = None
+
+    def setup(self, n):
+
+        if self.cm is None:
+            self.cm = makeColorModel()
+
+        side = np.sqrt(n / self.surface_density) * np.pi / 180
+
+        z = np.random.uniform(0.3, 0.4, n)
+        mag = np.random.uniform(-23., -16., n)
+        pos = np.zeros((n, 3))
+        pos[:, 0] = np.random.uniform(np.pi / 4, np.pi / 4 + side, n)
+        pos[:, 1] = np.random.uniform(0., side, n)
+        pos[:, 2] = z
+
+        dt = min(100. / getCosmology().angularDiameterDistance(0.3), 1.5)
+
+        return (z, mag, pos, dt)
+
+    def run(self, state):
+
+        z, mag, pos, dt = state
+
+        return self.cm.computeSigma5(z, mag, pos, dt=dt)
+
+
+class RankSigma5(KernelBenchmark):
+    """ColorModel.rankSigma5 for n galaxies with log-normal sigma5, in
+    the redshift and magnitude windows computeRankSigma5 uses.
+    """
+
+    name = 'rankSigma5'
+
+    def __init__(self):
+
+        self.cm = None
+
+    def setup(self, n):
+
+        if self.cm is None:
+            self.cm = makeColorModel()
+
+        z = np.random.uniform(0.1, 0.2, n)
+        mag = np.random.uniform(-23., -16., n)
+        sigma5 = np.random.lognormal(0., 1., n)
+
+        return (z, mag, sigma5, 0.01, self.cm.dm_rank)
+
+    def run(self, state):
+
+        return self.cm.rankSigma5(*state)
+
+
+class MatchTrainingSet(KernelBenchmark):
+    """ColorModel.matchTrainingSet for n galaxies, against a training
+    set of 2e5 galaxies, about the size of the SDSS training set.
+    """
+
+    name = 'matchTrainingSet'
+    n_train = 200000
+
+    def __init__(self):
+
+        self.cm = None
+
+    def setup(self, n):
+
+        if self.cm is None:
+            self.cm = makeColorModel()
+
+            train = np.zeros(self.n_train, dtype=[('ABSMAG', 'f8', (5,)),
+                                                  ('PSIGMA5', 'f8'),
+                                                  ('ISRED', 'i4')])
+            train['ABSMAG'] = np.random.uniform(-23., -16., self.n_train).reshape(-1, 1)
+            train['PSIGMA5'] = np.random.uniform(size=self.n_train)
+            train['ISRED'] = np.random.uniform(size=self.n_train) < 0.4
+            self.cm.trainingSet = train
+
+        mag = np.random.uniform(-23., -16., n)
+        ranksigma5 = np.random.uniform(size=n)
+        redfraction = np.random.uniform(size=n)
+
+        return (mag, ranksigma5, redfraction)
+
+    def run(self, state):
+
+        return self.cm.matchTrainingSet(*state)
+
+
+class KProjectionTable(KernelBenchmark):
+    """KCorrect.k_projection_table for n redshifts, projecting the
+    default templates onto the five DES filters.
+    """
+
+    name = 'k_projection_table'
+    max_size = 10**6
+
+    def __init__(self):
+
+        self.filters = None
+
+    def setup(self, n):
+
+        kcorr = KCorrect(nz=n)
+
+        if self.filters is None:
+            self.filters = kcorr.load_filters(_filters)
+
+        filter_lambda, filter_pass = self.filters
+
+        return (kcorr, filter_pass, filter_lambda, [0.1] * len(_filters))
+
+    def run(self, state):
+
+        kcorr, filter_pass, filter_lambda, band_shift = state
+
+        return kcorr.k_projection_table(filter_pass, filter_lambda, band_shift)
+
+
+class KReconstructMaggies(KernelBenchmark):
+    """k_reconstruct_maggies for n galaxies at 0 < z < 2, with the
+    projection table colorModel uses.
+    """
+
+    name = 'k_reconstruct_maggies'
+
+    def __init__(self):
+
+        self.rmatrix = None
+
+    def setup(self, n):
+
+        if self.rmatrix is None:
+            kcorr = KCorrect()
+            filter_lambda, filter_pass = kcorr.load_filters(_filters)
+            self.rmatrix = kcorr.k_projection_table(filter_pass, filter_lambda,
+                                                    [0.1] * len(_filters))
+            self.zvals = kcorr.zvals
+
+        coeffs = np.random.uniform(0., 1e-3, (n, self.rmatrix.shape[1]))
+        z = np.random.uniform(0., 2., n)
+
+        return (self.rmatrix, coeffs, z, self.zvals)
+
+    def run(self, state):
+
+        return k_reconstruct_maggies(*state)
+
+
+class GMMShapesSampleAll(KernelBenchmark):
+    """GMMShapes.sampleAll for n galaxies, from a 50 component mixture
+    of size and ellipticity conditioned on one magnitude, as in the
+    production shape model.
+    """
+
+    name = 'GMMShapes.sampleAll'
+    n_components = 50
+
+    def __init__(self):
+
+        self.shapes = None
+
+    def setup(self, n):
+
+        if self.shapes is None:
+            nc = self.n_components
+            a = np.random.normal(size=(nc, 3, 3))
+            cov = np.einsum('ijk,ilk->ijl', a, a) + 0.1 * np.eye(3)
+            weights = np.random.uniform(size=nc)
+
+            self.gmm = GMM(n_components=nc, cov=cov,
+                           mu=np.random.normal(size=(nc, 3)),
+                           weights=weights / np.sum(weights))
+            self.gmm.calculateConditionalCovs(np.array([True, False, False]))
+
+            self.shapes = GMMShapes(getCosmology(), n_components=nc,
+                                    cov_file='synthetic', means_file='synthetic',
+                                    weights_file='synthetic',
+                                    conditional_fields=[('OMAG', 2)],
+                                    conditional_field_mean=[22.33],
+                                    conditional_field_std=[1.25])
+
+        X = np.random.normal(22.33, 1.25, (n, 1))
+
+        return X
+
+    def run(self, X):
+
+        s = self.shapes
+
+        return s.sampleAll(X, s.conditional_field_mean, s.conditional_field_std,
+                           slice(0, s.n_feat), slice(s.n_feat, s.n_feat + 2),
+                           self.gmm.lil, self.gmm.predmat, self.gmm.featcov,
+                           self.gmm.ifeatcov, self.gmm.mu, self.gmm.weights,
+                           s.n_components, s.n_feat, s.n_pred)
+
+
+class GalaxyCatalogWrite(KernelBenchmark):
+    """GalaxyCatalog.write of n galaxies in one nside 4 pixel, with the
+    columns painted by a lightcone run with colors in five filters and
+    shapes, written as FITS.
+    """
+
+    name = 'GalaxyCatalog.write'
+    nside = 4
+
+    def __init__(self):
+
+        self.domain = None
+
+    def setup(self, n):
+
+        if self.domain is None:
+            cosmo = getCosmology()
+            self.domain = Domain(cosmo, fmt='BCCLightcone', nside=self.nside,
+                                 nest=True, rmin=0., rmax=1000., nrbins=1,
+                                 lbox=1000)
+            self.domain.pix = 0
+            self.domain.rcore = (400., 700.)
+            self.domain.key = (0, 0, 0)
+            self.nbody = _Holder(cosmo=cosmo, domain=self.domain)
+
+        nk = len(_filters)
+        columns = [(c, np.float64, ()) for c in ['PX', 'PY', 'PZ', 'VX', 'VY', 'VZ',
+                                                 'Z_COS', 'Z', 'MAG_R', 'DIST8',
+                                                 'M200', 'R200', 'RHALO']]
+        columns += [('HALOID', np.float64, ()), ('CENTRAL', np.float64, ()),
+                    ('BAD_ASSIGN', np.bool_, ()), ('SIGMA5', np.float64, ()),
+                    ('PSIGMA5', np.float64, ()), ('SEDID', np.int64, ()),
+                    ('MAG_R_EVOL', np.float64, ()), ('TMAG', np.float64, (nk,)),
+                    ('AMAG', np.float64, (nk,)), ('TSIZE', np.float64, ()),
+                    ('TE', np.float64, (2,)), ('EPSILON_IA', np.float64, (2,)),
+                    ('COMOVING_SIZE', np.float64, ()), ('ID', np.int64, ()),
+                    ('TRA', np.float64, ()), ('TDEC', np.float64, ())]
+
+        # placeholders are allocated as when painting, so the catalog
+        # is written without copying it
+        gc = GalaxyCatalog(self.nbody)
+        gc.allocate(n, columns, getPlaceholderNames())
+
+        for name, dtype, shape in columns:
+            if gc.store.dtype[name].kind == 'f':
+                gc.catalog[name][:] = np.random.uniform(size=gc.catalog[name].shape)
+
+        # directions within the domain pixel, from its nest ordered
+        # children at high resolution
+        nside_hi = 4096
+        nchild = (nside_hi // self.nside)**2
+        child = self.domain.pix * nchild + np.random.randint(0, nchild, n)
+        pos = np.array(hp.pix2vec(nside_hi, child, nest=True)).T
+        pos *= np.random.uniform(self.domain.rcore[0], self.domain.rcore[1], n).reshape(-1, 1)
+        gc.getPositions()[:] = pos
+
+        return (gc, tempfile.mkdtemp())
+
+    def run(self, state):
+
+        gc, tmp = state
+
+        return gc.write(os.path.join(tmp, 'Benchmark'), self.nside)
+
+    def teardown(self, state):
+
+        shutil.rmtree(state[1])
+
+
+benchmarks = [Assign, AssignLcen, SampleDensity, SampleLuminosities,
+              ComputeSigma5, RankSigma5, MatchTrainingSet, KProjectionTable,
+              KReconstructMaggies, GMMShapesSampleAll, GalaxyCatalogWrite]
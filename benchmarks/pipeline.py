@@ -0,0 +1,284 @@
+from __future__ import print_function, division
+from time import time
+import subprocess
+import argparse
+import shlex
+import json
+import sys
+import os
+
+from PyAddgals.config import parseConfig
+from PyAddgals.synthetic import makeBox, makeLightconeInputs, writeConfig
+from PyAddgals.trace import loadTraces, summarizeStages
+
+from .run import getMetadata
+
+_addgals = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'bin', 'addgals')
+
+
+def getPainters(nprocs, write_mode):
+    """Number of tasks that paint domains. Every task paints in alltoall
+    mode, otherwise rank 0 only arbitrates writes.
+    """
+
+    if write_mode == 'alltoall':
+        return nprocs
+    else:
+        return nprocs - 1
+
+
+def runAddgals(config_file, rundir, painters, mpiexec='mpiexec',
+               write_mode=None, trace_memory=False):
+    """Run bin/addgals on a config under MPI, tracing every task, and
+    summarize the run from its traces.
+
+    Parameters
+    ----------
+    config_file : str
+        Config to run. Its outputs are redirected to rundir.
+    rundir : str
+        Directory for the outputs, traces and log of the run
+    painters : int
+        Number of tasks painting domains. One more task is started
+        for the write arbiter unless write_mode is alltoall.
+    mpiexec : str
+        Command used to start MPI jobs
+    write_mode : str
+        If not None, overrides the write_mode of the config
+    trace_memory : bool
+        If True, also record the memory of each stage
+
+    Returns
+    -------
+    run : dict
+        Number of tasks and painters, wall time, painting time,
+        galaxies written, galaxies per core-second over the wall and
+        painting times, time spent waiting for the write lock, and the
+        total, count and maximum time of each traced stage
+    """
+
+    if not os.path.exists(rundir):
+        os.makedirs(rundir)
+
+    config = parseConfig(config_file)
+    runtime = config['Runtime']
+
+    if write_mode is not None:
+        runtime['write_mode'] = write_mode
+
+    write_mode = runtime.get('write_mode', 'arbiter')
+
+    if write_mode == 'alltoall':
+        nprocs = painters
+    else:
+        nprocs = painters + 1
+
+    runtime['outpath'] = os.path.join(rundir, 'Synthetic')
+    runtime['trace'] = os.path.join(rundir, 'trace')
+    runtime['trace_memory'] = bool(trace_memory)
+    runtime['restart'] = False
+
+    run_config = os.path.join(rundir, 'config.yaml')
+    writeConfig(run_config, config)
+
+    cmd = shlex.split(mpiexec) + ['-n', str(nprocs), sys.executable, _addgals, run_config]
+    print('Running {}'.format(' '.join(cmd)))
+    sys.stdout.flush()
+
+    log = os.path.join(rundir, 'addgals.log')
+    start = time()
+
+    with open(log, 'w') as fp:
+        status = subprocess.call(cmd, stdout=fp, stderr=subprocess.STDOUT)
+
+    wall = time() - start
+
+    if status != 0:
+        raise(RuntimeError('addgals exited with status {}, see {}'.format(status, log)))
+
+    records = loadTraces(runtime['trace'])
+    summary = summarizeStages(records)
+
+    # galaxies are counted where they are written, which depends
+    # on the write mode
+    n_gal = int(sum([r.get('n_gal', 0) for r in records if r['name'] == 'write']))
+
+    # wall time includes starting python, compiling numba kernels and
+    # merging shards, which dominate small runs, so also time painting
+    # from the first domain starting to the last domain or write ending
+    painting = [r for r in records if r['name'] in ['domain', 'write']]
+
+    if len(painting) == 0:
+        raise(RuntimeError('No domains were traced, see {}'.format(log)))
+
+    paint_time = (max([r['start'] + r['dur'] for r in painting]) -
+                  min([r['start'] for r in painting if r['name'] == 'domain']))
+
+    stages = dict([(name, {'total': float(summary[name]['total']),
+                           'count': int(summary[name]['count']),
+                           'max': float(summary[name]['max'])})
+                   for name in summary])
+
+    return {'nprocs': nprocs, 'painters': getPainters(nprocs, write_mode),
+            'write_mode': write_mode, 'wall': wall, 'paint_time': paint_time,
+            'n_gal': n_gal, 'gal_per_core_s_wall': n_gal / (wall * nprocs),
+            'gal_per_core_s': n_gal / (paint_time * nprocs),
+            'write_wait': stages.get('write_wait', {'total': 0.})['total'],
+            'stages': stages}
+
+
+def addEfficiency(runs):
+    """Add the scaling efficiency of each run, relative to the run with
+    the fewest painters, as the ratio of galaxies painted per painter
+    second. For a fixed problem this is T_0 n_0 / (T n), and for a
+    problem growing with the number of painters it is T_0 / T, up to
+    the variation in the number of galaxies. Times are painting times,
+    without start up and merging, and the same ratios of wall times are
+    added as speedup_wall and efficiency_wall.
+
+    Parameters
+    ----------
+    runs : list
+        Runs returned by runAddgals, modified in place
+
+    Returns
+    -------
+    None
+    """
+
+    ref = min(runs, key=lambda r: r['painters'])
+
+    for t, suffix in [('paint_time', ''), ('wall', '_wall')]:
+        ref_rate = ref['n_gal'] / (ref[t] * ref['painters'])
+
+        for r in runs:
+            r['speedup' + suffix] = ref[t] / r[t]
+            r['efficiency' + suffix] = r['n_gal'] / (r[t] * r['painters']) / ref_rate
+
+
+def printScaling(runs, mode):
+
+    print('')
+    print('{} scaling'.format(mode))
+    print('Painting times run from the first domain starting to the last write ending')
+    print('{:>8} {:>8} {:>10} {:>10} {:>12} {:>12} {:>10} {:>8} {:>12} {:>10} {:>8} {:>14} {:>10}'.format(
+        'painters', 'tasks', 'wall(s)', 'paint(s)', 'galaxies', 'gal/core-s', 'speedup', 'eff',
+        'wall gal/c-s', 'wall spdup', 'wall eff', 'write wait(s)', 'wait frac'))
+
+    for r in sorted(runs, key=lambda r: r['painters']):
+        print('{:>8} {:>8} {:>10.1f} {:>10.1f} {:>12} {:>12.1f} {:>10.2f} {:>8.2f} {:>12.1f} {:>10.2f} {:>8.2f} '
+              '{:>14.1f} {:>10.3f}'.format(r['painters'], r['nprocs'], r['wall'], r['paint_time'], r['n_gal'],
+                                           r['gal_per_core_s'], r['speedup'], r['efficiency'],
+                                           r['gal_per_core_s_wall'], r['speedup_wall'], r['efficiency_wall'],
+                                           r['write_wait'], r['write_wait'] / (r['paint_time'] * r['painters'])))
+
+    # time in each stage as a fraction of the painters' painting time.
+    # Stages are nested, e.g. paint is inside domain, so they don't add
+    # up to 1
+    names = sorted(set([n for r in runs for n in r['stages']]),
+                   key=lambda n: -max([r['stages'].get(n, {'total': 0.})['total'] for r in runs]))
+
+    print('')
+    print('{:>18}'.format('stage') + ''.join(['{:>10}'.format('n={}'.format(r['painters']))
+                                              for r in sorted(runs, key=lambda r: r['painters'])]))
+
+    for name in names:
+        fracs = [r['stages'].get(name, {'total': 0.})['total'] / (r['paint_time'] * r['painters'])
+                 for r in sorted(runs, key=lambda r: r['painters'])]
+        print('{:>18}'.format(name) + ''.join(['{:>10.3f}'.format(f) for f in fracs]))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Time bin/addgals end to end on synthetic lightcones '
+                                                 'at increasing numbers of MPI tasks')
+    parser.add_argument('outdir', type=str, help='Directory for the inputs and runs')
+    parser.add_argument('--template', type=str, required=True,
+                        help='Config to take the GalaxyModel and Runtime settings from')
+    parser.add_argument('--ranks', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='Numbers of painting tasks to run with')
+    parser.add_argument('--modes', type=str, nargs='+', default=['strong', 'weak'],
+                        choices=['strong', 'weak'], help='Scaling tests to run')
+    parser.add_argument('--pixels-per-rank', type=int, default=1,
+                        help='Lightcone pixels per painting task of the largest strong '
+                             'scaling run, and of every weak scaling run')
+    parser.add_argument('--nside', type=int, default=4,
+                        help='nside of the lightcone pixels')
+    parser.add_argument('--nrbins', type=int, default=2,
+                        help='Radial bins of the decomposition')
+    parser.add_argument('--rmax', type=float, default=400.,
+                        help='Maximum radius of the lightcones in Mpc/h')
+    parser.add_argument('--lbox', type=float, default=256.,
+                        help='Box size in Mpc/h')
+    parser.add_argument('--density', type=float, default=0.1,
+                        help='Particles per (Mpc/h)^3')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--mpiexec', type=str, default='mpiexec',
+                        help='Command used to start MPI jobs, e.g. "mpirun --oversubscribe"')
+    parser.add_argument('--write-mode', type=str, default=None,
+                        choices=['arbiter', 'shards', 'alltoall'],
+                        help='Override the write_mode of the template')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Also record the memory of each stage')
+    parser.add_argument('--output', type=str, default=None,
+                        help='JSON file to write results to')
+    args = parser.parse_args()
+
+    ranks = sorted(args.ranks)
+
+    # ranks are numbers of painting tasks in every write mode
+    for n in ranks:
+        if n < 1:
+            raise(ValueError('Need at least one painting task'))
+
+    npix_max = max(ranks) * args.pixels_per_rank
+    if npix_max > 12 * args.nside**2:
+        raise(ValueError('{} pixels requested, but nside {} only has {}'.format(npix_max, args.nside,
+                                                                               12 * args.nside**2)))
+
+    box = makeBox(args.lbox, args.density, seed=args.seed)
+    configs = {}
+
+    def getConfig(npix):
+        # pixels 0 to npix - 1 are contiguous in nest ordering
+        if npix not in configs:
+            configs[npix] = makeLightconeInputs(os.path.join(args.outdir, 'inputs_{}pix'.format(npix)),
+                                                box, args.rmax, args.nside, list(range(npix)),
+                                                nrbins=args.nrbins, template=args.template)
+        return configs[npix]
+
+    out = {'meta': getMetadata(), 'args': vars(args)}
+    done = {}
+
+    for mode in args.modes:
+        runs = []
+
+        for n in ranks:
+            if mode == 'strong':
+                npix = npix_max
+            else:
+                npix = n * args.pixels_per_rank
+
+            # the largest weak scaling run is the same as the
+            # largest strong scaling run
+            if (npix, n) not in done:
+                rundir = os.path.join(args.outdir, 'runs', '{}pix_{}ranks'.format(npix, n))
+                done[(npix, n)] = runAddgals(getConfig(npix), rundir, n, mpiexec=args.mpiexec,
+                                             write_mode=args.write_mode,
+                                             trace_memory=args.trace_memory)
+                done[(npix, n)]['npix'] = npix
+
+            runs.append(dict(done[(npix, n)]))
+
+        addEfficiency(runs)
+        printScaling(runs, mode)
+        out[mode] = runs
+
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(out, fp, indent=1)
+
+
+if __name__ == '__main__':
+    main()
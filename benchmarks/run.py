@@ -0,0 +1,346 @@
+from __future__ import print_function, division
+from time import time, strftime
+import numpy as np
+import subprocess
+import platform
+import argparse
+import json
+import sys
+import gc
+import os
+
+from PyAddgals.trace import _getRSS, _resetRSSPeak
+
+from .kernels import benchmarks
+
+_default_baseline = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def getMetadata():
+    """Describe the machine and code a set of results was measured on.
+    """
+
+    meta = {'date': strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': platform.node(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'ncpu': os.cpu_count() if hasattr(os, 'cpu_count') else None}
+
+    try:
+        import numba
+        meta['numba'] = numba.__version__
+    except ImportError:
+        meta['numba'] = None
+
+    try:
+        meta['commit'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                                 cwd=os.path.dirname(os.path.abspath(__file__)),
+                                                 stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        meta['commit'] = None
+
+    return meta
+
+
+def timeKernel(bench, n, repeat=3, seed=0):
+    """Time a kernel on inputs of n elements.
+
+    Parameters
+    ----------
+    bench : KernelBenchmark
+        Benchmark to run
+    n : int
+        Number of elements
+    repeat : int
+        Number of timed runs. The fastest is reported.
+    seed : int
+        Random seed used to make the inputs
+
+    Returns
+    -------
+    result : dict
+        name, size, time, times and throughput in elements per second,
+        and the memory of the inputs and the peak memory allocated by
+        the kernel above them, in bytes. Memory is None where the peak
+        resident set size can't be reset, i.e. off linux.
+    """
+
+    times = []
+    mem_input = []
+    mem_peak = []
+
+    for i in range(repeat):
+        np.random.seed(seed + i)
+
+        gc.collect()
+        rss_setup, _ = _getRSS()
+        state = bench.setup(n)
+
+        gc.collect()
+        rss_start, _ = _getRSS()
+        reset = _resetRSSPeak()
+
+        start = time()
+        bench.run(state)
+        times.append(time() - start)
+
+        _, rss_peak = _getRSS()
+
+        if reset & (rss_start is not None):
+            mem_input.append(rss_start - rss_setup)
+            mem_peak.append(rss_peak - rss_start)
+
+        bench.teardown(state)
+        del state
+
+    best = min(times)
+
+    return {'name': bench.name, 'size': n, 'time': best, 'times': times,
+            'throughput': n / best if best > 0 else None,
+            'mem_input': max(mem_input) if len(mem_input) > 0 else None,
+            'mem_peak': max(mem_peak) if len(mem_peak) > 0 else None}
+
+
+def runBenchmarks(names=None, sizes=None, repeat=3, max_time=600.,
+                  max_mem=None, no_limits=False, seed=0):
+    """Run the kernel benchmarks over a range of sizes.
+
+    Sizes are skipped when the time or memory of the previous size,
+    scaled linearly, is over the limits, or when they are above the
+    largest size that a kernel can reasonably run at.
+
+    Parameters
+    ----------
+    names : list
+        Names of the benchmarks to run, all of them if None
+    sizes : list
+        Numbers of elements to run at, 10^4, 10^5 and 10^6 if None
+    repeat : int
+        Number of timed runs at each size
+    max_time : float
+        Skip sizes expected to take longer than this, in seconds
+    max_mem : float
+        Skip sizes expected to need more than this, in GB
+    no_limits : bool
+        If True, run every size, ignoring the limits
+    seed : int
+        Random seed used to make the inputs
+
+    Returns
+    -------
+    results : list
+        Result of timeKernel for each kernel and size that was run
+    skipped : list
+        (name, size, reason) for each size that was skipped
+    """
+
+    if sizes is None:
+        sizes = [10**4, 10**5, 10**6]
+
+    available = [b.name for b in benchmarks]
+
+    if names is None:
+        names = available
+
+    for name in names:
+        if name not in available:
+            raise(ValueError('No benchmark named {}, choose from {}'.format(name, available)))
+
+    results = []
+    skipped = []
+
+    for b in benchmarks:
+        if b.name not in names:
+            continue
+
+        bench = b()
+
+        # compile numba kernels and load model data before timing
+        np.random.seed(seed)
+        start = time()
+        state = bench.setup(1000)
+        bench.run(state)
+        bench.teardown(state)
+        del state
+        print('{}: warm up took {:.2f}s'.format(bench.name, time() - start))
+        sys.stdout.flush()
+
+        last = None
+
+        for n in sorted(sizes):
+            reason = None
+
+            if not no_limits:
+                if n > bench.max_size:
+                    reason = 'above max size {}'.format(bench.max_size)
+                elif last is not None:
+                    scale = n / last['size']
+
+                    if last['time'] * scale * repeat > max_time:
+                        reason = 'expected to take {:.0f}s'.format(last['time'] * scale * repeat)
+                    elif ((max_mem is not None) & (last['mem_peak'] is not None) and
+                          (last['mem_input'] + last['mem_peak']) * scale > max_mem * 1024**3):
+                        reason = 'expected to need {:.1f} GB'.format((last['mem_input'] + last['mem_peak']) *
+                                                                     scale / 1024**3)
+
+            if reason is not None:
+                print('{}: skipping n={}, {}'.format(bench.name, n, reason))
+                skipped.append((bench.name, n, reason))
+                continue
+
+            last = timeKernel(bench, n, repeat=repeat, seed=seed)
+            results.append(last)
+            printResult(last)
+
+    return results, skipped
+
+
+def _formatMem(mem):
+
+    if mem is None:
+        return '{:>10}'.format('-')
+
+    return '{:>10.3f}'.format(mem / 1024**3)
+
+
+def printResult(r):
+
+    print('{:>24} {:>10} {:>10.3f} {:>14.4g} {} {}'.format(r['name'], r['size'], r['time'],
+                                                           r['throughput'], _formatMem(r['mem_input']),
+                                                           _formatMem(r['mem_peak'])))
+    sys.stdout.flush()
+
+
+def compareResults(results, baseline, tolerance=0.2):
+    """Compare results with a baseline run of the same kernels and sizes.
+
+    Parameters
+    ----------
+    results : list
+        Results returned by runBenchmarks
+    baseline : list
+        Results of an earlier run
+    tolerance : float
+        Fractional increase in time or peak memory counted as a
+        regression
+
+    Returns
+    -------
+    comparison : list
+        (name, size, time ratio, memory ratio, regressed) for each
+        result that is in the baseline. Ratios are new / baseline, and
+        the memory ratio is None if either run has no memory measurement.
+    """
+
+    base = dict([((b['name'], b['size']), b) for b in baseline])
+    comparison = []
+
+    for r in results:
+        b = base.get((r['name'], r['size']), None)
+
+        if b is None:
+            continue
+
+        tratio = r['time'] / b['time'] if b['time'] > 0 else np.inf
+
+        if (r['mem_peak'] is not None) & (b['mem_peak'] is not None):
+            # ignore changes in peaks too small to measure reliably
+            mratio = (max(r['mem_peak'], 2**20) /
+                      max(b['mem_peak'], 2**20))
+        else:
+            mratio = None
+
+        regressed = (tratio > 1 + tolerance) | ((mratio is not None) and (mratio > 1 + tolerance))
+        comparison.append((r['name'], r['size'], tratio, mratio, regressed))
+
+    return comparison
+
+
+def printComparison(comparison, tolerance):
+
+    print('')
+    print('{:>24} {:>10} {:>10} {:>10}'.format('kernel', 'n', 'time', 'memory'))
+
+    for name, n, tratio, mratio, regressed in comparison:
+        mratio = '{:>10}'.format('-') if mratio is None else '{:>10.2f}'.format(mratio)
+        print('{:>24} {:>10} {:>10.2f} {} {}'.format(name, n, tratio, mratio,
+                                                     'REGRESSION' if regressed else ''))
+
+    nreg = sum([c[4] for c in comparison])
+    print('')
+    print('{} of {} results regressed by more than {:.0f}%'.format(nreg, len(comparison),
+                                                                   100 * tolerance))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Time the PyAddgals kernels on synthetic inputs')
+    parser.add_argument('--kernels', type=str, nargs='+', default=None,
+                        help='Kernels to run, all of them by default')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[4, 5, 6],
+                        help='Powers of ten of the numbers of elements to run at')
+    parser.add_argument('--full', action='store_true',
+                        help='Run at 10^4 to 10^8 elements')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs at each size')
+    parser.add_argument('--max-time', type=float, default=600.,
+                        help='Skip sizes expected to take longer than this in seconds')
+    parser.add_argument('--max-mem', type=float, default=None,
+                        help='Skip sizes expected to need more than this in GB')
+    parser.add_argument('--no-limits', action='store_true',
+                        help='Run every size, ignoring the limits')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--output', type=str, default=None,
+                        help='JSON file to write results to')
+    parser.add_argument('--baseline', type=str, default=_default_baseline,
+                        help='JSON results to compare against')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Write the results to the baseline file instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Fractional slowdown or memory increase counted as a regression')
+    args = parser.parse_args()
+
+    if args.full:
+        args.sizes = [4, 5, 6, 7, 8]
+
+    print('{:>24} {:>10} {:>10} {:>14} {:>10} {:>10}'.format('kernel', 'n', 'time(s)', 'n/s',
+                                                             'input(GB)', 'peak(GB)'))
+
+    results, skipped = runBenchmarks(names=args.kernels,
+                                     sizes=[10**s for s in args.sizes],
+                                     repeat=args.repeat, max_time=args.max_time,
+                                     max_mem=args.max_mem, no_limits=args.no_limits,
+                                     seed=args.seed)
+
+    out = {'meta': getMetadata(), 'results': results,
+           'skipped': [{'name': n, 'size': s, 'reason': r} for n, s, r in skipped]}
+
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(out, fp, indent=1)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fp:
+            json.dump(out, fp, indent=1)
+
+        print('Wrote baseline to {}'.format(args.baseline))
+        return
+
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}, run with --save-baseline to make one'.format(args.baseline))
+        return
+
+    with open(args.baseline, 'r') as fp:
+        baseline = json.load(fp)
+
+    print('')
+    print('Comparing with baseline from {} on {}, commit {}'.format(baseline['meta']['date'],
+                                                                   baseline['meta']['host'],
+                                                                   baseline['meta']['commit']))
+
+    comparison = compareResults(results, baseline['results'], tolerance=args.tolerance)
+    printComparison(comparison, args.tolerance)
+
+    if any([c[4] for c in comparison]):
+        sys.exit(1)
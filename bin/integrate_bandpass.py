@@ -3,6 +3,8 @@ from PyAddgals.cosmology import Cosmology
 from PyAddgals.domain import Domain
 from PyAddgals.nBody import NBody
 from PyAddgals.addgalsModel import ADDGALSModel
+from PyAddgals.catalogIO import readCatalog, getCatalogColumns
+from PyAddgals.schema import addColumns
 
 from mpi4py import MPI
 from glob import glob
@@ -45,7 +47,11 @@ def main(config, outpath, magflag, clobber=False):
         if os.path.exists(fname) & (not clobber):
             continue
 
-        g = fitsio.read(f, columns=['SEDID', 'Z', 'MAG_R_EVOL', 'MU'])
+        columns = ['SEDID', 'Z', 'MAG_R_EVOL', 'MU']
+        g = readCatalog(f, columns=[c for c in columns if c in getCatalogColumns(f)])
+
+        # MU is filled in by lensing, and may not have been written
+        g = addColumns(g, ['MU'])
         mags = np.zeros(len(g), dtype=np.dtype([('TMAG', (np.float, nk)),
                                                 ('AMAG', (np.float, nk)),
                                                 ('LMAG', (np.float, nk)),
@@ -0,0 +1,43 @@
+from copy import copy
+import sys
+
+from PyAddgals.config import parseConfig
+from PyAddgals.cosmology import Cosmology
+from PyAddgals.domain import Domain
+from PyAddgals.nBody import NBody
+
+
+def make_halo_cache(cfg):
+    """Convert the lightcone halo catalogs and densities for every box
+    into the columnar cache read by HaloCatalog.readRockstarLightconeFile.
+    """
+
+    config = parseConfig(cfg)
+
+    cc = config['Cosmology']
+    nb_config = config['NBody']
+
+    cosmo = Cosmology(**cc)
+    d_config = nb_config.pop('Domain')
+
+    if 'cachepath' not in nb_config:
+        raise(ValueError('NBody: cachepath must be defined to make halo cache'))
+
+    domain = Domain(cosmo, **d_config)
+    domain.decomp(None, 0, 1)
+
+    d = domain.dummyDomain()
+
+    for boxnum in range(len(domain.lbox)):
+        db = copy(d)
+        db.boxnum = boxnum
+
+        nbody = NBody(cosmo, db, **nb_config)
+        nbody.haloCatalog.convertRockstarLightconeFile()
+
+
+if __name__ == '__main__':
+
+    cfg = sys.argv[1]
+
+    make_halo_cache(cfg)
@@ -9,6 +9,9 @@ import fitsio
 import yaml
 import sys
 
+from PyAddgals.catalogIO import readCatalog
+from PyAddgals.schema import addColumns
+
 
 def compute_lensing(g, shear, halos=False):
 
@@ -18,6 +21,10 @@ def compute_lensing(g, shear, halos=False):
     if not halos:
         lensfields.append("LMAG")
 
+        # columns filled in below, which may not have been written
+        # when the galaxies were painted
+        g = addColumns(g, ['LMAG', 'SIZE', 'EPSILON'])
+
     nmimg = 0
     adtype = []
     fields = []
@@ -162,7 +169,7 @@ def add_lensing(gfiles, sfiles):
         gfs = gf.split('/')
         gbase = "/".join(gfs[:-1])
 
-        g = fitsio.read(gf)
+        g = readCatalog(gf)
         shear = fitsio.read(sf)
 
         if 'halo' in gf:
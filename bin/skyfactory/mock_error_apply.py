@@ -12,6 +12,9 @@ import yaml
 import sys
 import os
 
+from PyAddgals.catalogIO import readCatalog
+from PyAddgals.schema import addColumns
+
 models = {
     'DR8':
         {'maglims':[20.425,21.749,21.239,20.769,19.344],
@@ -294,7 +297,7 @@ def apply_nonuniform_errormodel(g, oname, d, dhdr,
                                 refbands=None, zp=22.5):
     
     if magfile is not None:
-        mags = fitsio.read(magfile)
+        mags = readCatalog(magfile)
         if use_lmag:
             if ('LMAG' in mags.dtype.names) and (mags['LMAG']!=0).any():
                 imtag = 'LMAG'
@@ -503,7 +506,7 @@ def apply_uniform_errormodel(g, oname, survey, magfile=None, usemags=None,
                               refbands=None, zp=22.5):
     
     if magfile is not None:
-        mags = fitsio.read(magfile)
+        mags = readCatalog(magfile)
         if use_lmag:
             if ('LMAG' in mags.dtype.names) and (mags['LMAG']!=0).any():
                 imtag = 'LMAG'
@@ -794,7 +797,11 @@ if __name__ == "__main__":
             #if returns none, no galaxies in footprint
             if g is None: continue
         else:
-            g = fitsio.read(fname)
+            g = readCatalog(fname)
+
+        # observed columns may not have been written when the
+        # galaxies were painted
+        g = addColumns(g, ['OMAG', 'OMAGERR', 'FLUX', 'IVAR'])
 
         fs = fname.split('.')
         fp = fs[-2]
@@ -4,7 +4,8 @@ setup(
     name='pyaddgals',
     version='1.0',
     packages=['PyAddgals',],
-    scripts=['bin/addgals'],
+    scripts=['bin/addgals', 'bin/addgals-plan', 'bin/addgals-trace',
+             'bin/addgals-synth'],
     package_dir={'PyAddgals' : 'PyAddgals'},
     package_data={'PyAddgals': ['data/filters/*/*', 'data/templates/*']},
     long_description=open('README.md').read(),